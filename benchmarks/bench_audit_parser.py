@@ -0,0 +1,81 @@
+'''
+Compare audits/second of the precompiled audit detail parser against
+the previous split based implementation of
+EncodeFileTransfer._parse_audit_details_for_source_and_destination.
+
+    python -m benchmarks.bench_audit_parser --audits 100000
+'''
+import argparse
+import time
+from urllib.parse import urlparse
+
+from encode_file_transfer import EncodeFileTransfer
+
+from .records import make_audits
+
+
+def _legacy_parse_s3_to_bucket_and_key(s3_uri):
+    parsed_s3uri = urlparse(s3_uri)
+    return {'Bucket': parsed_s3uri.netloc, 'Key': parsed_s3uri.path[1:]}
+
+
+def legacy_parse_audit_details(parsed_audits):
+    accession, audit_detail = parsed_audits[:2]
+    status = audit_detail.split('Move')[1].split(' ')[1]
+    audit_split = audit_detail.split(' to ')
+    source_s3_uri_parsed = _legacy_parse_s3_to_bucket_and_key(
+        audit_split[0].split(' from ')[-1]
+    )
+    destination_s3_uri_parsed = _legacy_parse_s3_to_bucket_and_key(
+        audit_split[-1]
+    )
+    return {
+        'accession': accession,
+        'status': status,
+        'source_bucket': source_s3_uri_parsed.get('Bucket'),
+        'source_key': source_s3_uri_parsed.get('Key'),
+        'destination_bucket': destination_s3_uri_parsed.get('Bucket'),
+        'destination_key': destination_s3_uri_parsed.get('Key'),
+    }
+
+
+def run(parse, audits, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        files = [parse(audit) for audit in audits]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return files, len(audits) / best
+
+
+def _locations(files):
+    # The legacy parser only keeps the first word of the status.
+    return [
+        {k: v for k, v in f.items() if k != 'status'}
+        for f in files
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--audits', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    audits = make_audits(args.audits)
+    eft = EncodeFileTransfer('https://localhost')
+    legacy_files, legacy_rate = run(legacy_parse_audit_details, audits, args.repeat)
+    compiled_files, compiled_rate = run(
+        eft._parse_audit_details_for_source_and_destination,
+        audits,
+        args.repeat
+    )
+    assert _locations(legacy_files) == _locations(compiled_files), 'Parsed output differs'
+    print('audits\t{}'.format(args.audits))
+    print('legacy\t{:.0f} audits/s'.format(legacy_rate))
+    print('compiled\t{:.0f} audits/s'.format(compiled_rate))
+    print('speedup\t{:.2f}x'.format(compiled_rate / legacy_rate))
+
+
+if __name__ == '__main__':
+    main()
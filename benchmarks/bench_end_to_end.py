@@ -0,0 +1,253 @@
+'''
+End-to-end throughput of sync and metadata runs against a local fake
+portal and an S3 stand-in. Each scenario runs in a fresh process, with
+the portal in a process of its own, and reports files/second, portal
+and S3 requests issued, peak RSS of the client process and how much of
+it the run itself added on top of the S3 stand-in's setup.
+
+    python -m benchmarks.bench_end_to_end --files 1000 10000 100000
+    python -m benchmarks.bench_end_to_end --runs sync --s3 moto --json results.json
+
+--s3 fake (default) uses an in-memory client. --s3 moto starts moto's
+S3 server (pip install 'moto[server]') and talks to it over HTTP, which
+is much slower but exercises botocore and s3transfer.
+'''
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import socket
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from .fake_portal import FakePortal
+from .fake_s3 import FakeS3
+from .records import (
+    make_audit_record,
+    make_audit_records,
+    make_file_records,
+)
+
+
+def _peak_rss_mb():
+    # Linux reports KiB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+
+
+def _parse_detail(detail):
+    source, destination = detail.split(' from s3://')[1].split(' to s3://')
+    return source.split('/', 1), destination.split('/', 1)
+
+
+class MotoS3():
+    '''
+    moto S3 server with request counts taken from botocore events.
+    '''
+
+    def __init__(self):
+        from moto.server import ThreadedMotoServer
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        self.server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+        self.server.start()
+        self.endpoint_url = 'http://127.0.0.1:{}'.format(port)
+        self.requests = Counter()
+        self.buckets = set()
+        self.client = None
+
+    def count(self, model, **kwargs):
+        self.requests[model.name] += 1
+
+    def attach(self, client):
+        self.client = client
+        client.meta.events.register('before-call.s3', self.count)
+
+    def put(self, bucket, key, size):
+        if bucket not in self.buckets:
+            self.client.create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+            )
+            self.buckets.add(bucket)
+        # Object bodies are kept small, sizes only matter for the fake.
+        self.client.put_object(Bucket=bucket, Key=key, Body=b'0' * min(size, 1024))
+
+    def stop(self):
+        self.server.stop()
+
+
+def _make_s3(backend, eft, s3_latency):
+    if backend == 'moto':
+        s3 = MotoS3()
+        eft.s3h.endpoint_url = s3.endpoint_url
+        s3.attach(eft.s3h._get_client())
+        return s3
+    s3 = FakeS3(latency=s3_latency)
+    eft.s3h._client = s3
+    return s3
+
+
+def serve_portal(run, files, latency, result_latency, conn):
+    '''
+    Serves a fake portal until told to stop, then sends back its request
+    counts. Runs in its own process so the catalog and response encoding
+    don't count towards the client's memory.
+    '''
+    logging.getLogger().setLevel(logging.ERROR)
+    if run == 'sync':
+        portal = FakePortal(audits=make_audit_records(files), latency=latency, result_latency=result_latency)
+    else:
+        portal = FakePortal(files=make_file_records(files), latency=latency, result_latency=result_latency)
+    with portal:
+        conn.send(portal.url)
+        conn.recv()
+        conn.send(dict(portal.requests))
+
+
+class PortalProcess():
+
+    def __init__(self, run, files, latency, result_latency):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=serve_portal,
+            args=(run, files, latency, result_latency, child_conn),
+            daemon=True
+        )
+        self.url = None
+        self.requests = {}
+
+    def __enter__(self):
+        self.process.start()
+        self.url = self.conn.recv()
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.send('stop')
+        self.requests = self.conn.recv()
+        self.process.join()
+        return False
+
+
+def _seed_s3(s3, files):
+    # Same records the portal serves, made one at a time so they don't
+    # raise the client's peak RSS.
+    rng = random.Random(0)
+    for i in range(files):
+        audit = make_audit_record(i, rng)
+        (sb, sk), _ = _parse_detail(audit['audit']['INTERNAL_ACTION'][0]['detail'])
+        s3.put(sb, sk, audit['file_size'])
+
+
+def run_scenario(run, files, workers, portal_latency, s3_latency, backend, export_workers=1, result_latency=0, verbose=False):
+    from encode_file_transfer import EncodeFileTransfer
+    if not verbose:
+        logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory:
+        portal = PortalProcess(run, files, portal_latency, result_latency)
+        with portal:
+            eft = EncodeFileTransfer(
+                portal.url,
+                portal_creds=('key', 'secret'),
+                aws_creds=('key', 'secret'),
+                batch_size='all',
+                workers=workers,
+                patch_workers=workers,
+                patch_rate=None,
+                export_workers=export_workers,
+                manifest_path='{}/igvf_file_manifest.tsv'.format(directory),
+            )
+            s3 = _make_s3(backend, eft, s3_latency)
+            try:
+                if run == 'sync':
+                    _seed_s3(s3, files)
+                setup_requests = sum(s3.requests.values())
+                gc.collect()
+                setup_rss = _rss_mb()
+                start = time.perf_counter()
+                if run == 'sync':
+                    eft.sync_buckets_and_portal()
+                else:
+                    eft.dump_file_metadata_to_s3()
+                elapsed = time.perf_counter() - start
+                peak_rss = _peak_rss_mb()
+            finally:
+                if backend == 'moto':
+                    s3.stop()
+        summary = eft.metrics.summary()
+        return {
+            'run': run,
+            's3': backend,
+            'files': files,
+            'workers': workers,
+            'export_workers': export_workers,
+            'seconds': elapsed,
+            'files_per_second': files / elapsed,
+            'portal_requests': portal.requests,
+            's3_requests': sum(s3.requests.values()) - setup_requests,
+            'peak_rss_mb': peak_rss,
+            'run_rss_mb': max(0, peak_rss - setup_rss),
+            'stages': {
+                stage: {'count': histogram['count'], 'seconds': histogram['sum']}
+                for stage, histogram in summary['stages'].items()
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', nargs='+', choices=['sync', 'metadata'], default=['sync', 'metadata'])
+    parser.add_argument('--files', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--export-workers', type=int, default=1, help='Concurrent metadata searches')
+    parser.add_argument('--portal-latency', type=float, default=0, help='Seconds added to each portal request')
+    parser.add_argument('--result-latency', type=float, default=0, help='Seconds added to portal searches per result returned')
+    parser.add_argument('--s3-latency', type=float, default=0, help='Seconds added to each fake S3 request')
+    parser.add_argument('--s3', choices=['fake', 'moto'], default='fake')
+    parser.add_argument('--json', help='Also write results to this path')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    results = []
+    context = multiprocessing.get_context('spawn')
+    print('run\tfiles\tworkers\tseconds\tfiles/s\tportal requests\ts3 requests\tpeak RSS MiB\trun RSS MiB')
+    for run in args.runs:
+        for files in args.files:
+            # Fresh process so peak RSS belongs to this scenario.
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(
+                    run_scenario,
+                    run,
+                    files,
+                    args.workers,
+                    args.portal_latency,
+                    args.s3_latency,
+                    args.s3,
+                    args.export_workers,
+                    args.result_latency,
+                    args.verbose,
+                ).result()
+            results.append(result)
+            print(
+                '{run}\t{files}\t{workers}\t{seconds:.2f}\t{files_per_second:.0f}\t{portal}\t{s3_requests}\t{peak_rss_mb:.0f}\t{run_rss_mb:.0f}'.format(
+                    portal=sum(result['portal_requests'].values()),
+                    **result
+                )
+            )
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''
+Compare records/second of the compiled FieldPathExtractor against the
+previous per-record implementation of EncodePortalHelper._flatten_json.
+
+    python -m benchmarks.bench_flatten --records 100000
+'''
+import argparse
+import time
+
+from encode_file_transfer.interface import FILE_METADATA_FIELDS
+from encode_file_transfer.portal import FieldPathExtractor
+
+from .records import make_file_records
+
+
+def _legacy_flatten_list(values):
+    if isinstance(values, list):
+        for value in values:
+            yield from _legacy_flatten_list(value)
+    else:
+        yield values
+
+
+def legacy_flatten_json(data, fields=FILE_METADATA_FIELDS):
+    flattened_data = {}
+    for field in fields:
+        path = field.split('.')
+        v = data
+        for p in path:
+            if isinstance(v, list):
+                v = list(_legacy_flatten_list([x.get(p) for x in v]))
+            else:
+                v = v.get(p)
+            if not v:
+                break
+        flattened_data[field] = v
+    return flattened_data
+
+
+def run(flatten, records, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = [flatten(record) for record in records]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return rows, len(records) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    records = make_file_records(args.records)
+    legacy_rows, legacy_rate = run(legacy_flatten_json, records, args.repeat)
+    compiled_rows, compiled_rate = run(FieldPathExtractor(FILE_METADATA_FIELDS), records, args.repeat)
+    assert legacy_rows == compiled_rows, 'Flattened output differs'
+    print('records\t{}'.format(args.records))
+    print('legacy\t{:.0f} records/s'.format(legacy_rate))
+    print('compiled\t{:.0f} records/s'.format(compiled_rate))
+    print('speedup\t{:.2f}x'.format(compiled_rate / legacy_rate))
+
+
+if __name__ == '__main__':
+    main()
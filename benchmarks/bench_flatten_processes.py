@@ -0,0 +1,81 @@
+'''
+Scaling of metadata export across flattening process counts. Pages of
+a fake portal search (served from its own process) are fetched with
+EncodePortalHelper.iter_file_metadata, one process decoding and
+flattening in the calling thread, more on a process pool. CPU time of
+this process bounds the speedup more processes can give, even on a
+machine with fewer cores than processes.
+
+    python -m benchmarks.bench_flatten_processes --files 200000 --processes 1 2 4 8
+'''
+import argparse
+import multiprocessing
+import os
+import time
+
+from encode_file_transfer import EncodePortalHelper
+
+from .fake_portal import FakePortal
+from .records import make_file_records
+
+
+def serve(files, conn):
+    with FakePortal(files=make_file_records(files)) as portal:
+        conn.send(portal.url)
+        conn.recv()
+
+
+def run(url, processes, page_size, repeat):
+    best = None
+    best_cpu = None
+    eph = EncodePortalHelper(
+        url,
+        portal_creds=('key', 'secret'),
+        batch_size='all',
+        page_size=page_size,
+        flatten_processes=processes,
+    )
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            start_cpu = time.process_time()
+            rows = list(eph.iter_file_metadata())
+            cpu = time.process_time() - start_cpu
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    finally:
+        eph.close()
+    return rows, len(rows) / best, best_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=200000)
+    parser.add_argument('--processes', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--page-size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    server = context.Process(target=serve, args=(args.files, child_conn), daemon=True)
+    server.start()
+    url = conn.recv()
+    try:
+        print('files\t{}\tcpus\t{}\tpage size\t{}'.format(args.files, os.cpu_count(), args.page_size))
+        print('processes\tfiles/s\tspeedup\tmain process cpu s')
+        expected = None
+        baseline = None
+        for processes in args.processes:
+            rows, rate, cpu = run(url, processes, args.page_size, args.repeat)
+            if expected is None:
+                expected, baseline = rows, rate
+            assert rows == expected, 'Flattened output differs'
+            print('{}\t{:.0f}\t{:.2f}x\t{:.2f}'.format(processes, rate, rate / baseline, cpu))
+    finally:
+        conn.send('stop')
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
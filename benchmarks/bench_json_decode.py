@@ -0,0 +1,76 @@
+'''
+Decode time and peak memory of a metadata search response with each
+installed JSON decoder and with streaming (ijson), flattening rows as
+they're decoded. Peak memory is traced Python allocations on top of the
+response body.
+
+    python -m benchmarks.bench_json_decode --files 100000
+'''
+import argparse
+import gc
+import io
+import json
+import time
+import tracemalloc
+
+from encode_file_transfer import decoders
+from encode_file_transfer.interface import (
+    FILE_METADATA_FIELDS,
+    STREAM_BATCH_SIZE,
+)
+from encode_file_transfer.portal import FieldPathExtractor
+
+from .records import make_file_records
+
+
+def decode_whole(decode, body, extractor):
+    return sum(1 for data in decode(body)['@graph'] if extractor(data))
+
+
+def decode_streamed(body, extractor, batch_size):
+    count = 0
+    for batch in decoders.iter_json_items(io.BytesIO(body), '@graph.item', batch_size):
+        count += sum(1 for data in batch if extractor(data))
+    return count
+
+
+def measure(fn):
+    # Timed and traced separately since tracing slows decoding down.
+    gc.collect()
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=STREAM_BATCH_SIZE)
+    args = parser.parse_args()
+    records = make_file_records(args.files)
+    body = json.dumps({'@graph': records, 'total': len(records)}).encode()
+    del records
+    extractor = FieldPathExtractor(FILE_METADATA_FIELDS)
+    runs = {
+        name: (lambda decode=decoders.get_decoder(name): decode_whole(decode, body, extractor))
+        for name in ['json', 'orjson', 'msgspec']
+        if name == 'json' or getattr(decoders, name) is not None
+    }
+    if decoders.ijson is not None:
+        runs['ijson stream'] = lambda: decode_streamed(body, extractor, args.batch_size)
+    print('files\t{}\tresponse MiB\t{:.0f}'.format(args.files, len(body) / 1024 ** 2))
+    print('decoder\tseconds\tfiles/s\tpeak MiB')
+    for name, fn in runs.items():
+        count, elapsed, peak = measure(fn)
+        assert count == args.files
+        print('{}\t{:.2f}\t{:.0f}\t{:.0f}'.format(name, elapsed, count / elapsed, peak))
+
+
+if __name__ == '__main__':
+    main()
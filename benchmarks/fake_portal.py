@@ -0,0 +1,162 @@
+'''
+In-process stand-in for the portal endpoints used by sync and metadata
+runs: /search/ (incorrect bucket audits, file metadata and @id only
+searches with from/limit paging, filters and facets on facet_fields),
+/indexer-info and @@update_bucket. Served over HTTP on localhost with
+optional per request latency.
+'''
+import json
+import threading
+import time
+from collections import Counter
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from urllib.parse import (
+    parse_qs,
+    urlsplit,
+)
+
+
+class FakePortal():
+
+    def __init__(self, audits=(), files=(), latency=0, result_latency=0, indexing=False, facet_fields=('file_format',)):
+        self.audits = list(audits)
+        self.files = list(files)
+        self.facet_fields = list(facet_fields)
+        self.latency = latency
+        # Seconds per search result, like server side time growing with
+        # result size.
+        self.result_latency = result_latency
+        self.indexing = indexing
+        self.requests = Counter()
+        self.patched = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return 'http://{}:{}/'.format(host, port)
+
+    def _count(self, name):
+        with self.lock:
+            self.requests[name] += 1
+
+    @staticmethod
+    def _page(results, params):
+        start = int(params.get('from', ['0'])[0])
+        limit = params.get('limit', ['25'])[0]
+        if limit == 'all':
+            return results[start:]
+        return results[start:start + int(limit)]
+
+    def _facets(self, results):
+        facets = []
+        for field in self.facet_fields:
+            terms = Counter(result.get(field) for result in results if result.get(field) is not None)
+            facets.append(
+                {
+                    'field': field,
+                    'terms': [
+                        {'key': key, 'doc_count': count}
+                        for key, count in terms.most_common()
+                    ],
+                }
+            )
+        return facets
+
+    def search(self, query):
+        '''
+        Returns (page of results, total, facets).
+        '''
+        params = parse_qs(query)
+        if 'audit.INTERNAL_ACTION.category' in params:
+            results = self.audits
+        else:
+            results = self.files
+        for field in self.facet_fields:
+            if field in params:
+                results = [result for result in results if result.get(field) in params[field]]
+        page = self._page(results, params)
+        if params.get('field') == ['@id']:
+            page = [{'@id': result['@id']} for result in page]
+        return page, len(results), self._facets(results)
+
+    def patch(self, path, body):
+        accession = path.rsplit('/@@update_bucket', 1)[0]
+        with self.lock:
+            self.patched[accession] = body.get('new_bucket')
+
+    def _make_handler(self):
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open like the real portal and don't let
+            # Nagle's algorithm delay small responses.
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if portal.latency:
+                    time.sleep(portal.latency)
+                url = urlsplit(self.path)
+                if url.path.rstrip('/') == '/indexer-info':
+                    portal._count('indexer-info')
+                    self._send(200, {'is_indexing': portal.indexing})
+                    return
+                if url.path == '/search/':
+                    portal._count('search')
+                    results, total, facets = portal.search(url.query)
+                    if portal.result_latency:
+                        time.sleep(portal.result_latency * len(results))
+                    if not total:
+                        self._send(404, {'@graph': [], 'total': 0, 'notification': 'No results found'})
+                        return
+                    self._send(200, {'@graph': results, 'total': total, 'facets': facets})
+                    return
+                self._send(404, {})
+
+            def do_PATCH(self):
+                if portal.latency:
+                    time.sleep(portal.latency)
+                url = urlsplit(self.path)
+                if not url.path.endswith('@@update_bucket'):
+                    self._send(404, {})
+                    return
+                portal._count('update_bucket')
+                length = int(self.headers.get('Content-Length', 0))
+                portal.patch(url.path, json.loads(self.rfile.read(length) or b'{}'))
+                self._send(200, {'status': 'success'})
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
@@ -0,0 +1,103 @@
+'''
+In-memory stand-in for the S3 client calls s3Helper makes, with optional
+per request latency and request counts. Set it as s3Helper._client. For
+a real S3 API use moto's server and s3Helper(endpoint_url=...).
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+class FakePaginator():
+
+    def __init__(self, s3, operation):
+        self.s3 = s3
+        self.operation = operation
+
+    def paginate(self, Bucket, Prefix=''):
+        self.s3._call(self.operation)
+        with self.s3.lock:
+            contents = [
+                {'Key': key, 'Size': obj['ContentLength'], 'ETag': obj['ETag']}
+                for (bucket, key), obj in sorted(self.s3.objects.items())
+                if bucket == Bucket and key.startswith(Prefix)
+            ]
+        yield {'Contents': contents}
+
+
+class FakeS3():
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.objects = {}
+        self.tags = {}
+        self.requests = Counter()
+        self.bytes_copied = 0
+        self.lock = threading.Lock()
+
+    def _call(self, operation):
+        with self.lock:
+            self.requests[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, bucket, key, size, etag=None):
+        if etag is None:
+            etag = '"{}"'.format(hashlib.md5('{}/{}'.format(bucket, key).encode()).hexdigest())
+        with self.lock:
+            self.objects[(bucket, key)] = {'ContentLength': size, 'ETag': etag}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('HeadObject')
+        with self.lock:
+            obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return dict(obj, Metadata=obj.get('Metadata', {}))
+
+    def copy(self, CopySource, Bucket, Key, Config=None, **kwargs):
+        source = self.head_object(**CopySource)
+        parts = 1
+        if Config is not None and source['ContentLength'] >= Config.multipart_threshold:
+            parts = -(-source['ContentLength'] // Config.multipart_chunksize)
+        for _ in range(parts):
+            self._call('CopyObject' if parts == 1 else 'UploadPartCopy')
+        with self.lock:
+            self.objects[(Bucket, Key)] = {
+                'ContentLength': source['ContentLength'],
+                'ETag': source['ETag'],
+            }
+            self.bytes_copied += source['ContentLength']
+
+    def delete_objects(self, Bucket, Delete):
+        self._call('DeleteObjects')
+        with self.lock:
+            for obj in Delete['Objects']:
+                self.objects.pop((Bucket, obj['Key']), None)
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self._call('DeleteObject')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+
+    def put_object_tagging(self, Bucket, Key, Tagging):
+        self._call('PutObjectTagging')
+        with self.lock:
+            self.tags[(Bucket, Key)] = Tagging
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        self._call('PutObject')
+        with self.lock:
+            self.objects[(Bucket, Key)] = {
+                'ContentLength': os.path.getsize(Filename),
+                'ETag': '"upload"',
+                'Metadata': (ExtraArgs or {}).get('Metadata', {}),
+            }
+
+    def get_paginator(self, operation):
+        return FakePaginator(self, 'ListObjectsV2')
@@ -0,0 +1,130 @@
+'''
+Synthetic portal records shaped like IGVF file search results.
+'''
+import random
+
+
+FILE_FORMATS = ['bam', 'bed', 'fastq', 'tsv', 'vcf', 'hdf5', 'bigWig']
+ASSEMBLIES = ['GRCh38', 'GRCm39', None]
+
+
+def make_accession(i, prefix='IGVFFI'):
+    '''
+    Unique accession for i below 10000 * 26 ** 4.
+    '''
+    letters = ''
+    n = i // 10000
+    for _ in range(4):
+        n, r = divmod(n, 26)
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'[r] + letters
+    return '{}{:04d}{}'.format(prefix, i % 10000, letters)
+
+
+def make_file_record(i, rng=random):
+    accession = make_accession(i)
+    n_samples = rng.randint(0, 3)
+    return {
+        '@id': '/files/{}/'.format(accession),
+        'href': '/files/{0}/@@download/{0}.bam'.format(accession),
+        'accession': accession,
+        'file_format': rng.choice(FILE_FORMATS),
+        'content_type': 'alignments',
+        'summary': 'alignments of {} reads'.format(rng.randint(1, 10 ** 6)),
+        'file_set': {
+            'accession': 'IGVFDS{:04d}AAAA'.format(i % 2000),
+            'file_set_type': 'experimental data',
+            'lab': {'title': 'Lab {}'.format(i % 50)},
+            'donors': [
+                {'accession': 'IGVFDO{:04d}AAAA'.format(j)}
+                for j in range(rng.randint(0, 2))
+            ],
+            'samples': [
+                {
+                    'accession': 'IGVFSM{:04d}AAAA'.format(j),
+                    'summary': 'sample {}'.format(j),
+                    'sample_terms': [
+                        {'term_name': 'K562'},
+                        {'term_name': 'HepG2'},
+                    ][:rng.randint(1, 2)],
+                }
+                for j in range(n_samples)
+            ],
+        },
+        'assay_titles': ['ATAC-seq'],
+        'creation_timestamp': '2024-01-01T00:00:00.000000+00:00',
+        'file_size': rng.randint(1, 10 ** 11),
+        's3_uri': 's3://igvf-files/2024/01/01/{}/{}.bam'.format(i, accession),
+        'assembly': rng.choice(ASSEMBLIES),
+        'md5sum': '{:032x}'.format(rng.getrandbits(128)),
+        'derived_from': ['/files/IGVFFI0000AAAA/'] if i % 3 else [],
+        'status': 'released',
+        'upload_status': 'validated',
+        'sequencing_platform': {'term_name': 'Illumina NovaSeq 6000'},
+        'workflows': [{'accession': 'IGVFWF0000AAAA'}],
+    }
+
+
+def make_file_records(n, seed=0):
+    rng = random.Random(seed)
+    return [make_file_record(i, rng) for i in range(n)]
+
+
+AUDIT_STATUSES = ['released', 'in progress', 'revoked', 'archived', 'deleted']
+
+
+def make_audit(i, rng=random):
+    '''
+    Parsed incorrect file bucket audit, i.e. (@id, detail).
+    '''
+    accession = make_accession(i)
+    key = '2024/{:02d}/{:02d}/{:08x}-{:04x}/{}.bam'.format(
+        rng.randint(1, 12),
+        rng.randint(1, 28),
+        rng.getrandbits(32),
+        rng.getrandbits(16),
+        accession
+    )
+    source, destination = rng.sample(['igvf-files', 'igvf-public', 'igvf-private'], 2)
+    detail = 'Move {} file {} from s3://{}/{} to s3://{}/{}'.format(
+        rng.choice(AUDIT_STATUSES),
+        accession,
+        source,
+        key,
+        destination,
+        key
+    )
+    return ('/files/{}/'.format(accession), detail)
+
+
+def make_audits(n, seed=0):
+    rng = random.Random(seed)
+    return [make_audit(i, rng) for i in range(n)]
+
+
+def make_audit_record(i, rng=random):
+    '''
+    File search result with an incorrect file bucket audit, as returned
+    by the sync audit search.
+    '''
+    file_id, detail = make_audit(i, rng)
+    return {
+        '@id': file_id,
+        'md5sum': '{:032x}'.format(rng.getrandbits(128)),
+        'file_size': rng.randint(1, 10 ** 9),
+        'audit': {
+            'INTERNAL_ACTION': [
+                {
+                    'category': 'incorrect file bucket',
+                    'detail': detail,
+                    'level': 30,
+                    'level_name': 'INTERNAL_ACTION',
+                    'path': file_id,
+                }
+            ]
+        },
+    }
+
+
+def make_audit_records(n, seed=0):
+    rng = random.Random(seed)
+    return [make_audit_record(i, rng) for i in range(n)]
@@ -1,6 +1,7 @@
 import argparse
 import os
 import ast
+import json
 
 import boto3
 from encode_file_transfer import EncodeFileTransfer
@@ -9,18 +10,52 @@ from encode_file_transfer.interface import (
     AWS_DEFAULT_REGION,
     PORTAL_CREDS,
     AWS_CREDS,
-    DEFAULT_MAIN_ARG
+    DEFAULT_MAIN_ARG,
+    WORKERS,
+    LARGE_FILE_THRESHOLD,
+    MAX_POOL_CONNECTIONS,
+    MULTIPART_THRESHOLD,
+    MULTIPART_CHUNKSIZE,
+    MAX_CONCURRENCY,
+    PORTAL_RETRIES,
+    PORTAL_BACKOFF_FACTOR,
+    MANIFEST_BUFFER_SIZE,
+    LOCAL_SNAPSHOT,
+    LOCAL_CACHE,
+    CACHE_TTL,
+    CACHE_MAX_BYTES,
+    MANIFEST_FORMATS,
+    LOCAL_JOURNAL,
+    EXPORT_WORKERS,
+    EXPORT_PARTITION_FIELD,
+    FLATTEN_PROCESSES,
+    JSON_DECODER,
+    JSON_DECODERS,
+    PATCH_WORKERS,
+    PATCH_RATE,
+    PATCH_BURST,
+    INDEXER_WAIT_INITIAL,
+    INDEXER_WAIT_MAX,
+    INDEXER_WAIT_DEADLINE,
 )
 
 
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'run_type',
         nargs='?',
-        choices=['sync', 'metadata'],
+        choices=['sync', 'metadata', 'plan'],
         default=DEFAULT_MAIN_ARG,
-        help='Type of operation to run (sync or metadata)'
+        help='Type of operation to run (sync, metadata or plan, a dry run of sync)'
+    )
+    parser.add_argument(
+        '--plan-file',
+        help='Write the plan to this path, as JSON if it ends with .json and per file TSV otherwise',
     )
     parser.add_argument(
         '--query-filter',
@@ -54,6 +89,218 @@ def get_args():
         default='all',
         help='Batch size for processing',
     )
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        help='Fetch search results in pages of this size instead of one request',
+    )
+    parser.add_argument(
+        '--export-workers',
+        default=EXPORT_WORKERS,
+        type=int,
+        help='Concurrent metadata searches, split by --partition-field facet terms (default: {})'.format(EXPORT_WORKERS),
+    )
+    parser.add_argument(
+        '--partition-field',
+        default=EXPORT_PARTITION_FIELD,
+        help='Faceted field to split the metadata search by (default: {})'.format(EXPORT_PARTITION_FIELD),
+    )
+    parser.add_argument(
+        '--flatten-processes',
+        default=FLATTEN_PROCESSES,
+        type=int,
+        help='Processes decoding and flattening metadata search pages, requires --page-size (default: {})'.format(FLATTEN_PROCESSES),
+    )
+    parser.add_argument(
+        '--json-decoder',
+        default=JSON_DECODER,
+        choices=JSON_DECODERS,
+        help='Decoder for portal search responses, auto uses msgspec or orjson if installed (default: {})'.format(JSON_DECODER),
+    )
+    parser.add_argument(
+        '--stream-searches',
+        action='store_true',
+        help='Decode search results as they download instead of holding whole responses (requires ijson)',
+    )
+    parser.add_argument(
+        '--manifest-buffer-size',
+        default=MANIFEST_BUFFER_SIZE,
+        type=int,
+        help='Manifest rows sorted in memory before spilling to disk (default: {})'.format(MANIFEST_BUFFER_SIZE),
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Update a local metadata snapshot with files modified since the last run instead of fetching every file',
+    )
+    parser.add_argument(
+        '--snapshot-path',
+        default=LOCAL_SNAPSHOT,
+        help='Local metadata snapshot for --incremental (default: {})'.format(LOCAL_SNAPSHOT),
+    )
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help='Cache portal search responses on disk so reruns can skip or revalidate them',
+    )
+    parser.add_argument(
+        '--cache-path',
+        default=LOCAL_CACHE,
+        help='Directory for --cache (default: {})'.format(LOCAL_CACHE),
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        default=CACHE_TTL,
+        type=float,
+        help='Seconds cached responses are used before being revalidated (default: {})'.format(CACHE_TTL),
+    )
+    parser.add_argument(
+        '--cache-max-gb',
+        default=CACHE_MAX_BYTES / GB,
+        type=float,
+        help='Size in GiB past which least recently used responses are evicted (default: {:g})'.format(CACHE_MAX_BYTES / GB),
+    )
+    parser.add_argument(
+        '--force-upload',
+        action='store_true',
+        help='Upload the metadata manifest even if it is unchanged',
+    )
+    parser.add_argument(
+        '--manifest-formats',
+        nargs='*',
+        default=[],
+        choices=list(MANIFEST_FORMATS),
+        help='Extra manifest formats to upload next to the TSV',
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help='Write a JSON summary of run counters and stage timings to this path',
+    )
+    parser.add_argument(
+        '--prometheus-file',
+        help='Write run metrics in Prometheus text format to this path, e.g. for the node exporter textfile collector',
+    )
+    parser.add_argument(
+        '--workers',
+        default=WORKERS,
+        type=int,
+        help='Number of files to sync concurrently (default: {})'.format(WORKERS),
+    )
+    parser.add_argument(
+        '--large-file-threshold-gb',
+        default=LARGE_FILE_THRESHOLD // GB,
+        type=float,
+        help='Size in GiB from which files only run on the large file workers (default: {})'.format(LARGE_FILE_THRESHOLD // GB),
+    )
+    parser.add_argument(
+        '--large-file-workers',
+        type=int,
+        help='Workers that copy large files, largest first, before helping with small files (default: a quarter of --workers, at least 1)',
+    )
+    parser.add_argument(
+        '--max-pool-connections',
+        type=int,
+        help='Size of the shared S3 connection pool (default: larger of {} and --workers times --max-concurrency)'.format(MAX_POOL_CONNECTIONS),
+    )
+    parser.add_argument(
+        '--multipart-threshold-mb',
+        default=MULTIPART_THRESHOLD // MB,
+        type=int,
+        help='Size in MiB above which S3 copies and uploads use multipart (default: {})'.format(MULTIPART_THRESHOLD // MB),
+    )
+    parser.add_argument(
+        '--multipart-chunksize-mb',
+        default=MULTIPART_CHUNKSIZE // MB,
+        type=int,
+        help='Minimum multipart part size in MiB, raised for large objects (default: {})'.format(MULTIPART_CHUNKSIZE // MB),
+    )
+    parser.add_argument(
+        '--max-concurrency',
+        default=MAX_CONCURRENCY,
+        type=int,
+        help='Threads used by each multipart S3 transfer (default: {})'.format(MAX_CONCURRENCY),
+    )
+    parser.add_argument(
+        '--inventory',
+        action='store_true',
+        help='List source and destination prefixes up front instead of checking each file with HEAD (needs s3:ListBucket)',
+    )
+    parser.add_argument(
+        '--no-verify',
+        dest='verify',
+        action='store_false',
+        help='Delete sources without checking copies and use size based part sizes',
+    )
+    parser.add_argument(
+        '--strict-verify',
+        action='store_true',
+        help='Fail files whose copies can only be verified by size',
+    )
+    parser.add_argument(
+        '--journal-path',
+        default=LOCAL_JOURNAL,
+        help='Journal of completed sync steps used to resume interrupted runs (default: {})'.format(LOCAL_JOURNAL),
+    )
+    parser.add_argument(
+        '--no-journal',
+        dest='journal_path',
+        action='store_const',
+        const=None,
+        help='Do not keep a sync journal',
+    )
+    parser.add_argument(
+        '--indexer-wait-initial',
+        default=INDEXER_WAIT_INITIAL,
+        type=float,
+        help='Seconds before checking the portal indexer again, doubled after each check (default: {})'.format(INDEXER_WAIT_INITIAL),
+    )
+    parser.add_argument(
+        '--indexer-wait-max',
+        default=INDEXER_WAIT_MAX,
+        type=float,
+        help='Longest wait in seconds between indexer checks (default: {})'.format(INDEXER_WAIT_MAX),
+    )
+    parser.add_argument(
+        '--indexer-wait-deadline',
+        default=INDEXER_WAIT_DEADLINE,
+        type=float,
+        help='Total seconds to wait for the indexer before giving up (default: {})'.format(INDEXER_WAIT_DEADLINE),
+    )
+    parser.add_argument(
+        '--s3-while-indexing',
+        action='store_true',
+        help='Copy files while the portal indexes and only wait for the indexer before deleting and patching',
+    )
+    parser.add_argument(
+        '--patch-workers',
+        default=PATCH_WORKERS,
+        type=int,
+        help='Number of concurrent portal bucket updates (default: {})'.format(PATCH_WORKERS),
+    )
+    parser.add_argument(
+        '--patch-rate',
+        default=PATCH_RATE,
+        type=float,
+        help='Average portal bucket updates per second, 0 for unlimited (default: {})'.format(PATCH_RATE),
+    )
+    parser.add_argument(
+        '--patch-burst',
+        default=PATCH_BURST,
+        type=int,
+        help='Portal bucket updates allowed in a burst above --patch-rate (default: {})'.format(PATCH_BURST),
+    )
+    parser.add_argument(
+        '--portal-retries',
+        default=PORTAL_RETRIES,
+        type=int,
+        help='Retries on portal connection errors and 429/5xx responses (default: {})'.format(PORTAL_RETRIES),
+    )
+    parser.add_argument(
+        '--portal-backoff-factor',
+        default=PORTAL_BACKOFF_FACTOR,
+        type=float,
+        help='Exponential backoff factor in seconds between portal retries (default: {})'.format(PORTAL_BACKOFF_FACTOR),
+    )
     args = parser.parse_args()
     if not args.portal_key or not args.portal_secret_key:
         raise ValueError('Portal credentials must be provided via environment variables or command line arguments')
@@ -80,11 +327,52 @@ def main():
         portal_creds=(args.portal_key, args.portal_secret_key),
         aws_creds=(args.access_key, args.secret_access_key),
         query_filter=args.query_filter,
+        page_size=args.page_size,
+        manifest_buffer_size=args.manifest_buffer_size,
+        export_workers=args.export_workers,
+        partition_field=args.partition_field,
+        flatten_processes=args.flatten_processes,
+        json_decoder=args.json_decoder,
+        stream=args.stream_searches,
+        incremental=args.incremental,
+        snapshot_path=args.snapshot_path,
+        cache_path=args.cache_path if args.cache else None,
+        cache_ttl=args.cache_ttl,
+        cache_max_bytes=int(args.cache_max_gb * GB),
+        force_upload=args.force_upload,
+        manifest_formats=args.manifest_formats,
+        metrics_file=args.metrics_file,
+        prometheus_file=args.prometheus_file,
+        workers=args.workers,
+        large_file_threshold=int(args.large_file_threshold_gb * GB),
+        large_file_workers=args.large_file_workers,
+        max_pool_connections=args.max_pool_connections,
+        multipart_threshold=args.multipart_threshold_mb * MB,
+        multipart_chunksize=args.multipart_chunksize_mb * MB,
+        max_concurrency=args.max_concurrency,
+        inventory=args.inventory,
+        verify=args.verify,
+        strict_verify=args.strict_verify,
+        journal_path=args.journal_path,
+        indexer_wait_initial=args.indexer_wait_initial,
+        indexer_wait_max=args.indexer_wait_max,
+        indexer_wait_deadline=args.indexer_wait_deadline,
+        s3_while_indexing=args.s3_while_indexing,
+        patch_workers=args.patch_workers,
+        patch_rate=args.patch_rate,
+        patch_burst=args.patch_burst,
+        portal_retries=args.portal_retries,
+        portal_backoff_factor=args.portal_backoff_factor,
     )
     if run_type == 'sync':
         eft.sync_buckets_and_portal()
     elif run_type == 'metadata':
         eft.dump_file_metadata_to_s3()
+    elif run_type == 'plan':
+        plan = eft.plan_transfers()
+        if args.plan_file:
+            eft.write_plan(plan, args.plan_file)
+        print(json.dumps(plan['summary'], indent=2))
 
 
 if __name__ == '__main__':
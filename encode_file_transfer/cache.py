@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import requests
+from .interface import (
+    CACHE_TTL,
+    CACHE_MAX_BYTES,
+)
+
+
+log = logging.getLogger()
+
+
+class ResponseCache():
+    '''
+    On disk cache of portal GET responses keyed by URL and credentials.
+    Bodies are stored as files next to an SQLite index. Entries younger
+    than ttl seconds are served without a request, older ones can be
+    revalidated with the ETag and Last-Modified the portal sent. The
+    least recently used bodies are evicted once the cache is over
+    max_bytes.
+    '''
+
+    INDEX = 'index.sqlite'
+
+    def __init__(self, directory, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(directory, self.INDEX),
+            check_same_thread=False
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+            'content_type TEXT, size INTEGER NOT NULL, stored REAL NOT NULL, used REAL NOT NULL)'
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key(url, creds=None):
+        '''
+        Hash of the URL and credentials, so responses are never shared
+        between users and no secret is stored.
+        '''
+        digest = hashlib.sha256(url.encode())
+        for part in creds or ():
+            digest.update(b'\0' + str(part).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        '''
+        Returns the index entry for key with whether it is still fresh,
+        or None.
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT etag, last_modified, stored FROM responses WHERE key = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, stored = row
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': time.time() - stored < self.ttl,
+        }
+
+    @staticmethod
+    def validators(entry):
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def load(self, key, url):
+        '''
+        Cached response for key, or None if its body has been evicted.
+        '''
+        try:
+            with open(self._path(key), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT content_type FROM responses WHERE key = ?',
+                (key,)
+            ).fetchone()
+            with self.connection:
+                self.connection.execute(
+                    'UPDATE responses SET used = ? WHERE key = ?',
+                    (time.time(), key)
+                )
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        r._content = content
+        if row and row[0]:
+            r.headers['Content-Type'] = row[0]
+        return r
+
+    def touch(self, key):
+        '''
+        Restarts the ttl of a revalidated entry.
+        '''
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE responses SET stored = ?, used = ? WHERE key = ?',
+                (now, now, key)
+            )
+
+    def store(self, key, url, r):
+        content = r.content
+        if len(content) > self.max_bytes:
+            log.warning('Response of {} bytes is too big to cache'.format(len(content)))
+            return
+        # Written under a temporary name so readers never see part of a
+        # body.
+        path = self._path(key)
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, path)
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO responses '
+                    '(key, url, etag, last_modified, content_type, size, stored, used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        key,
+                        url,
+                        r.headers.get('ETag'),
+                        r.headers.get('Last-Modified'),
+                        r.headers.get('Content-Type'),
+                        len(content),
+                        now,
+                        now,
+                    )
+                )
+            self._evict()
+
+    def _evict(self):
+        total = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.connection.execute(
+            'SELECT key, size FROM responses ORDER BY used'
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM responses WHERE key = ?',
+                [(key,) for key in evicted]
+            )
+        for key in evicted:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        log.warning('Evicted {} cached responses'.format(len(evicted)))
+
+    def clear(self):
+        with self.lock:
+            keys = [row[0] for row in self.connection.execute('SELECT key FROM responses')]
+            with self.connection:
+                self.connection.execute('DELETE FROM responses')
+            for key in keys:
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        self.connection.close()
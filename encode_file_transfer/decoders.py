@@ -0,0 +1,65 @@
+import json
+from itertools import islice
+from .interface import (
+    JSON_DECODER,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def get_decoder(name=JSON_DECODER):
+    '''
+    Returns a function decoding JSON bytes. auto picks msgspec or orjson
+    if installed, falling back to the standard library.
+    '''
+    if name == 'auto':
+        if msgspec is not None:
+            name = 'msgspec'
+        elif orjson is not None:
+            name = 'orjson'
+        else:
+            name = 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError('orjson decoder requires the orjson package')
+        return orjson.loads
+    if name == 'msgspec':
+        if msgspec is None:
+            raise ValueError('msgspec decoder requires the msgspec package')
+        return msgspec.json.decode
+    if name == 'json':
+        return json.loads
+    raise ValueError('Unknown JSON decoder {}'.format(name))
+
+
+def check_streaming():
+    if ijson is None:
+        raise ValueError('Streaming JSON requires the ijson package')
+
+
+def iter_json_items(f, prefix, batch_size):
+    '''
+    Yields lists of up to batch_size items under prefix, e.g.
+    @graph.item, as the JSON file-like object f is read. Numbers are
+    decoded to ints and floats like the standard library.
+    '''
+    check_streaming()
+    items = ijson.items(f, prefix, use_float=True)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -21,10 +21,116 @@ INDEXER = 'indexer-info'
 AUDIT = 'audit'
 AUDIT_TYPE = 'INTERNAL_ACTION'
 AUDIT_CATEGORY = 'incorrect file bucket'
+# File properties kept from the audit search.
+AUDIT_FILE_FIELDS = [
+    'md5sum',
+    'file_size',
+]
 BATCH_SIZE = 10
+WORKERS = 1
+MAX_POOL_CONNECTIONS = 10
+# Files at least this big only run on the large file slots of the sync
+# workers (by default a quarter of them), largest first.
+LARGE_FILE_THRESHOLD = 10 * 1024 * 1024 * 1024
+# Managed S3 transfer settings in bytes.
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 64 * 1024 * 1024
+# Bigger objects use larger parts to copy in about this many parts.
+MULTIPART_TARGET_PARTS = 1000
+# S3 maximum part size.
+MAX_MULTIPART_CHUNKSIZE = 5 * 1024 * 1024 * 1024
+# Threads per managed transfer.
+MAX_CONCURRENCY = 10
+# Largest object CopyObject can copy in one request.
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+# Additional checksums compared when verifying copies.
+CHECKSUM_KEYS = [
+    'ChecksumCRC64NVME',
+    'ChecksumCRC32',
+    'ChecksumCRC32C',
+    'ChecksumSHA1',
+    'ChecksumSHA256',
+]
+# DeleteObjects accepts at most 1000 keys.
+DELETE_BATCH_SIZE = 1000
+# Seconds before a partial delete batch is sent anyway.
+DELETE_FLUSH_INTERVAL = 30
+LOCAL_JOURNAL = os.path.expanduser('~/igvf_file_transfer_journal.jsonl')
+# Journal entries older than this are ignored.
+JOURNAL_MAX_AGE_DAYS = 7
+# Key parts listed together by the bucket inventory, i.e. YYYY/MM/DD/.
+INVENTORY_PREFIX_DEPTH = 3
+PORTAL_POOL_SIZE = 10
+PORTAL_RETRIES = 5
+PORTAL_BACKOFF_FACTOR = 1
+PORTAL_RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Indexer wait in seconds: checks back off exponentially from
+# INDEXER_WAIT_INITIAL up to INDEXER_WAIT_MAX, each shortened by up to
+# INDEXER_WAIT_JITTER of itself, until INDEXER_WAIT_DEADLINE.
+INDEXER_WAIT_INITIAL = 60
+INDEXER_WAIT_MAX = 600
+INDEXER_WAIT_FACTOR = 2
+INDEXER_WAIT_JITTER = 0.5
+INDEXER_WAIT_DEADLINE = 1800
+# Background @@update_bucket PATCHes, rate in requests per second
+# (None for unlimited) with bursts of up to PATCH_BURST requests.
+PATCH_WORKERS = 2
+PATCH_RATE = 5
+PATCH_BURST = 10
+# Upper bounds in seconds of the stage latency histogram buckets.
+METRICS_LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800]
+METRICS_PREFIX = 'igvf_file_transfer'
+# Metadata export searches run concurrently, one per term of the
+# partition facet. One worker makes a single search.
+EXPORT_WORKERS = 1
+EXPORT_PARTITION_FIELD = 'file_format'
+# Flattened pages buffered per export worker.
+EXPORT_QUEUE_PAGES = 2
+# Processes decoding and flattening metadata search pages, 1 flattens
+# in the calling thread. More than 1 needs a PAGE_SIZE.
+FLATTEN_PROCESSES = 1
+# Decoder for search responses, one of JSON_DECODERS. auto uses msgspec
+# or orjson when installed.
+JSON_DECODERS = ['auto', 'orjson', 'msgspec', 'json']
+JSON_DECODER = 'auto'
+# Streamed searches (needs ijson) are decoded STREAM_BATCH_SIZE results
+# at a time instead of holding the whole response.
+STREAM_BATCH_SIZE = 1000
+# Results per search page. None makes a single search request.
+PAGE_SIZE = None
 LOGFILE = 'transfer_log_{}.txt'
 METADATA_TSV = 'igvf_file_manifest.tsv'
 LOCAL_METADATA_TSV = os.path.expanduser(f'~/{METADATA_TSV}')
+# Optional extra manifest formats and their object keys.
+MANIFEST_FORMATS = {
+    'gzip': 'igvf_file_manifest.tsv.gz',
+    'zstd': 'igvf_file_manifest.tsv.zst',
+    'parquet': 'igvf_file_manifest.parquet',
+}
+MANIFEST_PARQUET_ROW_GROUP_SIZE = 100000
+MANIFEST_SORT_FIELDS = [
+    'file_set.accession',
+    'assembly',
+    'file_format',
+]
+# Rows sorted in memory before spilling a sorted run to disk.
+MANIFEST_BUFFER_SIZE = 20000
+LOCAL_SNAPSHOT = os.path.expanduser('~/igvf_file_manifest_snapshot.sqlite')
+LOCAL_CACHE = os.path.expanduser('~/igvf_file_transfer_cache')
+# Cached portal responses are used without a request for CACHE_TTL
+# seconds, then revalidated. Least recently used responses are evicted
+# past CACHE_MAX_BYTES.
+CACHE_TTL = 3600
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+# Indexed file property used to find files changed since the last run.
+MODIFIED_FIELD = 'last_modified'
+# Query from a little before the last run to catch files indexed late.
+INCREMENTAL_OVERLAP_HOURS = 1
+# Embedded objects (e.g. file_set.lab.title) can change without the file
+# changing, so incremental snapshots are fully refreshed this often.
+INCREMENTAL_FULL_REFRESH_DAYS = 7
+# S3 object metadata key holding the sha256 of the uploaded manifest.
+MANIFEST_HASH_METADATA_KEY = 'sha256'
 FILE_METADATA_FIELDS = [
     '@id',
     'href',
@@ -0,0 +1,91 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .interface import (
+    INVENTORY_PREFIX_DEPTH,
+)
+
+
+log = logging.getLogger()
+
+
+class BucketInventory():
+    '''
+    In memory index of object sizes and ETags built by listing key
+    prefixes with ListObjectsV2, so existence checks for many files cost a
+    few list requests instead of a HEAD each. Keys are grouped by their
+    first prefix_depth parts, e.g. YYYY/MM/DD/. Lookups under a prefix that
+    has been listed are answered locally, anything else is a miss.
+    '''
+
+    def __init__(self, client, prefix_depth=INVENTORY_PREFIX_DEPTH):
+        self.client = client
+        self.prefix_depth = prefix_depth
+        self.objects = {}
+        self.prefixes = set()
+        self.lock = threading.Lock()
+
+    def _get_prefix(self, key):
+        parts = key.split('/')
+        # Never list a whole bucket for keys without enough parts.
+        if len(parts) <= self.prefix_depth:
+            return None
+        return '/'.join(parts[:self.prefix_depth]) + '/'
+
+    def _list_prefix(self, bucket, prefix):
+        objects = {}
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                objects[(bucket, item['Key'])] = {
+                    'ContentLength': item['Size'],
+                    'ETag': item['ETag'],
+                }
+        with self.lock:
+            self.objects.update(objects)
+            self.prefixes.add((bucket, prefix))
+        return len(objects)
+
+    def list_keys(self, bucket_keys, workers=1):
+        '''
+        Lists every unlisted prefix covering the (bucket, key) pairs.
+        '''
+        bucket_prefixes = set()
+        for bucket, key in bucket_keys:
+            prefix = self._get_prefix(key)
+            if prefix is not None and (bucket, prefix) not in self.prefixes:
+                bucket_prefixes.add((bucket, prefix))
+        log.warning('Listing {} bucket prefixes'.format(len(bucket_prefixes)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            counts = list(
+                executor.map(
+                    lambda bucket_prefix: self._list_prefix(*bucket_prefix),
+                    sorted(bucket_prefixes)
+                )
+            )
+        log.warning('Listed {} objects'.format(sum(counts)))
+
+    def covers(self, bucket, key):
+        prefix = self._get_prefix(key)
+        return prefix is not None and (bucket, prefix) in self.prefixes
+
+    def lookup(self, bucket, key):
+        '''
+        Returns object metadata if listed, False if bucket/key is under a
+        listed prefix but doesn't exist and None if it isn't covered.
+        '''
+        metadata = self.objects.get((bucket, key))
+        if metadata is not None:
+            return metadata
+        if self.covers(bucket, key):
+            return False
+        return None
+
+    def add(self, bucket, key, metadata):
+        if self.covers(bucket, key):
+            with self.lock:
+                self.objects[(bucket, key)] = metadata
+
+    def remove(self, bucket, key):
+        with self.lock:
+            self.objects.pop((bucket, key), None)
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from .interface import (
+    JOURNAL_MAX_AGE_DAYS,
+)
+
+
+log = logging.getLogger()
+
+
+class TransferJournal():
+    '''
+    Append-only JSON lines record of the sync steps completed for each
+    file, so a restarted run can skip finished work and resume a file at
+    the step it stopped. Files are keyed by accession and destination
+    since the source can change when it is resolved. A failure clears the
+    step to redo and the steps after it, keeping e.g. a verified copy
+    when the delete fails. Patched files are forgotten since nothing is
+    left to resume. Entries older than max_age are ignored.
+    '''
+
+    RESOLVED = 'resolved'
+    COPIED = 'copied'
+    VERIFIED = 'verified'
+    TAGGED = 'tagged'
+    DELETED = 'deleted'
+    PATCHED = 'patched'
+    FAILED = 'failed'
+    STEPS = [RESOLVED, COPIED, VERIFIED, TAGGED, DELETED, PATCHED]
+
+    def __init__(self, path, max_age=timedelta(days=JOURNAL_MAX_AGE_DAYS)):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = {}
+        self._load()
+        self._file = open(self.path, 'a')
+
+    @staticmethod
+    def _key(f):
+        return '{}|{}|{}'.format(
+            f.get('accession'),
+            f.get('destination_bucket'),
+            f.get('destination_key')
+        )
+
+    def _apply(self, record):
+        if record['step'] == self.PATCHED:
+            self.entries.pop(record['key'], None)
+            return
+        if record['step'] == self.FAILED:
+            entry = self.entries.get(record['key'])
+            if entry is None:
+                return
+            redo = record.get('redo') or next(
+                (step for step in self.STEPS if step not in entry['steps']),
+                self.PATCHED
+            )
+            if redo == self.RESOLVED:
+                self.entries.pop(record['key'])
+                return
+            entry['steps'].difference_update(self.STEPS[self.STEPS.index(redo):])
+            return
+        entry = self.entries.setdefault(record['key'], {'steps': set(), 'file': None})
+        entry['steps'].add(record['step'])
+        if record.get('file'):
+            entry['file'] = record['file']
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        oldest = datetime.now(timezone.utc) - self.max_age
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partial line written as the previous run died.
+                    continue
+                if datetime.fromisoformat(record['time']) < oldest:
+                    continue
+                self._apply(record)
+        log.warning('Loaded journal with {} files'.format(len(self.entries)))
+
+    def record(self, f, step, redo=None):
+        '''
+        For FAILED, redo is the step to start again from, by default the
+        first step not completed.
+        '''
+        record = {
+            'key': self._key(f),
+            'step': step,
+            'time': datetime.now(timezone.utc).isoformat(),
+        }
+        if step == self.RESOLVED:
+            record['file'] = f
+        if redo is not None:
+            record['redo'] = redo
+        with self.lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            self._apply(record)
+
+    def completed(self, f):
+        entry = self.entries.get(self._key(f))
+        return set(entry['steps']) if entry else set()
+
+    def resolved(self, f):
+        '''
+        File as resolved by a previous run, i.e. with its actual source.
+        '''
+        entry = self.entries.get(self._key(f))
+        return dict(entry['file']) if entry and entry['file'] else None
+
+    def reset(self):
+        with self.lock:
+            self._file.close()
+            self._file = open(self.path, 'w')
+            self.entries = {}
+
+    def close(self):
+        self._file.close()
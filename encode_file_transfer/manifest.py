@@ -0,0 +1,280 @@
+import csv
+import gzip
+import heapq
+import io
+import logging
+import os
+import pickle
+import tempfile
+from .interface import (
+    MANIFEST_SORT_FIELDS,
+    MANIFEST_BUFFER_SIZE,
+    MANIFEST_PARQUET_ROW_GROUP_SIZE,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+log = logging.getLogger()
+
+
+class ColumnKind():
+    '''
+    Tracks the types seen in a column so values are written the way a
+    pandas DataFrame would write them, i.e. ints in a column with missing
+    values or floats are written as floats.
+    '''
+
+    def __init__(self):
+        self.has_none = False
+        self.has_bool = False
+        self.has_int = False
+        self.has_float = False
+        self.has_str = False
+        self.has_other = False
+
+    def update(self, value):
+        if value is None:
+            self.has_none = True
+        elif isinstance(value, bool):
+            self.has_bool = True
+        elif isinstance(value, int):
+            self.has_int = True
+        elif isinstance(value, float):
+            self.has_float = True
+        elif isinstance(value, str):
+            self.has_str = True
+        else:
+            self.has_other = True
+
+    @property
+    def is_mixed(self):
+        return self.has_bool or self.has_str or self.has_other
+
+    @property
+    def is_float(self):
+        if self.is_mixed:
+            return False
+        return self.has_float or (self.has_int and self.has_none)
+
+    def format(self, value):
+        if value is None:
+            return ''
+        if self.is_float:
+            return repr(float(value))
+        return str(value)
+
+
+class TsvOutput():
+    '''
+    Writes manifest rows as TSV, optionally gzip or zstd compressed.
+    Compressed output is deterministic so unchanged content hashes the
+    same between runs.
+    '''
+
+    def __init__(self, filename, compression=None):
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd manifest requires the zstandard package')
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError('Unknown compression {}'.format(compression))
+        self.filename = filename
+        self.compression = compression
+        self._raw = None
+        self._file = None
+        self._writer = None
+        self._kinds = None
+
+    def _open_binary(self):
+        self._raw = open(self.filename, 'wb')
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=self._raw, mode='wb', mtime=0)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().stream_writer(self._raw)
+        return self._raw
+
+    def open(self, fields, kinds):
+        self._kinds = kinds
+        self._file = io.TextIOWrapper(self._open_binary(), newline='')
+        self._writer = csv.writer(self._file, delimiter='\t', lineterminator='\n')
+        self._writer.writerow(fields)
+
+    def write(self, values):
+        self._writer.writerow(
+            [
+                kind.format(value)
+                for kind, value in zip(self._kinds, values)
+            ]
+        )
+
+    def close(self):
+        self._file.close()
+        if not self._raw.closed:
+            self._raw.close()
+
+
+class ParquetOutput():
+    '''
+    Writes manifest rows as Parquet in row groups. Numeric and boolean
+    columns keep their types, everything else is written as strings the
+    same way as in the TSV.
+    '''
+
+    def __init__(self, filename, row_group_size=MANIFEST_PARQUET_ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise ValueError('Parquet manifest requires the pyarrow package')
+        self.filename = filename
+        self.row_group_size = row_group_size
+        self._writer = None
+        self._schema = None
+        self._converters = None
+        self._columns = None
+
+    @staticmethod
+    def _column_type(kind):
+        if kind.is_mixed:
+            if kind.has_bool and not (kind.has_str or kind.has_other or kind.has_int or kind.has_float):
+                return pyarrow.bool_(), lambda v: v
+            return pyarrow.string(), lambda v: None if v is None else kind.format(v)
+        if kind.has_float:
+            return pyarrow.float64(), lambda v: None if v is None else float(v)
+        if kind.has_int:
+            return pyarrow.int64(), lambda v: v
+        return pyarrow.string(), lambda v: v
+
+    def open(self, fields, kinds):
+        column_types = [self._column_type(kind) for kind in kinds]
+        self._schema = pyarrow.schema(
+            [
+                (field, column_type)
+                for field, (column_type, _) in zip(fields, column_types)
+            ]
+        )
+        self._converters = [converter for _, converter in column_types]
+        self._writer = pyarrow.parquet.ParquetWriter(self.filename, self._schema)
+        self._columns = [[] for _ in fields]
+
+    def _flush(self):
+        if not self._columns[0]:
+            return
+        self._writer.write_table(
+            pyarrow.Table.from_arrays(
+                [
+                    pyarrow.array(column, type=field.type)
+                    for column, field in zip(self._columns, self._schema)
+                ],
+                schema=self._schema
+            )
+        )
+        self._columns = [[] for _ in self._columns]
+
+    def write(self, values):
+        for column, converter, value in zip(self._columns, self._converters, values):
+            column.append(converter(value))
+        if len(self._columns[0]) >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+class ManifestWriter():
+    '''
+    Writes sorted manifest rows to a TSV without holding them all in
+    memory. Rows are sorted in buffers of buffer_size, buffers are
+    spilled to temporary files and the sorted runs are merged while
+    writing. Output matches sorting and writing a pandas DataFrame of the
+    same rows (stable sort, missing values last).
+    '''
+
+    def __init__(self, fields, sort_by=MANIFEST_SORT_FIELDS, buffer_size=MANIFEST_BUFFER_SIZE, tmpdir=None):
+        self.fields = list(fields)
+        self.sort_by = list(sort_by)
+        self.buffer_size = buffer_size
+        self.tmpdir = tmpdir
+        self.kinds = [ColumnKind() for _ in self.fields]
+        self.count = 0
+
+    def _sort_key(self, row):
+        return tuple(
+            (row.get(field) is None, row.get(field))
+            for field in self.sort_by
+        )
+
+    def _add(self, row, buffer):
+        values = tuple(row.get(field) for field in self.fields)
+        for kind, value in zip(self.kinds, values):
+            kind.update(value)
+        buffer.append((self._sort_key(row), self.count, values))
+        self.count += 1
+
+    @staticmethod
+    def _spill(buffer, directory):
+        buffer.sort()
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.run')
+        with os.fdopen(fd, 'wb') as f:
+            for item in buffer:
+                pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def _sorted_values(self, rows, directory):
+        '''
+        Consumes all rows, spilling sorted runs to directory, and returns
+        an iterator over row values in sorted order.
+        '''
+        runs = []
+        buffer = []
+        for row in rows:
+            self._add(row, buffer)
+            if len(buffer) >= self.buffer_size:
+                runs.append(self._spill(buffer, directory))
+                buffer = []
+        buffer.sort()
+        if runs:
+            log.warning('Merging {} sorted manifest runs'.format(len(runs) + 1))
+        # Sequence numbers are unique so rows are never compared.
+        merged = heapq.merge(*[self._read_run(run) for run in runs], buffer)
+        return (values for _, _, values in merged)
+
+    def write(self, rows, filename, outputs=()):
+        '''
+        Writes rows to filename as a sorted TSV and to any extra outputs
+        (e.g. compressed TSV or Parquet) in the same pass. Returns number
+        of rows.
+        '''
+        log.warning('Dumping metadata to {}'.format(filename))
+        self.kinds = [ColumnKind() for _ in self.fields]
+        self.count = 0
+        outputs = [TsvOutput(filename)] + list(outputs)
+        with tempfile.TemporaryDirectory(dir=self.tmpdir) as directory:
+            sorted_values = self._sorted_values(rows, directory)
+            opened = []
+            try:
+                for output in outputs:
+                    output.open(self.fields, self.kinds)
+                    opened.append(output)
+                for values in sorted_values:
+                    for output in outputs:
+                        output.write(values)
+            finally:
+                for output in opened:
+                    output.close()
+        return self.count
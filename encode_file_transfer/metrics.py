@@ -0,0 +1,162 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import (
+    datetime,
+    timezone,
+)
+from .interface import (
+    METRICS_LATENCY_BUCKETS,
+    METRICS_PREFIX,
+)
+
+
+log = logging.getLogger()
+
+
+class Histogram():
+    '''
+    Count, sum, min, max and cumulative bucket counts of latencies in
+    seconds.
+    '''
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'buckets': {
+                str(bound): count
+                for bound, count in zip(self.buckets, self.bucket_counts)
+            },
+        }
+
+
+class RunMetrics():
+    '''
+    Thread safe counters and per stage latency histograms for a run,
+    written as a JSON summary and optionally in Prometheus text format.
+    Stages timed with timer also count their errors.
+    '''
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.run = None
+        self.started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram(self.buckets)
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('{}_errors'.format(stage))
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'run': self.run,
+                'started': self.started.isoformat(),
+                'elapsed_seconds': time.perf_counter() - self._start,
+                'counters': dict(sorted(self.counters.items())),
+                'stages': {
+                    stage: histogram.summary()
+                    for stage, histogram in sorted(self.stages.items())
+                },
+            }
+
+    @staticmethod
+    def _labels(**labels):
+        pairs = [
+            '{}="{}"'.format(key, value)
+            for key, value in labels.items()
+            if value is not None
+        ]
+        return '{{{}}}'.format(','.join(pairs)) if pairs else ''
+
+    def to_prometheus(self, prefix=METRICS_PREFIX):
+        summary = self.summary()
+        run = summary['run']
+        labels = self._labels(run=run)
+        lines = [
+            '# TYPE {}_elapsed_seconds gauge'.format(prefix),
+            '{}_elapsed_seconds{} {}'.format(prefix, labels, summary['elapsed_seconds']),
+        ]
+        for name, value in summary['counters'].items():
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            lines.append('{}_{}_total{} {}'.format(prefix, name, labels, value))
+        if summary['stages']:
+            lines.append('# TYPE {}_stage_seconds histogram'.format(prefix))
+        for stage, histogram in summary['stages'].items():
+            buckets = list(histogram['buckets'].items()) + [('+Inf', histogram['count'])]
+            for bound, count in buckets:
+                lines.append(
+                    '{}_stage_seconds_bucket{} {}'.format(
+                        prefix,
+                        self._labels(run=run, stage=stage, le=bound),
+                        count
+                    )
+                )
+            stage_labels = self._labels(run=run, stage=stage)
+            lines.append('{}_stage_seconds_sum{} {}'.format(prefix, stage_labels, histogram['sum']))
+            lines.append('{}_stage_seconds_count{} {}'.format(prefix, stage_labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_prometheus(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus())
+
+    def log_summary(self):
+        summary = self.summary()
+        log.warning(
+            'Run {} took {:.1f}s: {}'.format(
+                summary['run'],
+                summary['elapsed_seconds'],
+                ', '.join(
+                    '{} {:.1f}s/{}'.format(stage, histogram['sum'], histogram['count'])
+                    for stage, histogram in summary['stages'].items()
+                ) or 'no stages timed'
+            )
+        )
@@ -1,6 +1,17 @@
 import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from requests.exceptions import ConnectionError
+from urllib3.util.retry import Retry
 from urllib.parse import (
     urlparse,
     urljoin,
@@ -11,18 +22,176 @@ from .interface import (
     AUDIT,
     AUDIT_TYPE,
     AUDIT_CATEGORY,
+    AUDIT_FILE_FIELDS,
     INDEXER,
     SPLITQUERYTEMPLATE,
     FILE_METADATA_QUERY_TEMPLATE,
     FILE_METADATA_FIELDS,
     FILE_METADATA_STATUSES,
     FILE_METADATA_UPLOAD_STATUSES,
+    PORTAL_POOL_SIZE,
+    PORTAL_RETRIES,
+    PORTAL_BACKOFF_FACTOR,
+    PORTAL_RETRY_STATUSES,
+    PATCH_WORKERS,
+    PATCH_RATE,
+    PATCH_BURST,
+    PAGE_SIZE,
+    MODIFIED_FIELD,
+    EXPORT_WORKERS,
+    EXPORT_PARTITION_FIELD,
+    EXPORT_QUEUE_PAGES,
+    FLATTEN_PROCESSES,
+    CACHE_TTL,
+    CACHE_MAX_BYTES,
+    JSON_DECODER,
+    STREAM_BATCH_SIZE,
+)
+from .cache import ResponseCache
+from .decoders import (
+    check_streaming,
+    get_decoder,
+    iter_json_items,
 )
+from .metrics import RunMetrics
 
 
 log = logging.getLogger()
 
 
+class FieldPathExtractor():
+    '''
+    Flattens records to dotted fields, e.g. file_set.samples.summary.
+    Paths are split once up front and lists along a path are flattened
+    without recursion. Missing or empty values stop the walk and are
+    returned as is.
+    '''
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.nested_paths = tuple(
+            (field, tuple(field.split('.')))
+            for field in self.fields
+            if '.' in field
+        )
+
+    @staticmethod
+    def _flatten_list(values):
+        for value in values:
+            if isinstance(value, list):
+                break
+        else:
+            return values
+        flattened = []
+        stack = [iter(values)]
+        while stack:
+            for value in stack[-1]:
+                if isinstance(value, list):
+                    stack.append(iter(value))
+                    break
+                flattened.append(value)
+            else:
+                stack.pop()
+        return flattened
+
+    def __call__(self, data):
+        # Top level fields are a single lookup. Nested fields are filled
+        # in afterwards, keeping the key order of fields.
+        get = data.get
+        flattened_data = {field: get(field) for field in self.fields}
+        flatten_list = self._flatten_list
+        for field, path in self.nested_paths:
+            v = data
+            for p in path:
+                if isinstance(v, list):
+                    v = flatten_list([x.get(p) for x in v])
+                else:
+                    v = v.get(p)
+                if not v:
+                    break
+            flattened_data[field] = v
+        return flattened_data
+
+
+# Extractor and decoder of a flattening process, set by
+# _init_flatten_worker.
+_flatten_extractor = None
+_flatten_decoder = None
+
+
+def _init_flatten_worker(fields, decoder):
+    global _flatten_extractor, _flatten_decoder
+    _flatten_extractor = FieldPathExtractor(fields)
+    _flatten_decoder = get_decoder(decoder)
+
+
+def _flatten_page(content):
+    extractor = _flatten_extractor
+    return [extractor(data) for data in _flatten_decoder(content).get('@graph', [])]
+
+
+class RateLimiter():
+    '''
+    Token bucket allowing rate requests per second on average with bursts
+    of up to burst requests. A rate of None doesn't limit.
+    '''
+
+    def __init__(self, rate=PATCH_RATE, burst=PATCH_BURST):
+        self.rate = rate
+        self.burst = max(burst or 1, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self):
+        '''
+        Takes a token if available, otherwise returns seconds until one is.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        if not self.rate:
+            return
+        wait = self._take()
+        while wait:
+            time.sleep(wait)
+            wait = self._take()
+
+
+class PortalUpdater():
+    '''
+    Background stage that runs portal updates from a queue on its own
+    workers and rate limiter, so slow portal responses don't hold up S3
+    work and bursts of finished files don't flood the portal. Submitting
+    a file returns a Future for the result of update(file).
+    '''
+
+    def __init__(self, update, workers=PATCH_WORKERS, rate=PATCH_RATE, burst=PATCH_BURST):
+        self.update = update
+        self.limiter = RateLimiter(rate, burst)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or PATCH_WORKERS,
+            thread_name_prefix='portal-update',
+        )
+
+    def _run(self, f):
+        self.limiter.acquire()
+        return self.update(f)
+
+    def submit(self, f):
+        return self.executor.submit(self._run, f)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
 class EncodePortalHelper():
 
     def __init__(self, server, **kwargs):
@@ -30,9 +199,77 @@ class EncodePortalHelper():
         self.creds = kwargs.get('portal_creds')
         self.batch_size = kwargs.get('batch_size')
         self.query_filter = kwargs.get('query_filter')
+        self.page_size = kwargs.get('page_size', PAGE_SIZE)
+        self.modified_field = kwargs.get('modified_field', MODIFIED_FIELD)
         self.file_metadata_fields = kwargs.get('fields', FILE_METADATA_FIELDS)
+        self.extractor = FieldPathExtractor(self.file_metadata_fields)
         self.file_metadata_statuses = kwargs.get('statuses', FILE_METADATA_STATUSES)
         self.file_metadata_upload_statuses = kwargs.get('upload_statuses', FILE_METADATA_UPLOAD_STATUSES)
+        # Leave at least one pooled connection per sync, patch and export
+        # worker.
+        self.pool_size = kwargs.get('portal_pool_size') or max(
+            PORTAL_POOL_SIZE,
+            (kwargs.get('workers') or 0) + (kwargs.get('patch_workers') or PATCH_WORKERS),
+            kwargs.get('export_workers') or 0
+        )
+        self.retries = kwargs.get('portal_retries', PORTAL_RETRIES)
+        self.backoff_factor = kwargs.get('portal_backoff_factor', PORTAL_BACKOFF_FACTOR)
+        self.metrics = kwargs.get('metrics') or RunMetrics()
+        self.export_workers = kwargs.get('export_workers') or EXPORT_WORKERS
+        self.partition_field = kwargs.get('partition_field') or EXPORT_PARTITION_FIELD
+        self.flatten_processes = kwargs.get('flatten_processes') or FLATTEN_PROCESSES
+        if self.flatten_processes > 1 and not self.page_size:
+            # Deep pages can go past the search result window, so paging
+            # stays the caller's choice.
+            raise ValueError('Flattening on more than one process requires a page_size')
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._flatten_pool = None
+        self._flatten_pool_lock = threading.Lock()
+        self.json_decoder = kwargs.get('json_decoder') or JSON_DECODER
+        self.decode = get_decoder(self.json_decoder)
+        self.stream = kwargs.get('stream', False)
+        self.stream_batch_size = kwargs.get('stream_batch_size') or STREAM_BATCH_SIZE
+        if self.stream:
+            check_streaming()
+        self.cache = None
+        if kwargs.get('cache_path'):
+            self.cache = ResponseCache(
+                kwargs['cache_path'],
+                ttl=kwargs.get('cache_ttl') or CACHE_TTL,
+                max_bytes=kwargs.get('cache_max_bytes') or CACHE_MAX_BYTES
+            )
+
+    def _make_session(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=PORTAL_RETRY_STATUSES,
+            # @@update_bucket sets an absolute value so retrying PATCH is safe.
+            allowed_methods=['GET', 'PATCH'],
+            # Return the last response so status is checked as usual.
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def session(self):
+        '''
+        Keep-alive session shared by all portal requests.
+        '''
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._make_session()
+        return self._session
 
     @staticmethod
     def _zero_search_results(r):
@@ -52,23 +289,65 @@ class EncodePortalHelper():
         ]
         return all(conditions)
 
-    def _get(self, url, creds=None):
+    def _get_cached(self, key, url):
+        '''
+        Returns (cached response if fresh, conditional request headers).
+        '''
+        entry = self.cache.get(key)
+        if entry is not None and entry['fresh']:
+            r = self.cache.load(key, url)
+            if r is not None:
+                self.metrics.inc('cache_hits')
+                return r, {}
+        return None, self.cache.validators(entry)
+
+    def _get(self, url, creds=None, use_cache=True, stream=False):
+        '''
+        With a cache, responses are served from it while fresh and
+        revalidated once stale. Streamed responses are never cached.
+        '''
+        creds = creds or self.creds
+        cache = self.cache if use_cache and not stream else None
+        headers = {}
+        if cache is not None:
+            key = cache.key(url, creds)
+            r, headers = self._get_cached(key, url)
+            if r is not None:
+                log.warning('Using cached {}'.format(url))
+                return r
         log.warning('Getting {}'.format(url))
         try:
-            r = requests.get(url, auth=creds or self.creds)
+            if headers:
+                r = self.session.get(url, auth=creds, headers=headers)
+            elif stream:
+                r = self.session.get(url, auth=creds, stream=True)
+            else:
+                r = self.session.get(url, auth=creds)
         except ConnectionError as e:
             log.warning('URL not found. Does {} exist?'.format(url))
             raise e
+        if r.status_code == 304 and cache is not None:
+            cached = cache.load(key, url)
+            if cached is not None:
+                self.metrics.inc('cache_revalidated')
+                cache.touch(key)
+                return cached
+            # Evicted since, fetch it again.
+            return self._get(url, creds, use_cache=False)
         if r.status_code != 200 and not self._zero_search_results(r):
             log.warning('Status code not 200. Does {} exist?'.format(url))
             log.warning('{} {}'.format(r.status_code, r.text))
             raise ValueError('Bad response code')
+        if cache is not None and r.status_code == 200:
+            self.metrics.inc('cache_misses')
+            cache.store(key, url, r)
         return r
 
     def _patch(self, url, json, creds=None):
         log.warning('Patching {} with {}'.format(url, json))
         try:
-            r = requests.patch(url, json=json, auth=creds or self.creds)
+            with self.metrics.timer('patch'):
+                r = self.session.patch(url, json=json, auth=creds or self.creds)
         except ConnectionError as e:
             log.warning('URL not found. Does {} exist?'.format(url))
             raise e
@@ -82,40 +361,124 @@ class EncodePortalHelper():
     def _parse_query_filter(query_filter):
         return urlencode(query_filter, doseq=True)
 
+    def _split_query(self, template):
+        '''
+        Copy of a urlsplit template pointing at the server, keeping the
+        template scheme unless the server has one, e.g. a local http
+        portal.
+        '''
+        split_query = template.copy()
+        server = urlparse(self.server)
+        split_query[0] = server.scheme or split_query[0]
+        split_query[1] = server.netloc
+        return split_query
+
     def _make_audit_query(self, batch_size=None, query_filter=None):
-        split_query = SPLITQUERYTEMPLATE.copy()
-        split_query[1] = urlparse(self.server).netloc
+        split_query = self._split_query(SPLITQUERYTEMPLATE)
         if batch_size:
             split_query[3] += '&limit={}'.format(batch_size)
         if query_filter:
             split_query[3] += '&{}'.format(self._parse_query_filter(query_filter))
         return urlunsplit(tuple(split_query))
 
-    def _parse_audits(self, query_results):
+    @staticmethod
+    def _make_page_query(query, start, limit):
+        return '{}&from={}&limit={}'.format(query, start, limit)
+
+    def _iter_search(self, query, batch_size=None):
         '''
-        Returns tuple (accession, incorrect file bucket details).
+        Yields @graph of search results one page at a time so the whole
+        result set is never held in memory. The query must not already
+        have a limit. Stops after batch_size results if it is an int.
+        Without a page_size this is a single request using batch_size as
+        the limit. Streamed pages are yielded in parts as they are
+        decoded.
+        '''
+        if not self.page_size:
+            if batch_size:
+                query += '&limit={}'.format(batch_size)
+            yield from self._search(query)
+            return
+        total = batch_size if isinstance(batch_size, int) else None
+        start = 0
+        while total is None or start < total:
+            limit = self.page_size
+            if total is not None:
+                limit = min(limit, total - start)
+            count = 0
+            for page in self._search(self._make_page_query(query, start, limit)):
+                count += len(page)
+                yield page
+            start += count
+            if count < limit:
+                break
+
+    def _search(self, query):
+        '''
+        Yields @graph of a single search, whole or in parts of
+        stream_batch_size results if streaming.
+        '''
+        if self.stream:
+            yield from self._stream_search(query)
+            return
+        with self.metrics.timer('search'):
+            page = self.decode(self._get(query).content).get('@graph', [])
+        yield page
+
+    def _stream_search(self, query):
+        with self.metrics.timer('search'):
+            r = self._get(query, stream=True)
+        # Anything else is a search without results.
+        if r.status_code != 200:
+            return
+        try:
+            r.raw.decode_content = True
+            pages = iter_json_items(r.raw, '@graph.item', self.stream_batch_size)
+            while True:
+                with self.metrics.timer('search'):
+                    page = next(pages, None)
+                if page is None:
+                    return
+                yield page
+        finally:
+            r.close()
+
+    def _parse_audits(self, query_results, fields=()):
+        '''
+        Returns tuple (accession, incorrect file bucket details). With
+        fields a dict of those file properties is added to the tuple.
         '''
         # Must use @id for replaced and reference files.
         internal_audits = [
             (
                 q.get('@id'),
-                q.get(AUDIT, {}).get(AUDIT_TYPE, [])
+                q.get(AUDIT, {}).get(AUDIT_TYPE, []),
+                q
             )
             for q in query_results
         ]
         parsed_audits = []
-        for f in internal_audits:
-            accession = f[0]
-            for audit in f[1]:
+        for accession, audits, q in internal_audits:
+            for audit in audits:
                 if audit.get('category') == AUDIT_CATEGORY:
-                    parsed_audits.append((accession, audit.get('detail')))
+                    parsed_audit = (accession, audit.get('detail'))
+                    if fields:
+                        parsed_audit += ({field: q.get(field) for field in fields},)
+                    parsed_audits.append(parsed_audit)
         return parsed_audits
 
-    def _make_metadata_query(self):
-        metadata_query = FILE_METADATA_QUERY_TEMPLATE.copy()
-        metadata_query[1] = urlparse(self.server).netloc
+    def _make_modified_filter(self, modified_since):
+        return urlencode({self.modified_field: 'gte:{}'.format(modified_since)})
+
+    def _make_metadata_query(self, paginate=False, modified_since=None):
+        '''
+        With paginate the limit is left off for _iter_search to add. With
+        modified_since only files modified since that timestamp are
+        returned.
+        '''
+        metadata_query = self._split_query(FILE_METADATA_QUERY_TEMPLATE)
         batch_size = self.batch_size
-        if batch_size:
+        if batch_size and not paginate:
             metadata_query[3] += '&limit={}'.format(batch_size)
         metadata_query[3] += '&{}'.format(
             urlencode(
@@ -130,53 +493,221 @@ class EncodePortalHelper():
                 doseq=True
             )
         )
+        if modified_since:
+            metadata_query[3] += '&{}'.format(self._make_modified_filter(modified_since))
         return urlunsplit(tuple(metadata_query))
 
-    def _flatten_list(self, values):
-        if isinstance(values, list):
-            for value in values:
-                yield from self._flatten_list(value)
-        else:
-            yield values
+    def _make_modified_query(self, modified_since):
+        '''
+        All files modified since timestamp regardless of whether they
+        belong in the manifest.
+        '''
+        modified_query = self._split_query(FILE_METADATA_QUERY_TEMPLATE)
+        modified_query[3] += '&field=%40id&{}'.format(
+            self._make_modified_filter(modified_since)
+        )
+        return urlunsplit(tuple(modified_query))
 
     def _flatten_json(self, data):
-        flattened_data = {}
-        for field in self.file_metadata_fields:
-            path = field.split('.')
-            v = data
-            for p in path:
-                if isinstance(v, list):
-                    v = list(self._flatten_list([x.get(p) for x in v]))
-                else:
-                    v = v.get(p)
-                if not v:
-                    break
-            flattened_data[field] = v
-        return flattened_data
+        return self.extractor(data)
 
     def _parse_metadata(self, metadata):
-        parsed_metadata = []
-        for data in metadata:
-            parsed_metadata.append(
-                self._flatten_json(
-                    data
+        extractor = self.extractor
+        return [extractor(data) for data in metadata]
+
+    def _parse_metadata_page(self, page):
+        with self.metrics.timer('flatten'):
+            rows = self._parse_metadata(page)
+        self.metrics.inc('metadata_rows', len(rows))
+        return rows
+
+    def _get_flatten_pool(self):
+        with self._flatten_pool_lock:
+            if self._flatten_pool is None:
+                # Forking while other threads hold locks can deadlock
+                # the children.
+                self._flatten_pool = ProcessPoolExecutor(
+                    max_workers=self.flatten_processes,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_init_flatten_worker,
+                    initargs=(self.file_metadata_fields, self.json_decoder)
                 )
+            return self._flatten_pool
+
+    def _iter_flattened_pages(self, query, batch_size=None):
+        '''
+        Yields flattened rows of each search page in order, like
+        _iter_search followed by _parse_metadata_page. The raw page
+        content is decoded and flattened on flatten_processes processes
+        while the following pages are fetched, so records are never
+        decoded or pickled here. Up to flatten_processes pages are
+        requested ahead, past the end of the results for short searches.
+        '''
+        pool = self._get_flatten_pool()
+        page_size = self.page_size
+        total = batch_size if isinstance(batch_size, int) else None
+        pending = deque()
+        start = 0
+        while True:
+            while len(pending) < self.flatten_processes and (total is None or start < total):
+                limit = page_size
+                if total is not None:
+                    limit = min(limit, total - start)
+                with self.metrics.timer('search'):
+                    content = self._get(self._make_page_query(query, start, limit)).content
+                pending.append((limit, pool.submit(_flatten_page, content)))
+                start += limit
+            if not pending:
+                return
+            limit, future = pending.popleft()
+            with self.metrics.timer('flatten'):
+                rows = future.result()
+            self.metrics.inc('metadata_rows', len(rows))
+            yield rows
+            if len(rows) < limit:
+                return
+
+    def _iter_metadata_pages(self, query):
+        if self.flatten_processes > 1:
+            yield from self._iter_flattened_pages(query, self.batch_size)
+            return
+        for page in self._iter_search(query, self.batch_size):
+            yield self._parse_metadata_page(page)
+
+    def _get_partition_queries(self, query):
+        '''
+        Splits query into one query per term of the partition_field facet.
+        Returns None if the facet is missing or its terms don't add up to
+        the total, e.g. files without the field.
+        '''
+        with self.metrics.timer('search'):
+            r = self.decode(self._get(query + '&limit=0').content)
+        for facet in r.get('facets', []):
+            if facet.get('field') == self.partition_field:
+                terms = [term for term in facet.get('terms', []) if term.get('doc_count')]
+                break
+        else:
+            log.warning('No {} facet to partition export by'.format(self.partition_field))
+            return None
+        if sum(term['doc_count'] for term in terms) != r.get('total'):
+            log.warning('{} facet does not cover all files'.format(self.partition_field))
+            return None
+        # Biggest partitions first so they don't finish last.
+        terms.sort(key=lambda term: -term['doc_count'])
+        return [
+            '{}&{}'.format(query, urlencode({self.partition_field: term['key']}))
+            for term in terms
+        ]
+
+    @staticmethod
+    def _put(pages, stop, item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch_partition(self, query, pages, stop):
+        for rows in self._iter_metadata_pages(query):
+            if not self._put(pages, stop, rows):
+                return
+
+    def _iter_partitioned_metadata(self, queries):
+        '''
+        Fetches and flattens partitions on export_workers threads and
+        yields rows as pages arrive. At most EXPORT_QUEUE_PAGES pages per
+        worker are buffered.
+        '''
+        log.warning(
+            'Exporting {} partitions by {} on {} workers'.format(
+                len(queries),
+                self.partition_field,
+                self.export_workers
             )
-        return parsed_metadata
+        )
+        pages = queue.Queue(maxsize=self.export_workers * EXPORT_QUEUE_PAGES)
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.export_workers) as executor:
+            futures = [
+                executor.submit(self._fetch_partition, query, pages, stop)
+                for query in queries
+            ]
+            try:
+                while True:
+                    try:
+                        yield from pages.get(timeout=0.1)
+                        continue
+                    except queue.Empty:
+                        pass
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise future.exception()
+                    # Workers put their last page before finishing.
+                    if all(future.done() for future in futures) and pages.empty():
+                        return
+            finally:
+                stop.set()
+
+    def iter_file_metadata(self, modified_since=None):
+        '''
+        Yields flattened file metadata rows page by page. With more than
+        one export worker the search is split by partition_field and
+        partitions are fetched concurrently, so rows come out grouped by
+        partition rather than in search order. Rows that share a
+        partition_field value keep their search order.
+        '''
+        file_metadata_query = self._make_metadata_query(
+            paginate=True,
+            modified_since=modified_since
+        )
+        # A limit on the number of files applies to the whole search.
+        if self.export_workers > 1 and not isinstance(self.batch_size, int):
+            queries = self._get_partition_queries(file_metadata_query)
+            if queries:
+                if self.flatten_processes > 1:
+                    # Start the flattening processes before the
+                    # partition threads.
+                    self._get_flatten_pool()
+                yield from self._iter_partitioned_metadata(queries)
+                return
+        for rows in self._iter_metadata_pages(file_metadata_query):
+            yield from rows
+
+    def close(self):
+        with self._flatten_pool_lock:
+            if self._flatten_pool is not None:
+                self._flatten_pool.shutdown(cancel_futures=True)
+                self._flatten_pool = None
+
+    def iter_modified_file_ids(self, modified_since):
+        '''
+        Yields @id of every file modified since timestamp. Every
+        modified file is needed to find removals, so batch_size does not
+        apply.
+        '''
+        for page in self._iter_search(self._make_modified_query(modified_since), 'all'):
+            for f in page:
+                yield f.get('@id')
 
     def get_file_metadata(self):
-        file_metadata_query = self._make_metadata_query()
-        r = self._get(file_metadata_query)
-        parsed_metadata = self._parse_metadata(r.json().get('@graph', []))
+        parsed_metadata = list(self.iter_file_metadata())
         log.warning('Got {} files for metadata'.format(len(parsed_metadata)))
         return parsed_metadata
 
     def is_indexing(self):
-        r = self._get(urljoin(self.server, INDEXER))
+        with self.metrics.timer('indexer_check'):
+            r = self._get(urljoin(self.server, INDEXER), use_cache=False)
         return r.json().get('is_indexing') is True
 
+    def iter_files_in_incorrect_bucket(self):
+        '''
+        Yields parsed audits page by page.
+        '''
+        file_audit_query = self._make_audit_query(query_filter=self.query_filter)
+        for page in self._iter_search(file_audit_query, self.batch_size):
+            yield from self._parse_audits(page, fields=AUDIT_FILE_FIELDS)
+
     def get_files_in_incorrect_bucket(self):
-        file_audit_query = self._make_audit_query(self.batch_size, self.query_filter)
-        r = self._get(file_audit_query)
-        parsed_audits = self._parse_audits(r.json().get('@graph', []))
-        return parsed_audits
+        return list(self.iter_files_in_incorrect_bucket())
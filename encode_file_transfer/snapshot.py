@@ -0,0 +1,122 @@
+import json
+import logging
+import sqlite3
+from datetime import (
+    datetime,
+    timezone,
+)
+
+
+log = logging.getLogger()
+
+
+class ManifestSnapshot():
+    '''
+    Local SQLite copy of the last manifest rows keyed by @id, used to
+    build the manifest incrementally. Rows keep the order they were first
+    inserted in, so a full refresh matches the portal search order and
+    updated rows keep their position.
+    '''
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = list(fields)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files (id TEXT PRIMARY KEY, row TEXT NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+        )
+        self.connection.commit()
+
+    def _get_meta(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM meta WHERE key = ?',
+            (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, key, value):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            (key, json.dumps(value))
+        )
+
+    @property
+    def since(self):
+        '''
+        Timestamp that the next incremental update should query from.
+        '''
+        return self._get_meta('since')
+
+    @property
+    def refreshed(self):
+        refreshed = self._get_meta('refreshed')
+        return datetime.fromisoformat(refreshed) if refreshed else None
+
+    def needs_full_refresh(self, max_age):
+        '''
+        Snapshots that are empty, were made with other fields or have not
+        been fully refreshed within max_age (a timedelta) are rebuilt.
+        '''
+        if self.since is None or self.refreshed is None:
+            return True
+        if self._get_meta('fields') != self.fields:
+            return True
+        return datetime.now(timezone.utc) - self.refreshed > max_age
+
+    def replace(self, rows, since):
+        '''
+        Replaces all rows. Returns number of rows stored.
+        '''
+        with self.connection:
+            self.connection.execute('DELETE FROM files')
+            count = self._upsert(rows)
+            self._set_meta('fields', self.fields)
+            self._set_meta('refreshed', datetime.now(timezone.utc).isoformat())
+            self._set_meta('since', since)
+        return count
+
+    def _upsert(self, rows):
+        count = 0
+        for row in rows:
+            self.connection.execute(
+                'INSERT INTO files (id, row) VALUES (?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET row = excluded.row',
+                (row['@id'], json.dumps(row))
+            )
+            count += 1
+        return count
+
+    def update(self, rows, removed_ids, since):
+        '''
+        Adds or updates rows and deletes removed_ids. Returns number of
+        rows upserted and removed.
+        '''
+        with self.connection:
+            upserted = self._upsert(rows)
+            removed = 0
+            for removed_id in removed_ids:
+                removed += self.connection.execute(
+                    'DELETE FROM files WHERE id = ?',
+                    (removed_id,)
+                ).rowcount
+            self._set_meta('since', since)
+        return upserted, removed
+
+    def __contains__(self, file_id):
+        return self.connection.execute(
+            'SELECT 1 FROM files WHERE id = ?',
+            (file_id,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def rows(self):
+        for (row,) in self.connection.execute('SELECT row FROM files ORDER BY rowid'):
+            yield json.loads(row)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,87 @@
+def make_response(body, status_code=200, headers=None):
+    import json
+    import requests
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = json.dumps(body).encode() if body is not None else b''
+    r.headers.update(headers or {})
+    return r
+
+
+def test_encode_cache_store_and_load(tmp_path):
+    from encode_file_transfer.cache import ResponseCache
+    cache = ResponseCache(tmp_path / 'cache', ttl=60)
+    key = cache.key('https://portal/search/', ('key', 'secret'))
+    assert key != cache.key('https://portal/search/', ('other', 'secret'))
+    assert key != cache.key('https://portal/search/')
+    assert 'secret' not in key
+    assert cache.get(key) is None
+    assert cache.validators(None) == {}
+    cache.store(
+        key,
+        'https://portal/search/',
+        make_response({'@graph': [1]}, headers={'ETag': '"abc"', 'Content-Type': 'application/json'})
+    )
+    entry = cache.get(key)
+    assert entry['fresh']
+    assert cache.validators(entry) == {'If-None-Match': '"abc"'}
+    r = cache.load(key, 'https://portal/search/')
+    assert r.json() == {'@graph': [1]}
+    assert r.headers['Content-Type'] == 'application/json'
+    cache.close()
+    cache = ResponseCache(tmp_path / 'cache', ttl=0)
+    assert not cache.get(key)['fresh']
+    cache.clear()
+    assert cache.get(key) is None
+    assert cache.load(key, 'https://portal/search/') is None
+
+
+def test_encode_cache_evicts_least_recently_used(tmp_path, mocker):
+    from encode_file_transfer.cache import ResponseCache
+    clock = [0]
+    mocker.patch('encode_file_transfer.cache.time.time', side_effect=lambda: clock[0])
+    cache = ResponseCache(tmp_path / 'cache', max_bytes=25)
+    for name in ['a', 'b']:
+        clock[0] += 1
+        cache.store(name, name, make_response('x' * 8))
+    clock[0] += 1
+    cache.load('a', 'a')
+    clock[0] += 1
+    cache.store('c', 'c', make_response('x' * 8))
+    assert cache.get('b') is None
+    assert not (tmp_path / 'cache' / 'b').exists()
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    cache.store('d', 'd', make_response('x' * 30))
+    assert cache.get('d') is None
+
+
+def test_encode_cache_portal_helper_get(server, mocker, tmp_path):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    mocker.patch(
+        'requests.Session.get',
+        return_value=make_response({'@graph': [1]}, headers={'ETag': '"abc"'})
+    )
+    eph = EncodePortalHelper(server, cache_path=tmp_path / 'cache', cache_ttl=60)
+    url = server + '/search/?type=File'
+    assert eph._get(url).json() == {'@graph': [1]}
+    assert eph._get(url).json() == {'@graph': [1]}
+    assert requests.Session.get.call_count == 1
+    # Stale responses are revalidated.
+    eph.cache.ttl = 0
+    requests.Session.get.return_value = make_response(None, 304)
+    assert eph._get(url).json() == {'@graph': [1]}
+    assert requests.Session.get.call_args.kwargs['headers'] == {'If-None-Match': '"abc"'}
+    requests.Session.get.return_value = make_response({'@graph': [2]}, headers={'ETag': '"def"'})
+    assert eph._get(url).json() == {'@graph': [2]}
+    assert eph.cache.get(eph.cache.key(url, None))['etag'] == '"def"'
+    # Indexer checks always go to the portal.
+    requests.Session.get.return_value = make_response({'is_indexing': False})
+    eph.cache.ttl = 60
+    eph.is_indexing()
+    eph.is_indexing()
+    assert requests.Session.get.call_count == 5
+    assert eph.metrics.counters['cache_hits'] == 1
+    assert eph.metrics.counters['cache_revalidated'] == 1
+    assert eph.metrics.counters['cache_misses'] == 2
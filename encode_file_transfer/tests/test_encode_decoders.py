@@ -0,0 +1,35 @@
+import pytest
+
+
+def test_encode_decoders_get_decoder(mocker):
+    import json
+    from encode_file_transfer import decoders
+    body = json.dumps({'@graph': [{'file_size': 1, 'read_length': 1.5, 'status': 'released'}]}).encode()
+    for name in ['auto', 'json'] + [name for name in ['orjson', 'msgspec'] if getattr(decoders, name)]:
+        assert decoders.get_decoder(name)(body) == json.loads(body)
+    assert decoders.get_decoder('json') is json.loads
+    with pytest.raises(ValueError):
+        decoders.get_decoder('yaml')
+    if decoders.msgspec is not None:
+        assert decoders.get_decoder('auto') is decoders.msgspec.json.decode
+    mocker.patch.object(decoders, 'orjson', None)
+    mocker.patch.object(decoders, 'msgspec', None)
+    assert decoders.get_decoder('auto') is json.loads
+    with pytest.raises(ValueError):
+        decoders.get_decoder('orjson')
+
+
+def test_encode_decoders_iter_json_items(mocker):
+    import io
+    import json
+    pytest.importorskip('ijson')
+    from encode_file_transfer import decoders
+    graph = [{'@id': str(i), 'file_size': i, 'read_length': i + 0.5} for i in range(5)]
+    f = io.BytesIO(json.dumps({'total': 5, '@graph': graph}).encode())
+    batches = list(decoders.iter_json_items(f, '@graph.item', 2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [item for batch in batches for item in batch] == graph
+    assert type(batches[0][0]['read_length']) is float
+    mocker.patch.object(decoders, 'ijson', None)
+    with pytest.raises(ValueError):
+        list(decoders.iter_json_items(f, '@graph.item', 2))
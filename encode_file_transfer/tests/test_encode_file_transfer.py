@@ -1,3 +1,4 @@
+import json
 import pytest
 
 
@@ -11,6 +12,10 @@ class MockResponse():
         def json(self):
             return self.json_data
 
+        @property
+        def content(self):
+            return json.dumps(self.json_data).encode()
+
 
 def test_encode_file_transfer_init(server):
     from encode_file_transfer import EncodeFileTransfer
@@ -34,13 +39,36 @@ def test_encode_file_transfer_parse_audit_details_for_source_and_destination(ser
     assert parsed_audit_details.get('source_key') == '2019/02/11/0e18d1ba-4804-4ca8-9e8e-65eb640b9908/ENCFF910LZK.bigBed'
     assert parsed_audit_details.get('destination_bucket') == 'encode-pds-private-dev'
     assert parsed_audit_details.get('destination_key') == '2019/02/11/0e18d1ba-4804-4ca8-9e8e-65eb640b9908/ENCFF910LZK.bigBed'
+    assert parsed_audit_details.get('status') == 'in progress'
+
+
+def test_encode_file_transfer_parse_audit_details_malformed(server, parsed_audit, mocker):
+    from encode_file_transfer import EncodeFileTransfer
+    from encode_file_transfer.transfer import AuditDetailError
+    eft = EncodeFileTransfer(server)
+    malformed = [
+        None,
+        '',
+        'Move in progress file ENCFF910LZK from s3://encode-files/ENCFF910LZK.bigBed',
+        'Move in progress file ENCFF910LZK from encode-files/a.bigBed to s3://encode-public/a.bigBed',
+        'Move in progress file ENCFF910LZK from s3://encode-files/a.bigBed to s3://encode-public/',
+    ]
+    for detail in malformed:
+        with pytest.raises(AuditDetailError):
+            eft._parse_audit_details_for_source_and_destination(('/files/ENCFF910LZK/', detail))
+    mocker.patch.object(eft.eph, 'get_files_in_incorrect_bucket', return_value=[
+        ('/files/ENCFF000AAA/', malformed[2]),
+        parsed_audit,
+    ])
+    files_to_move = eft._get_files_to_move()
+    assert [f['accession'] for f in files_to_move] == ['/files/ENCFF910LZK/']
 
 
 def test_encode_file_transfer_get_files_to_move(server, search_results, mocker):
     import requests
     from encode_file_transfer import EncodeFileTransfer
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         {'@graph': search_results},
         200,
         text=''
@@ -71,8 +99,8 @@ def test_encode_file_transfer_make_bucket_update_url(server):
 def test_encode_file_transfer_update_bucket_on_portal(server, mocker, file_to_move):
     import requests
     from encode_file_transfer import EncodeFileTransfer
-    mocker.patch('requests.patch')
-    requests.patch.return_value = MockResponse(
+    mocker.patch('requests.Session.patch')
+    requests.Session.patch.return_value = MockResponse(
         json_data={
             'status': 'success',
             'old_bucket': 'encode-files',
@@ -106,6 +134,25 @@ def test_encode_file_transfer_wait_for_indexer_waiting(server, mocker):
     assert eft._wait_for_indexer(times=[0, 2, 4])
 
 
+def test_encode_file_transfer_indexer_wait_times(server, mocker):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(
+        server,
+        indexer_wait_initial=10,
+        indexer_wait_max=40,
+        indexer_wait_deadline=100,
+        indexer_wait_jitter=0,
+    )
+    assert list(eft._get_indexer_wait_times()) == [0, 10, 20, 40, 30]
+    eft.indexer_wait_jitter = 0.5
+    for t, expected in zip(eft._get_indexer_wait_times(), [0, 10, 20, 40]):
+        assert expected / 2 <= t <= expected
+    sleep = mocker.patch('encode_file_transfer.transfer.time.sleep')
+    mocker.patch('encode_file_transfer.EncodePortalHelper.is_indexing', return_value=True)
+    assert not eft._wait_for_indexer()
+    assert sum(c.args[0] for c in sleep.call_args_list) == pytest.approx(100)
+
+
 def test_encode_file_transfer_initial_transfer(server):
     from encode_file_transfer import EncodeFileTransfer
     eft = EncodeFileTransfer(server)
@@ -157,3 +204,412 @@ def test_encode_file_transfer_file_does_not_exist_in_source_or_destination(serve
     assert file_to_move['source_bucket'] == 'not-encode-files'
     file_to_move = eft._determine_source(file_to_move)
     assert file_to_move['source_bucket'] == 'igvf-files'
+
+
+def test_encode_file_transfer_workers(server):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server)
+    assert eft.workers == 1
+    eft = EncodeFileTransfer(server, workers=8)
+    assert eft.workers == 8
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_concurrent(server, mocker):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server, workers=4)
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=True)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=[
+        {
+            'accession': '/files/ENCFF{:06d}/'.format(i),
+            'status': 'released',
+        }
+        for i in range(20)
+    ])
+    synced = []
+    mocker.patch.object(eft, '_sync_file', side_effect=lambda i, f: synced.append(f['accession']))
+    assert eft.sync_buckets_and_portal()
+    assert len(synced) == 20
+    assert not eft.failures
+
+
+def test_encode_file_transfer_size_scheduler_order():
+    from encode_file_transfer.transfer import SizeScheduler
+    sizes = [5, None, 100, 1, 300, 50]
+    files = [{'accession': str(i), 'file_size': size} for i, size in enumerate(sizes)]
+    order = []
+    with SizeScheduler(1, large_threshold=100) as scheduler:
+        futures = scheduler.map(lambda i, f: order.append(i) or f['accession'], files)
+    assert order == [4, 2, 5, 0, 3, 1]
+    assert sorted(future.result() for future in futures) == ['0', '1', '2', '3', '4', '5']
+
+
+def test_encode_file_transfer_size_scheduler_large_slots():
+    import threading
+    import time
+    from encode_file_transfer.transfer import SizeScheduler
+    files = [{'accession': str(i), 'file_size': 1000} for i in range(4)]
+    files += [{'accession': str(i), 'file_size': 1} for i in range(4, 12)]
+    scheduler = SizeScheduler(4, large_threshold=100, large_workers=1)
+    lock = threading.Lock()
+    running = {'large': 0, 'max_large': 0}
+    threads = {}
+
+    def sync_file(i, f):
+        large = f['file_size'] >= 100
+        with lock:
+            if large:
+                running['large'] += 1
+                # Only the large slot runs large files while small
+                # files wait.
+                if scheduler.small:
+                    threads.setdefault(True, set()).add(threading.current_thread().name)
+                    running['max_large'] = max(running['max_large'], running['large'])
+        time.sleep(0.01)
+        with lock:
+            if large:
+                running['large'] -= 1
+        if f['accession'] == '5':
+            raise ValueError('Copy failed')
+        return f
+
+    with scheduler:
+        futures = scheduler.map(sync_file, files)
+    assert running['max_large'] == 1
+    assert threads[True] == {'sync-0'}
+    failed = [f['accession'] for future, f in futures.items() if future.exception()]
+    assert failed == ['5']
+
+
+def test_encode_file_transfer_size_scheduler_all_large():
+    import threading
+    from encode_file_transfer.transfer import SizeScheduler
+    files = [{'accession': str(i), 'file_size': 1000} for i in range(16)]
+    # Every worker has to run a large file at once to pass the barrier.
+    barrier = threading.Barrier(8, timeout=5)
+    with SizeScheduler(8, large_threshold=100) as scheduler:
+        futures = scheduler.map(lambda i, f: barrier.wait(), files)
+    assert scheduler.large_workers == 2
+    assert all(future.exception() is None for future in futures)
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_collects_failures(server, mocker, file_to_move):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server, workers=2)
+    files_to_move = []
+    for i in range(3):
+        f = dict(file_to_move)
+        f['accession'] = '/files/ENCFF00{}AAA/'.format(i)
+        f['status'] = 'released'
+        files_to_move.append(f)
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=True)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=files_to_move)
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch.object(eft, '_update_bucket_on_portal')
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch('encode_file_transfer.s3Helper._delete_files', return_value={})
+
+    def move_file(f, initial_transfer=False):
+        if f['accession'] == '/files/ENCFF001AAA/':
+            raise ValueError('Copy failed')
+        return True
+
+    mocker.patch('encode_file_transfer.s3Helper._move_file', side_effect=move_file)
+    with pytest.raises(RuntimeError):
+        eft.sync_buckets_and_portal()
+    assert list(eft.failures) == ['/files/ENCFF001AAA/']
+    assert eft._update_bucket_on_portal.call_count == 2
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_patch_callback_failure(server, mocker, file_to_move):
+    from encode_file_transfer import EncodeFileTransfer
+    from encode_file_transfer.journal import TransferJournal
+    eft = EncodeFileTransfer(server, workers=2)
+    files_to_move = []
+    for i in range(3):
+        f = dict(file_to_move)
+        f['accession'] = '/files/ENCFF00{}AAA/'.format(i)
+        f['status'] = 'released'
+        files_to_move.append(f)
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=True)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=files_to_move)
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch.object(eft, '_update_bucket_on_portal')
+    mocker.patch('encode_file_transfer.s3Helper._move_file', return_value=True)
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch('encode_file_transfer.s3Helper._delete_files', return_value={})
+    record_step = eft._record_step
+
+    def fail_on_delete(f, step, redo=None):
+        # Raised in the delete future's done callback.
+        if step == TransferJournal.DELETED and f['accession'] == '/files/ENCFF002AAA/':
+            raise OSError('Journal write failed')
+        return record_step(f, step, redo=redo)
+
+    mocker.patch.object(eft, '_record_step', side_effect=fail_on_delete)
+    with pytest.raises(RuntimeError):
+        eft.sync_buckets_and_portal()
+    assert list(eft.failures) == ['/files/ENCFF002AAA/']
+    assert isinstance(eft.failures['/files/ENCFF002AAA/'], OSError)
+    assert eft._update_bucket_on_portal.call_count == 2
+
+
+def test_encode_file_transfer_incremental_metadata_tsv(server, mocker, tmp_path):
+    from encode_file_transfer import EncodeFileTransfer
+    fields = ['@id', 'file_set.accession', 'assembly', 'file_format']
+    eft = EncodeFileTransfer(server, fields=fields, incremental=True, snapshot_path=tmp_path / 'snapshot.sqlite')
+    mocker.patch.object(eft.eph, 'iter_file_metadata', return_value=iter([
+        {'@id': '/files/IGVFFI0001AAAA/', 'file_set.accession': 'IGVFDS0002AAAA', 'assembly': None, 'file_format': 'bam'},
+        {'@id': '/files/IGVFFI0002AAAA/', 'file_set.accession': 'IGVFDS0001AAAA', 'assembly': None, 'file_format': 'bam'},
+    ]))
+    manifest = tmp_path / 'manifest.tsv'
+    assert eft._make_incremental_metadata_tsv(manifest) == 2
+    eft.eph.iter_file_metadata.assert_called_once_with()
+    mocker.patch.object(eft.eph, 'iter_file_metadata', return_value=iter([
+        {'@id': '/files/IGVFFI0003AAAA/', 'file_set.accession': 'IGVFDS0001AAAA', 'assembly': None, 'file_format': 'bed'},
+    ]))
+    mocker.patch.object(eft.eph, 'iter_modified_file_ids', return_value=iter([
+        '/files/IGVFFI0003AAAA/',
+        '/files/IGVFFI0001AAAA/',
+    ]))
+    assert eft._make_incremental_metadata_tsv(manifest) == 2
+    assert 'modified_since' in eft.eph.iter_file_metadata.call_args.kwargs
+    assert manifest.read_text() == (
+        '@id\tfile_set.accession\tassembly\tfile_format\n'
+        '/files/IGVFFI0002AAAA/\tIGVFDS0001AAAA\t\tbam\n'
+        '/files/IGVFFI0003AAAA/\tIGVFDS0001AAAA\t\tbed\n'
+    )
+
+
+def test_encode_file_transfer_manifest_formats(server, mocker, tmp_path, metadata_results):
+    import gzip
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server, manifest_formats=['gzip'])
+    parsed_metadata = eft.eph._parse_metadata(metadata_results)
+    manifest = tmp_path / 'igvf_file_manifest.tsv'
+    assert eft._make_metadata_tsv(parsed_metadata, str(manifest)) == 2
+    compressed = tmp_path / 'igvf_file_manifest.tsv.gz'
+    assert gzip.decompress(compressed.read_bytes()).decode() == manifest.read_text()
+    mocker.patch('encode_file_transfer.s3Helper._upload_file_metadata')
+    eft._upload_manifests(str(manifest))
+    keys = [c.kwargs.get('key') for c in eft.s3h._upload_file_metadata.call_args_list]
+    assert keys == [None, 'igvf_file_manifest.tsv.gz']
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_batches_deletes(server, mocker, file_to_move):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server, workers=3)
+    files_to_move = []
+    for i in range(5):
+        f = dict(file_to_move)
+        f['accession'] = '/files/ENCFF00{}AAA/'.format(i)
+        f['source_key'] = '2019/02/09/{}/ENCFF00{}AAA.bigBed'.format(i, i)
+        f['status'] = 'released'
+        files_to_move.append(f)
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=True)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=files_to_move)
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch.object(eft, '_update_bucket_on_portal')
+    mocker.patch('encode_file_transfer.s3Helper._move_file')
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch(
+        'encode_file_transfer.s3Helper._delete_files',
+        return_value={'2019/02/09/3/ENCFF003AAA.bigBed': 'AccessDenied Access Denied'}
+    )
+    with pytest.raises(RuntimeError):
+        eft.sync_buckets_and_portal()
+    eft.s3h._delete_files.assert_called_once()
+    bucket, keys = eft.s3h._delete_files.call_args.args
+    assert bucket == 'encode-files'
+    assert sorted(keys) == sorted(f['source_key'] for f in files_to_move)
+    assert list(eft.failures) == ['/files/ENCFF003AAA/']
+    patched = sorted(c.args[0]['accession'] for c in eft._update_bucket_on_portal.call_args_list)
+    assert patched == ['/files/ENCFF000AAA/', '/files/ENCFF001AAA/', '/files/ENCFF002AAA/', '/files/ENCFF004AAA/']
+
+
+def test_encode_file_transfer_get_files_to_move_file_properties(server, search_results, mocker):
+    import requests
+    from encode_file_transfer import EncodeFileTransfer
+    search_results[0]['md5sum'] = '19e37212a2b8a24a1cfd12ffd50ef257'
+    search_results[0]['file_size'] = 504017
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse({'@graph': search_results}, 200, text='')
+    eft = EncodeFileTransfer(server)
+    files_to_move = eft._get_files_to_move()
+    assert files_to_move[0]['md5sum'] == '19e37212a2b8a24a1cfd12ffd50ef257'
+    assert files_to_move[0]['file_size'] == 504017
+    assert files_to_move[1]['md5sum'] is None
+
+
+def test_encode_file_transfer_sync_file_verification_failure(server, mocker, file_to_move):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server)
+    file_to_move['status'] = 'released'
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch('encode_file_transfer.s3Helper._move_file')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy', side_effect=ValueError('Size mismatch'))
+    with pytest.raises(ValueError):
+        eft._sync_file(0, file_to_move)
+    eft.s3h._tag_file.assert_not_called()
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_resumes_from_journal(server, mocker, file_to_move, tmp_path):
+    from encode_file_transfer import EncodeFileTransfer
+    from encode_file_transfer.journal import TransferJournal
+    path = tmp_path / 'journal.jsonl'
+    files_to_move = []
+    for i in range(3):
+        f = dict(file_to_move)
+        f['accession'] = '/files/ENCFF00{}AAA/'.format(i)
+        f['status'] = 'released'
+        files_to_move.append(f)
+    journal = TransferJournal(path)
+    # Copied and tagged but interrupted before delete.
+    resolved = dict(files_to_move[0], source_bucket='encode-public')
+    journal.record(resolved, TransferJournal.RESOLVED)
+    for step in (TransferJournal.COPIED, TransferJournal.VERIFIED, TransferJournal.TAGGED):
+        journal.record(resolved, step)
+    # Synced before but audited again, so it is synced again.
+    for step in (TransferJournal.RESOLVED, TransferJournal.DELETED, TransferJournal.PATCHED):
+        journal.record(files_to_move[1], step)
+    journal.close()
+    eft = EncodeFileTransfer(server, workers=2, journal_path=path)
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=True)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=files_to_move)
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch.object(eft, '_update_bucket_on_portal')
+    mocker.patch('encode_file_transfer.s3Helper._move_file')
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch('encode_file_transfer.s3Helper._delete_files', return_value={})
+    assert eft.sync_buckets_and_portal()
+    assert eft._determine_source.call_count == 2
+    moved = sorted(c.args[0]['accession'] for c in eft.s3h._move_file.call_args_list)
+    assert moved == ['/files/ENCFF001AAA/', '/files/ENCFF002AAA/']
+    patched = sorted(c.args[0]['accession'] for c in eft._update_bucket_on_portal.call_args_list)
+    assert patched == ['/files/ENCFF000AAA/', '/files/ENCFF001AAA/', '/files/ENCFF002AAA/']
+    assert [c.args[0]['source_bucket'] for c in eft._update_bucket_on_portal.call_args_list if c.args[0]['accession'] == '/files/ENCFF000AAA/'] == ['encode-public']
+    assert path.read_text() == ''
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_s3_while_indexing(server, mocker, file_to_move, tmp_path):
+    from encode_file_transfer import EncodeFileTransfer
+    from encode_file_transfer.journal import TransferJournal
+    path = tmp_path / 'journal.jsonl'
+    eft = EncodeFileTransfer(server, s3_while_indexing=True, journal_path=path)
+    file_to_move['status'] = 'released'
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=False)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=[file_to_move])
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch.object(eft, '_update_bucket_on_portal')
+    mocker.patch('encode_file_transfer.s3Helper._move_file')
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch('encode_file_transfer.s3Helper._delete_files', return_value={})
+    assert not eft.sync_buckets_and_portal()
+    eft.s3h._move_file.assert_called_once()
+    eft.s3h._delete_files.assert_not_called()
+    eft._update_bucket_on_portal.assert_not_called()
+    assert [f['accession'] for f in eft.deferred] == ['/files/ENCFF321OXI/']
+    journal = TransferJournal(path)
+    assert TransferJournal.TAGGED in journal.completed(file_to_move)
+    journal.close()
+    # Indexer idle after copies.
+    eft._wait_for_indexer.side_effect = [False, True]
+    eft.s3h._move_file.reset_mock()
+    assert eft.sync_buckets_and_portal()
+    eft.s3h._move_file.assert_not_called()
+    eft._update_bucket_on_portal.assert_called_once()
+    assert not eft.deferred
+
+
+def test_encode_file_transfer_sync_buckets_and_portal_metrics(server, mocker, file_to_move, tmp_path):
+    import json
+    from encode_file_transfer import EncodeFileTransfer
+    metrics_file = tmp_path / 'metrics.json'
+    eft = EncodeFileTransfer(server, metrics_file=metrics_file)
+    assert eft.eph.metrics is eft.metrics
+    assert eft.s3h.metrics is eft.metrics
+    file_to_move['status'] = 'released'
+    mocker.patch.object(eft, '_wait_for_indexer', return_value=True)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=[file_to_move])
+    mocker.patch.object(eft, '_determine_source', side_effect=lambda f: f)
+    mocker.patch.object(eft, '_update_bucket_on_portal')
+    mocker.patch('encode_file_transfer.s3Helper._move_file')
+    mocker.patch('encode_file_transfer.s3Helper._tag_file')
+    mocker.patch('encode_file_transfer.s3Helper._delete_files', return_value={})
+    mocker.patch('encode_file_transfer.s3Helper._verify_copy', side_effect=ValueError('Size mismatch'))
+    with pytest.raises(RuntimeError):
+        eft.sync_buckets_and_portal()
+    summary = json.loads(metrics_file.read_text())
+    assert summary['run'] == 'sync'
+    assert summary['counters'] == {'files_failed': 1, 'verify_errors': 1}
+    assert summary['stages']['determine_source']['count'] == 1
+
+
+def test_encode_file_transfer_plan_transfers(server, mocker, file_to_move, tmp_path):
+    import csv
+    import json
+    from unittest.mock import MagicMock
+    from botocore.exceptions import ClientError
+    from encode_file_transfer import EncodeFileTransfer
+    mib = 1024 * 1024
+    eft = EncodeFileTransfer(server, workers=2)
+    files_to_move = []
+    for i, source_bucket in enumerate(['igvf-files', 'encode-private', 'encode-private', 'encode-private']):
+        f = dict(file_to_move)
+        f['accession'] = '/files/ENCFF00{}AAA/'.format(i)
+        f['source_bucket'] = source_bucket
+        f['source_key'] = 'a/b/c/{}.bam'.format(i)
+        f['destination_key'] = 'a/b/c/{}.bam'.format(i)
+        f['status'] = 'released'
+        files_to_move.append(f)
+    objects = {
+        ('igvf-files', 'a/b/c/0.bam'): {'ContentLength': 10 * mib, 'ETag': '"abc"'},
+        ('encode-private', 'a/b/c/1.bam'): {'ContentLength': 200 * mib, 'ETag': '"abc-4"'},
+        # Copied and deleted but not patched.
+        ('encode-pds-public-dev', 'a/b/c/2.bam'): {'ContentLength': 5 * mib, 'ETag': '"abc"'},
+    }
+
+    def head_object(Bucket, Key, **kwargs):
+        if (Bucket, Key) not in objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return objects[(Bucket, Key)]
+
+    client = MagicMock()
+    client.head_object.side_effect = head_object
+    mocker.patch.object(eft.s3h, '_get_client', return_value=client)
+    mocker.patch.object(eft, '_get_files_to_move', return_value=files_to_move)
+    plan = eft.plan_transfers()
+    actions = [p['action'] for p in plan['files']]
+    assert actions == ['copy+verify+tag+patch', 'copy+verify+delete+patch', 'patch', 'missing']
+    assert [p['parts'] for p in plan['files']] == [1, 4, 0, 0]
+    # Source resolution HEADs: found in source, source, destination and
+    # none of the three buckets.
+    assert [p['s3_requests'] for p in plan['files']] == [7, 12, 2, 3]
+    summary = plan['summary']
+    assert summary['bytes'] == 210 * mib
+    assert summary['bucket_pairs'] == {
+        'encode-pds-public-dev -> encode-pds-public-dev': {'files': 1, 'bytes': 0},
+        'encode-private -> encode-pds-public-dev': {'files': 1, 'bytes': 200 * mib},
+        'igvf-files -> encode-pds-public-dev': {'files': 1, 'bytes': 10 * mib},
+    }
+    assert summary['requests'] == {'s3': 25, 's3_delete': 1, 'portal_patch': 3}
+    client.copy.assert_not_called()
+    client.delete_objects.assert_not_called()
+    # Copy skipped by initial_transfer, but still verified.
+    objects[('encode-pds-public-dev', 'a/b/c/0.bam')] = objects[('igvf-files', 'a/b/c/0.bam')]
+    eft.initial_transfer = True
+    p = eft._plan_file(files_to_move[0])
+    assert p['action'] == 'verify+tag+patch'
+    assert p['s3_requests'] == 5
+    client.put_object_tagging.assert_not_called()
+    eft.write_plan(plan, tmp_path / 'plan.json')
+    assert json.loads((tmp_path / 'plan.json').read_text())['summary'] == summary
+    eft.write_plan(plan, tmp_path / 'plan.tsv')
+    with open(tmp_path / 'plan.tsv') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    assert [row['action'] for row in rows] == actions
@@ -0,0 +1,90 @@
+import pytest
+
+
+@pytest.fixture
+def list_objects_pages():
+    return {
+        ('igvf-files', '2019/02/09/'): [
+            {
+                'Contents': [
+                    {'Key': '2019/02/09/dc1388a0-7a81-4255-8de1-a1bd186208f8/ENCFF321OXI.bigBed', 'Size': 10, 'ETag': '"abc"'},
+                ]
+            },
+            {
+                'Contents': [
+                    {'Key': '2019/02/09/653cadee-5227-4d22-9aa2-e9945069617a/ENCFF758RFO.bigBed', 'Size': 20, 'ETag': '"def-2"'},
+                ]
+            },
+        ],
+        ('igvf-public', '2019/02/09/'): [{}],
+    }
+
+
+@pytest.fixture
+def inventory_client(mocker, list_objects_pages):
+    client = mocker.Mock()
+
+    def paginate(Bucket, Prefix):
+        return list_objects_pages.get((Bucket, Prefix), [{}])
+
+    client.get_paginator.return_value.paginate.side_effect = paginate
+    return client
+
+
+def test_encode_inventory_get_prefix(inventory_client):
+    from encode_file_transfer.inventory import BucketInventory
+    inventory = BucketInventory(inventory_client)
+    assert inventory._get_prefix('2019/02/09/dc1388a0/ENCFF321OXI.bigBed') == '2019/02/09/'
+    assert inventory._get_prefix('ENCFF321OXI.bigBed') is None
+
+
+def test_encode_inventory_lookup(inventory_client):
+    from encode_file_transfer.inventory import BucketInventory
+    inventory = BucketInventory(inventory_client)
+    key = '2019/02/09/dc1388a0-7a81-4255-8de1-a1bd186208f8/ENCFF321OXI.bigBed'
+    inventory.list_keys(
+        [
+            ('igvf-files', key),
+            ('igvf-files', '2019/02/09/653cadee-5227-4d22-9aa2-e9945069617a/ENCFF758RFO.bigBed'),
+            ('igvf-public', key),
+        ],
+        workers=2
+    )
+    assert inventory_client.get_paginator.return_value.paginate.call_count == 2
+    assert inventory.lookup('igvf-files', key) == {'ContentLength': 10, 'ETag': '"abc"'}
+    assert inventory.lookup('igvf-public', key) is False
+    assert inventory.lookup('igvf-private', key) is None
+    inventory.add('igvf-public', key, {'ContentLength': 10, 'ETag': None})
+    assert inventory.lookup('igvf-public', key)['ContentLength'] == 10
+    inventory.remove('igvf-files', key)
+    assert inventory.lookup('igvf-files', key) is False
+    inventory.list_keys([('igvf-files', key)])
+    assert inventory_client.get_paginator.return_value.paginate.call_count == 2
+
+
+def test_encode_inventory_s3_helper_file_exists(mocker, inventory_client, file_to_move):
+    from encode_file_transfer import s3Helper
+    from encode_file_transfer.inventory import BucketInventory
+    s3h = s3Helper()
+    mocker.patch.object(s3h, '_get_object_metadata', return_value={'ContentLength': 5})
+    s3h.inventory = BucketInventory(inventory_client)
+    s3h.inventory.list_keys([('igvf-files', file_to_move['source_key'])])
+    assert s3h._file_exists('igvf-files', file_to_move['source_key'])
+    assert not s3h._file_exists('igvf-files', '2019/02/09/missing/ENCFF000AAA.bigBed')
+    assert s3h._get_object_size('igvf-files', file_to_move['source_key']) == 10
+    s3h._get_object_metadata.assert_not_called()
+    assert s3h._file_exists('igvf-private', file_to_move['source_key'])
+    s3h._get_object_metadata.assert_called_once()
+
+
+def test_encode_file_transfer_build_inventory(server, mocker, inventory_client, file_to_move):
+    from encode_file_transfer import EncodeFileTransfer
+    eft = EncodeFileTransfer(server, inventory=True)
+    mocker.patch.object(eft.s3h, '_get_client', return_value=inventory_client)
+    inventory = eft._build_inventory([file_to_move])
+    assert eft.s3h.inventory is inventory
+    assert inventory.prefixes == {
+        ('encode-files', '2019/02/09/'),
+        ('encode-pds-public-dev', '2019/02/09/'),
+        ('igvf-files', '2019/02/09/'),
+    }
@@ -0,0 +1,58 @@
+def test_encode_journal_record_and_reload(tmp_path, file_to_move):
+    from encode_file_transfer.journal import TransferJournal
+    path = tmp_path / 'journal.jsonl'
+    journal = TransferJournal(path)
+    assert journal.completed(file_to_move) == set()
+    assert journal.resolved(file_to_move) is None
+    journal.record(file_to_move, TransferJournal.RESOLVED)
+    journal.record(file_to_move, TransferJournal.COPIED)
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"key": "partial')
+    journal = TransferJournal(path)
+    assert journal.completed(file_to_move) == {TransferJournal.RESOLVED, TransferJournal.COPIED}
+    assert journal.resolved(file_to_move) == file_to_move
+    journal.record(file_to_move, TransferJournal.FAILED, redo=TransferJournal.RESOLVED)
+    assert journal.completed(file_to_move) == set()
+    assert journal.resolved(file_to_move) is None
+    journal.close()
+
+
+def test_encode_journal_failures_keep_earlier_steps(tmp_path, file_to_move):
+    from encode_file_transfer.journal import TransferJournal
+    path = tmp_path / 'journal.jsonl'
+    journal = TransferJournal(path)
+    for step in (TransferJournal.RESOLVED, TransferJournal.COPIED, TransferJournal.VERIFIED, TransferJournal.TAGGED):
+        journal.record(file_to_move, step)
+    # Failed delete.
+    journal.record(file_to_move, TransferJournal.FAILED)
+    steps = {TransferJournal.RESOLVED, TransferJournal.COPIED, TransferJournal.VERIFIED, TransferJournal.TAGGED}
+    assert journal.completed(file_to_move) == steps
+    journal.close()
+    journal = TransferJournal(path)
+    assert journal.completed(file_to_move) == steps
+    assert journal.resolved(file_to_move) == file_to_move
+    # A copy that failed verification is redone.
+    journal.record(file_to_move, TransferJournal.FAILED, redo=TransferJournal.COPIED)
+    assert journal.completed(file_to_move) == {TransferJournal.RESOLVED}
+    # Nothing to resume once patched.
+    journal.record(file_to_move, TransferJournal.PATCHED)
+    assert journal.completed(file_to_move) == set()
+    journal.close()
+
+
+def test_encode_journal_max_age_and_reset(tmp_path, file_to_move):
+    from datetime import timedelta
+    from encode_file_transfer.journal import TransferJournal
+    path = tmp_path / 'journal.jsonl'
+    journal = TransferJournal(path)
+    journal.record(file_to_move, TransferJournal.COPIED)
+    journal.close()
+    journal = TransferJournal(path, max_age=timedelta(seconds=-1))
+    assert journal.completed(file_to_move) == set()
+    journal.close()
+    journal = TransferJournal(path)
+    assert journal.completed(file_to_move) == {TransferJournal.COPIED}
+    journal.reset()
+    journal.close()
+    assert path.read_text() == ''
@@ -0,0 +1,111 @@
+import pytest
+
+
+@pytest.fixture
+def manifest_rows():
+    return [
+        {'@id': '/files/IGVFFI0001AAAA/', 'file_set.accession': 'IGVFDS0002', 'assembly': 'GRCh38', 'file_format': 'bam', 'file_size': 10, 'lane': None, 'derived_from': ['/files/IGVFFI0009AAAA/']},
+        {'@id': '/files/IGVFFI0002AAAA/', 'file_set.accession': 'IGVFDS0001', 'assembly': None, 'file_format': 'fastq', 'file_size': 20, 'lane': 1, 'derived_from': None},
+        {'@id': '/files/IGVFFI0003AAAA/', 'file_set.accession': None, 'assembly': 'GRCh38', 'file_format': 'bed', 'file_size': 30, 'lane': 2, 'derived_from': None},
+        {'@id': '/files/IGVFFI0004AAAA/', 'file_set.accession': 'IGVFDS0001', 'assembly': None, 'file_format': 'fastq', 'file_size': 40, 'lane': None, 'derived_from': None},
+        {'@id': '/files/IGVFFI0005AAAA/', 'file_set.accession': 'IGVFDS0002', 'assembly': 'GRCh38', 'file_format': 'bam', 'file_size': 50, 'lane': None, 'derived_from': ['a\tb']},
+        {'@id': '/files/IGVFFI0006AAAA/', 'file_set.accession': 'IGVFDS0001', 'assembly': 'GRCm39', 'file_format': 'fastq', 'file_size': 60, 'lane': 3, 'derived_from': None},
+        {'@id': '/files/IGVFFI0007AAAA/', 'file_set.accession': 'IGVFDS0002', 'assembly': 'GRCh38', 'file_format': 'bam', 'file_size': 70, 'lane': None, 'derived_from': None},
+    ]
+
+
+def _pandas_tsv(rows, fields, filename):
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    df = df.sort_values(
+        by=[
+            'file_set.accession',
+            'assembly',
+            'file_format'
+        ]
+    ).reset_index(drop=True)
+    df[fields].to_csv(filename, sep='\t', index=False)
+
+
+@pytest.mark.parametrize('buffer_size', [1, 2, 3, 100])
+def test_encode_manifest_writer_matches_pandas(manifest_rows, tmp_path, buffer_size):
+    from encode_file_transfer.manifest import ManifestWriter
+    fields = list(manifest_rows[0])
+    expected = tmp_path / 'expected.tsv'
+    actual = tmp_path / 'actual.tsv'
+    _pandas_tsv(manifest_rows, fields, expected)
+    writer = ManifestWriter(fields, buffer_size=buffer_size, tmpdir=tmp_path)
+    assert writer.write(iter(manifest_rows), actual) == len(manifest_rows)
+    assert actual.read_text() == expected.read_text()
+    assert not list(tmp_path.glob('**/*.run'))
+
+
+def test_encode_manifest_writer_metadata_results(server, metadata_results, tmp_path):
+    from encode_file_transfer import EncodePortalHelper
+    from encode_file_transfer.manifest import ManifestWriter
+    eph = EncodePortalHelper(server)
+    parsed_metadata = eph._parse_metadata(metadata_results)
+    expected = tmp_path / 'expected.tsv'
+    actual = tmp_path / 'actual.tsv'
+    _pandas_tsv(parsed_metadata, eph.file_metadata_fields, expected)
+    ManifestWriter(eph.file_metadata_fields, buffer_size=1).write(parsed_metadata, actual)
+    assert actual.read_text() == expected.read_text()
+
+
+def test_encode_manifest_writer_no_rows(tmp_path):
+    from encode_file_transfer.manifest import ManifestWriter
+    actual = tmp_path / 'actual.tsv'
+    assert ManifestWriter(['@id', 'file_set.accession', 'assembly', 'file_format']).write([], actual) == 0
+    assert actual.read_text() == '@id\tfile_set.accession\tassembly\tfile_format\n'
+
+
+def test_encode_manifest_writer_gzip_output(manifest_rows, tmp_path):
+    import gzip
+    from encode_file_transfer.manifest import ManifestWriter, TsvOutput
+    fields = list(manifest_rows[0])
+    writer = ManifestWriter(fields, buffer_size=2)
+    writer.write(manifest_rows, tmp_path / 'manifest.tsv', outputs=[TsvOutput(tmp_path / 'manifest.tsv.gz', compression='gzip')])
+    first = (tmp_path / 'manifest.tsv.gz').read_bytes()
+    assert gzip.decompress(first).decode() == (tmp_path / 'manifest.tsv').read_text()
+    writer.write(manifest_rows, tmp_path / 'manifest.tsv', outputs=[TsvOutput(tmp_path / 'manifest.tsv.gz', compression='gzip')])
+    assert (tmp_path / 'manifest.tsv.gz').read_bytes() == first
+
+
+def test_encode_manifest_writer_zstd_output(manifest_rows, tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    from encode_file_transfer.manifest import ManifestWriter, TsvOutput
+    fields = list(manifest_rows[0])
+    ManifestWriter(fields).write(manifest_rows, tmp_path / 'manifest.tsv', outputs=[TsvOutput(tmp_path / 'manifest.tsv.zst', compression='zstd')])
+    with open(tmp_path / 'manifest.tsv.zst', 'rb') as f:
+        content = zstandard.ZstdDecompressor().stream_reader(f).read().decode()
+    assert content == (tmp_path / 'manifest.tsv').read_text()
+
+
+def test_encode_manifest_writer_parquet_output(manifest_rows, tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+    from encode_file_transfer.manifest import ManifestWriter, ParquetOutput
+    fields = list(manifest_rows[0])
+    ManifestWriter(fields, buffer_size=3).write(
+        manifest_rows,
+        tmp_path / 'manifest.tsv',
+        outputs=[ParquetOutput(tmp_path / 'manifest.parquet', row_group_size=2)]
+    )
+    table = pyarrow.parquet.read_table(tmp_path / 'manifest.parquet', columns=['@id', 'file_size', 'lane'])
+    assert table.num_rows == len(manifest_rows)
+    assert str(table.schema.field('file_size').type) == 'int64'
+    assert str(table.schema.field('lane').type) == 'int64'
+    assert table.column('@id').to_pylist()[:3] == [
+        '/files/IGVFFI0006AAAA/',
+        '/files/IGVFFI0002AAAA/',
+        '/files/IGVFFI0004AAAA/',
+    ]
+    assert table.column('lane').to_pylist()[:3] == [3, 1, None]
+    derived_from = pyarrow.parquet.read_table(tmp_path / 'manifest.parquet', columns=['derived_from'])
+    assert "['/files/IGVFFI0009AAAA/']" in derived_from.column('derived_from').to_pylist()
+
+
+def test_encode_manifest_unknown_compression(tmp_path):
+    from encode_file_transfer.manifest import TsvOutput
+    with pytest.raises(ValueError):
+        TsvOutput(tmp_path / 'manifest.tsv.bz2', compression='bz2')
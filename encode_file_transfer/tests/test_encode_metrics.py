@@ -0,0 +1,42 @@
+import pytest
+
+
+def test_encode_metrics_counters_and_timers():
+    from encode_file_transfer.metrics import RunMetrics
+    metrics = RunMetrics(buckets=[0.5, 1])
+    metrics.inc('bytes_copied', 10)
+    metrics.inc('bytes_copied', 5)
+    metrics.observe('copy', 0.2)
+    metrics.observe('copy', 0.7)
+    metrics.observe('copy', 3)
+    with pytest.raises(ValueError):
+        with metrics.timer('patch'):
+            raise ValueError('Bad response code')
+    summary = metrics.summary()
+    assert summary['counters'] == {'bytes_copied': 15, 'patch_errors': 1}
+    copy = summary['stages']['copy']
+    assert copy['count'] == 3
+    assert copy['sum'] == pytest.approx(3.9)
+    assert copy['min'] == 0.2
+    assert copy['max'] == 3
+    assert copy['buckets'] == {'0.5': 1, '1': 2}
+    assert summary['stages']['patch']['count'] == 1
+
+
+def test_encode_metrics_write(tmp_path):
+    import json
+    from encode_file_transfer.metrics import RunMetrics
+    metrics = RunMetrics(buckets=[1])
+    metrics.run = 'sync'
+    metrics.inc('files_synced', 2)
+    metrics.observe('copy', 0.5)
+    metrics.write_json(tmp_path / 'metrics.json')
+    summary = json.loads((tmp_path / 'metrics.json').read_text())
+    assert summary['run'] == 'sync'
+    assert summary['counters'] == {'files_synced': 2}
+    metrics.write_prometheus(tmp_path / 'metrics.prom')
+    lines = (tmp_path / 'metrics.prom').read_text().splitlines()
+    assert 'igvf_file_transfer_files_synced_total{run="sync"} 2' in lines
+    assert 'igvf_file_transfer_stage_seconds_bucket{run="sync",stage="copy",le="1"} 1' in lines
+    assert 'igvf_file_transfer_stage_seconds_bucket{run="sync",stage="copy",le="+Inf"} 1' in lines
+    assert 'igvf_file_transfer_stage_seconds_count{run="sync",stage="copy"} 1' in lines
@@ -12,8 +12,8 @@ def test_encode_portal_helper_server_init(server):
 def test_encode_server_is_indexing(server, mocker):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         {'is_indexing': True},
         200,
         text=''
@@ -25,8 +25,8 @@ def test_encode_server_is_indexing(server, mocker):
 def test_encode_server_is_not_indexing(server, mocker):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         {'is_indexing': False},
         200,
         text=''
@@ -39,8 +39,8 @@ def test_encode_portal_helper_get_connection_error(server, mocker):
     import requests
     from requests.exceptions import ConnectionError
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.side_effect = ConnectionError()
+    mocker.patch('requests.Session.get')
+    requests.Session.get.side_effect = ConnectionError()
     eph = EncodePortalHelper(server)
     with pytest.raises(ConnectionError):
         eph.is_indexing()
@@ -49,8 +49,8 @@ def test_encode_portal_helper_get_connection_error(server, mocker):
 def test_encode_portal_helper_get_status_code_404_no_search_results(server, mocker, no_search_results):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         no_search_results,
         404,
         text=''
@@ -63,8 +63,8 @@ def test_encode_portal_helper_get_status_code_404_no_search_results(server, mock
 def test_encode_portal_helper_get_status_code_not_200(server, mocker):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         {},
         422,
         text='Access denied'
@@ -77,8 +77,8 @@ def test_encode_portal_helper_get_status_code_not_200(server, mocker):
 def test_encode_portal_helper_patch_server(server, mocker):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.patch')
-    requests.patch.return_value = MockResponse(
+    mocker.patch('requests.Session.patch')
+    requests.Session.patch.return_value = MockResponse(
         {'new_bucket': 'new_test_bucket', 'old_bucket': 'old_test_bucket'},
         200,
         text=''
@@ -93,8 +93,8 @@ def test_encode_portal_helper_patch_connection_error(server, mocker):
     import requests
     from requests.exceptions import ConnectionError
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.patch')
-    requests.patch.side_effect = ConnectionError()
+    mocker.patch('requests.Session.patch')
+    requests.Session.patch.side_effect = ConnectionError()
     eph = EncodePortalHelper(server)
     with pytest.raises(ConnectionError):
         eph._patch(server, {'new_bucket': 'new-test-bucket'}, creds=('ABC', '123'))
@@ -103,8 +103,8 @@ def test_encode_portal_helper_patch_connection_error(server, mocker):
 def test_encode_portal_helper_patch_status_code_not_200(server, mocker):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.patch')
-    requests.patch.return_value = MockResponse(
+    mocker.patch('requests.Session.patch')
+    requests.Session.patch.return_value = MockResponse(
         {},
         422,
         text='Access denied'
@@ -120,6 +120,13 @@ def test_encode_portal_helper_make_audit_query(server):
     assert eph._make_audit_query() == 'https://encode-demo.org/search/?type=File&audit.INTERNAL_ACTION.category=incorrect+file+bucket'
 
 
+def test_encode_portal_helper_make_audit_query_local_server():
+    from encode_file_transfer import EncodePortalHelper
+    eph = EncodePortalHelper('http://127.0.0.1:8000')
+    assert eph._make_audit_query() == 'http://127.0.0.1:8000/search/?type=File&audit.INTERNAL_ACTION.category=incorrect+file+bucket'
+    assert eph._make_metadata_query().startswith('http://127.0.0.1:8000/search/?type=File&')
+
+
 def test_encode_portal_helper_make_audit_query_with_batch(server):
     from encode_file_transfer import EncodePortalHelper
     eph = EncodePortalHelper(server)
@@ -166,8 +173,8 @@ def test_encode_portal_helper_parse_audits(server, search_results):
 def test_encode_portal_helper_get_files_in_incorrect_bucket(server, search_results, mocker):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         {'@graph': search_results},
         200,
         text=''
@@ -229,8 +236,8 @@ def test_encode_portal_helper_parse_metadata(server, metadata_results):
 def test_encode_portal_helper_get_file_metadata(server, mocker, metadata_results):
     import requests
     from encode_file_transfer import EncodePortalHelper
-    mocker.patch('requests.get')
-    requests.get.return_value = MockResponse(
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse(
         {'@graph': metadata_results},
         200,
         text=''
@@ -266,3 +273,316 @@ def test_encode_portal_helper_zero_search_results_false(server, mocker, no_searc
     )
     r = requests.get('https://no_results_found.com')
     assert not eph._zero_search_results(r)
+
+
+def test_encode_portal_helper_session_reused(server):
+    from encode_file_transfer import EncodePortalHelper
+    eph = EncodePortalHelper(server)
+    assert eph.session is eph.session
+
+
+def test_encode_portal_helper_session_retries(server):
+    from encode_file_transfer import EncodePortalHelper
+    eph = EncodePortalHelper(server, workers=16, portal_retries=3, portal_backoff_factor=0.5)
+    adapter = eph.session.get_adapter(server)
+    assert adapter._pool_maxsize == 18
+    assert adapter.max_retries.total == 3
+    assert adapter.max_retries.backoff_factor == 0.5
+    assert 429 in adapter.max_retries.status_forcelist
+    assert 'PATCH' in adapter.max_retries.allowed_methods
+
+
+def test_encode_portal_helper_iter_search_pages(server, mocker, metadata_results):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    mocker.patch('requests.Session.get')
+    requests.Session.get.side_effect = [
+        MockResponse({'@graph': metadata_results}, 200, text=''),
+        MockResponse({'@graph': metadata_results}, 200, text=''),
+        MockResponse({'@graph': metadata_results[:1]}, 200, text=''),
+    ]
+    eph = EncodePortalHelper(server, page_size=2)
+    pages = list(eph._iter_search('https://encode-demo.org/search/?type=File'))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    urls = [c.args[0] for c in requests.Session.get.call_args_list]
+    assert urls == [
+        'https://encode-demo.org/search/?type=File&from=0&limit=2',
+        'https://encode-demo.org/search/?type=File&from=2&limit=2',
+        'https://encode-demo.org/search/?type=File&from=4&limit=2',
+    ]
+
+
+def test_encode_portal_helper_iter_search_pages_with_batch_size(server, mocker, metadata_results):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    mocker.patch('requests.Session.get')
+    requests.Session.get.side_effect = [
+        MockResponse({'@graph': metadata_results}, 200, text=''),
+        MockResponse({'@graph': metadata_results[:1]}, 200, text=''),
+    ]
+    eph = EncodePortalHelper(server, page_size=2, batch_size=3)
+    rows = list(eph.iter_file_metadata())
+    assert len(rows) == 3
+    urls = [c.args[0] for c in requests.Session.get.call_args_list]
+    assert urls[0].endswith('&from=0&limit=2')
+    assert urls[1].endswith('&from=2&limit=1')
+    assert urls[0].count('limit=') == 1
+
+
+def test_encode_portal_helper_iter_search_single_request(server, mocker, search_results):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    mocker.patch('requests.Session.get')
+    requests.Session.get.return_value = MockResponse({'@graph': search_results}, 200, text='')
+    eph = EncodePortalHelper(server, batch_size='all')
+    parsed_audits = list(eph.iter_files_in_incorrect_bucket())
+    assert len(parsed_audits) == 2
+    requests.Session.get.assert_called_once()
+    assert requests.Session.get.call_args.args[0].endswith('&limit=all')
+
+
+def test_encode_portal_helper_field_path_extractor():
+    from encode_file_transfer.portal import FieldPathExtractor
+    extractor = FieldPathExtractor([
+        'accession',
+        'file_size',
+        'derived_from',
+        'file_set.accession',
+        'file_set.samples.accession',
+        'file_set.samples.sample_terms.term_name',
+        'file_set.donors.accession',
+        'workflows.accession',
+    ])
+    data = {
+        'accession': 'IGVFFI0001AAAA',
+        'file_size': 0,
+        'derived_from': [['/files/IGVFFI0002AAAA/']],
+        'file_set': {
+            'accession': 'IGVFDS0001AAAA',
+            'samples': [
+                {'accession': 'IGVFSM0001AAAA', 'sample_terms': [{'term_name': 'K562'}, {'term_name': 'HepG2'}]},
+                {'accession': 'IGVFSM0002AAAA', 'sample_terms': [{'term_name': 'GM12878'}]},
+            ],
+            'donors': [],
+        },
+    }
+    assert extractor(data) == {
+        'accession': 'IGVFFI0001AAAA',
+        'file_size': 0,
+        'derived_from': [['/files/IGVFFI0002AAAA/']],
+        'file_set.accession': 'IGVFDS0001AAAA',
+        'file_set.samples.accession': ['IGVFSM0001AAAA', 'IGVFSM0002AAAA'],
+        'file_set.samples.sample_terms.term_name': ['K562', 'HepG2', 'GM12878'],
+        'file_set.donors.accession': [],
+        'workflows.accession': None,
+    }
+    assert list(extractor(data)) == extractor.fields
+
+
+def test_encode_portal_helper_field_path_extractor_flatten_list():
+    from encode_file_transfer.portal import FieldPathExtractor
+    assert FieldPathExtractor._flatten_list([1, [2, [3, [4]], 5], [], 6]) == [1, 2, 3, 4, 5, 6]
+    assert FieldPathExtractor._flatten_list(['a', None]) == ['a', None]
+
+
+def test_encode_portal_helper_make_metadata_query_modified_since(server):
+    from encode_file_transfer import EncodePortalHelper
+    eph = EncodePortalHelper(server)
+    metadata_query = eph._make_metadata_query(modified_since='2026-10-17T00:00:00+00:00')
+    assert metadata_query.endswith('&last_modified=gte%3A2026-10-17T00%3A00%3A00%2B00%3A00')
+    modified_query = eph._make_modified_query('2026-10-17T00:00:00+00:00')
+    assert modified_query == 'https://encode-demo.org/search/?type=File&field=%40id&last_modified=gte%3A2026-10-17T00%3A00%3A00%2B00%3A00'
+
+
+def test_encode_portal_helper_iter_modified_file_ids(server, mocker):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    mocker.patch(
+        'requests.Session.get',
+        return_value=MockResponse({'@graph': [{'@id': '/files/IGVFFI0001AAAA/'}]}, 200, text='')
+    )
+    for batch_size, page_size, query in [
+        (None, None, '&limit=all'),
+        (2, None, '&limit=all'),
+        (None, 100, '&from=0&limit=100'),
+    ]:
+        eph = EncodePortalHelper(server, batch_size=batch_size, page_size=page_size)
+        assert list(eph.iter_modified_file_ids('2026-10-17T00:00:00+00:00')) == ['/files/IGVFFI0001AAAA/']
+        assert requests.Session.get.call_args.args[0] == eph._make_modified_query('2026-10-17T00:00:00+00:00') + query
+
+
+def test_encode_portal_helper_rate_limiter(mocker):
+    from encode_file_transfer.portal import RateLimiter
+    clock = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    mocker.patch('encode_file_transfer.portal.time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('encode_file_transfer.portal.time.sleep', side_effect=sleep)
+    limiter = RateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.acquire()
+    assert sleeps == []
+    limiter.acquire()
+    assert sleeps == [0.5]
+    RateLimiter(rate=None).acquire()
+    assert sleeps == [0.5]
+
+
+def test_encode_portal_helper_portal_updater():
+    import threading
+    from encode_file_transfer.portal import PortalUpdater
+    threads = set()
+
+    def update(f):
+        threads.add(threading.current_thread().name)
+        return f['accession']
+
+    updater = PortalUpdater(update, workers=2, rate=None)
+    futures = [updater.submit({'accession': str(i)}) for i in range(5)]
+    updater.shutdown()
+    assert [future.result() for future in futures] == ['0', '1', '2', '3', '4']
+    assert all(name.startswith('portal-update') for name in threads)
+
+
+def test_encode_portal_helper_iter_file_metadata_partitioned(server, mocker, metadata_results):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    facets = {
+        '@graph': [],
+        'total': 2,
+        'facets': [
+            {
+                'field': 'file_format',
+                'terms': [
+                    {'key': 'vcf', 'doc_count': 1},
+                    {'key': 'bam', 'doc_count': 1},
+                    {'key': 'bed', 'doc_count': 0},
+                ],
+            },
+        ],
+    }
+
+    def get(url, auth=None):
+        if url.endswith('&limit=0'):
+            return MockResponse(facets, 200, text='')
+        file_format = url.rsplit('&file_format=', 1)[1]
+        return MockResponse(
+            {'@graph': [r for r in metadata_results if r['file_format'] == file_format]},
+            200,
+            text=''
+        )
+
+    mocker.patch('requests.Session.get', side_effect=get)
+    eph = EncodePortalHelper(server, export_workers=2)
+    rows = list(eph.iter_file_metadata())
+    assert sorted(row['@id'] for row in rows) == ['/files/ENCFF322LPX/', '/files/ENCFF525YUW/']
+    urls = [c.args[0] for c in requests.Session.get.call_args_list]
+    assert len(urls) == 3
+    assert not any(url.endswith('file_format=bed') for url in urls)
+    # Facet terms that don't cover every file fall back to one search.
+    facets['total'] = 3
+    requests.Session.get.reset_mock()
+    requests.Session.get.side_effect = [
+        MockResponse(facets, 200, text=''),
+        MockResponse({'@graph': metadata_results}, 200, text=''),
+    ]
+    assert len(list(eph.iter_file_metadata())) == 2
+    assert '&file_format=' not in requests.Session.get.call_args_list[1].args[0]
+
+
+def test_encode_portal_helper_iter_file_metadata_partition_error(server, mocker, metadata_results):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+    facets = {
+        '@graph': [],
+        'total': 2,
+        'facets': [{'field': 'file_format', 'terms': [{'key': 'vcf', 'doc_count': 1}, {'key': 'bam', 'doc_count': 1}]}],
+    }
+
+    def get(url, auth=None):
+        if url.endswith('&limit=0'):
+            return MockResponse(facets, 200, text='')
+        if url.endswith('bam'):
+            return MockResponse({}, 500, text='error')
+        return MockResponse({'@graph': metadata_results[:1]}, 200, text='')
+
+    mocker.patch('requests.Session.get', side_effect=get)
+    eph = EncodePortalHelper(server, export_workers=2)
+    with pytest.raises(ValueError):
+        list(eph.iter_file_metadata())
+
+
+def test_encode_portal_helper_iter_file_metadata_flatten_processes(server, mocker, metadata_results):
+    import requests
+    from encode_file_transfer import EncodePortalHelper
+
+    def get(url, auth=None):
+        start = int(url.split('&from=')[1].split('&')[0])
+        return MockResponse({'@graph': metadata_results[start:start + 1]}, 200, text='')
+
+    mocker.patch('requests.Session.get', side_effect=get)
+    expected = EncodePortalHelper(server)._parse_metadata(metadata_results)
+    eph = EncodePortalHelper(server, flatten_processes=2, page_size=1)
+    try:
+        assert list(eph.iter_file_metadata()) == expected
+        # Pages are requested two ahead, so two past the end here.
+        urls = [c.args[0] for c in requests.Session.get.call_args_list]
+        assert [url.split('&from=')[1] for url in urls] == ['0&limit=1', '1&limit=1', '2&limit=1', '3&limit=1']
+        requests.Session.get.reset_mock()
+        eph.batch_size = 1
+        assert list(eph.iter_file_metadata()) == expected[:1]
+        assert requests.Session.get.call_count == 1
+    finally:
+        eph.close()
+    assert eph._flatten_pool is None
+    assert eph.metrics.counters['metadata_rows'] == 3
+
+
+def test_encode_portal_helper_stream(server, mocker, metadata_results):
+    import io
+    import json
+    import requests
+    pytest.importorskip('ijson')
+    from encode_file_transfer import EncodePortalHelper
+
+    def get(url, auth=None, stream=False):
+        assert stream
+        start = int(url.split('&from=')[1].split('&')[0])
+        r = requests.Response()
+        r.status_code = 200
+        r.raw = io.BytesIO(json.dumps({'@graph': metadata_results[start:start + 3]}).encode())
+        return r
+
+    mocker.patch('requests.Session.get', side_effect=get)
+    metadata = metadata_results * 3
+    metadata_results[:] = metadata
+    expected = EncodePortalHelper(server)._parse_metadata(metadata)
+    eph = EncodePortalHelper(server, stream=True, stream_batch_size=2, page_size=3)
+    assert list(eph.iter_file_metadata()) == expected
+    # Two full pages read in parts, then an empty one.
+    assert requests.Session.get.call_count == 3
+    pages = list(eph._iter_search(eph._make_metadata_query(paginate=True)))
+    assert [len(page) for page in pages] == [2, 1, 2, 1]
+
+
+def test_encode_portal_helper_stream_requires_ijson(server, mocker):
+    from encode_file_transfer import EncodePortalHelper
+    mocker.patch('encode_file_transfer.decoders.ijson', None)
+    EncodePortalHelper(server)
+    with pytest.raises(ValueError):
+        EncodePortalHelper(server, stream=True)
+
+
+def test_encode_portal_helper_flatten_processes_requires_page_size(server):
+    from encode_file_transfer import EncodePortalHelper
+    with pytest.raises(ValueError):
+        EncodePortalHelper(server, flatten_processes=2)
+    eph = EncodePortalHelper(server, flatten_processes=2, page_size=100)
+    try:
+        assert eph._get_flatten_pool()._mp_context.get_start_method() == 'forkserver'
+    finally:
+        eph.close()
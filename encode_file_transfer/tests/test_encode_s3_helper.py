@@ -9,3 +9,263 @@ def test_s3_helper_parse_file_to_move(file_to_move):
     assert sk == '2019/02/09/dc1388a0-7a81-4255-8de1-a1bd186208f8/ENCFF321OXI.bigBed'
     assert db == 'encode-pds-public-dev'
     assert dk == '2019/02/09/dc1388a0-7a81-4255-8de1-a1bd186208f8/ENCFF321OXI.bigBed'
+
+
+def test_s3_helper_max_pool_connections():
+    from encode_file_transfer import s3Helper
+    assert s3Helper().max_pool_connections == 10
+    assert s3Helper(workers=32).max_pool_connections == 320
+    assert s3Helper(workers=32, max_concurrency=2).max_pool_connections == 64
+    assert s3Helper(workers=32, max_pool_connections=64).max_pool_connections == 64
+
+
+def test_s3_helper_get_client_reuses_client(mocker):
+    import boto3
+    from encode_file_transfer import s3Helper
+    mocker.patch('boto3.Session')
+    s3h = s3Helper(aws_creds=('ABC', '123'), max_pool_connections=20)
+    client = s3h._get_client()
+    assert s3h._get_client() is client
+    assert boto3.Session.call_count == 1
+    boto3.Session.return_value.client.assert_called_once()
+    config = boto3.Session.return_value.client.call_args.kwargs['config']
+    assert config.max_pool_connections == 20
+
+
+def test_s3_helper_file_exists(mocker):
+    from botocore.exceptions import ClientError
+    from encode_file_transfer import s3Helper
+    s3h = s3Helper()
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    assert s3h._file_exists('igvf-files', 'a/b.bam')
+    client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+    assert not s3h._file_exists('igvf-files', 'a/b.bam')
+    client.head_object.side_effect = ClientError({'Error': {'Code': '403'}}, 'HeadObject')
+    with pytest.raises(ClientError):
+        s3h._file_exists('igvf-files', 'a/b.bam')
+    assert s3h.metrics.counters == {'head_misses': 1, 'head_errors': 1}
+    assert s3h.metrics.stages['head'].count == 3
+
+
+def test_s3_helper_upload_file_metadata_skips_unchanged(mocker, tmp_path):
+    import hashlib
+    from encode_file_transfer import s3Helper
+    manifest = tmp_path / 'manifest.tsv'
+    manifest.write_text('@id\n/files/IGVFFI0001AAAA/\n')
+    sha256 = hashlib.sha256(manifest.read_bytes()).hexdigest()
+    s3h = s3Helper()
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    client.head_object.return_value = {'ETag': '"abc-2"', 'Metadata': {'sha256': sha256}}
+    assert not s3h._upload_file_metadata(manifest)
+    client.upload_file.assert_not_called()
+    assert s3h._upload_file_metadata(manifest, force=True)
+    assert client.upload_file.call_args.kwargs['ExtraArgs']['Metadata'] == {'sha256': sha256}
+
+
+def test_s3_helper_upload_file_metadata_skips_matching_etag(mocker, tmp_path):
+    import hashlib
+    from encode_file_transfer import s3Helper
+    manifest = tmp_path / 'manifest.tsv'
+    manifest.write_text('@id\n/files/IGVFFI0001AAAA/\n')
+    md5 = hashlib.md5(manifest.read_bytes()).hexdigest()
+    s3h = s3Helper()
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    client.head_object.return_value = {'ETag': '"{}"'.format(md5), 'Metadata': {}}
+    assert not s3h._upload_file_metadata(manifest)
+    client.upload_file.assert_not_called()
+
+
+def test_s3_helper_upload_file_metadata_changed(mocker, tmp_path):
+    from botocore.exceptions import ClientError
+    from encode_file_transfer import s3Helper
+    manifest = tmp_path / 'manifest.tsv'
+    manifest.write_text('@id\n/files/IGVFFI0001AAAA/\n')
+    s3h = s3Helper()
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    client.head_object.return_value = {'ETag': '"abc"', 'Metadata': {'sha256': 'abc'}}
+    assert s3h._upload_file_metadata(manifest)
+    client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+    assert s3h._upload_file_metadata(manifest)
+    assert client.upload_file.call_count == 2
+
+
+def test_s3_helper_get_transfer_config():
+    from encode_file_transfer import s3Helper
+    mib = 1024 * 1024
+    s3h = s3Helper(multipart_threshold=8 * mib, multipart_chunksize=16 * mib, max_concurrency=4)
+    config = s3h._get_transfer_config()
+    assert config.multipart_threshold == 8 * mib
+    assert config.multipart_chunksize == 16 * mib
+    assert config.max_concurrency == 4
+    assert s3h._get_transfer_config(100 * mib).multipart_chunksize == 16 * mib
+    # 500 GB copies in about a thousand parts.
+    assert s3h._get_transfer_config(500 * 1000 * mib).multipart_chunksize == 500 * mib
+    assert s3h._get_transfer_config(50 * 1024 * 1024 * mib).multipart_chunksize == 5 * 1024 * mib
+
+
+def test_s3_helper_move_file_uses_size_config(mocker, file_to_move):
+    from encode_file_transfer import s3Helper
+    mib = 1024 * 1024
+    s3h = s3Helper(verify=False)
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    client.head_object.return_value = {'ContentLength': 200 * 1000 * mib, 'ETag': '"abc-10"'}
+    assert s3h._move_file(file_to_move)
+    args, kwargs = client.copy.call_args
+    assert args[1:] == ('encode-pds-public-dev', file_to_move['destination_key'])
+    assert kwargs['Config'].multipart_chunksize == 200 * mib
+
+
+def test_s3_helper_delete_files(mocker):
+    from encode_file_transfer import s3Helper
+    s3h = s3Helper()
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    client.delete_objects.return_value = {
+        'Errors': [{'Key': 'b', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+    }
+    assert s3h._delete_files('encode-files', ['a', 'b']) == {'b': 'AccessDenied Access Denied'}
+    assert client.delete_objects.call_args.kwargs['Delete'] == {
+        'Objects': [{'Key': 'a'}, {'Key': 'b'}],
+        'Quiet': True,
+    }
+
+
+def test_s3_batch_deleter_batches(mocker, file_to_move):
+    from encode_file_transfer import s3Helper
+    from encode_file_transfer.transfer import s3BatchDeleter
+    s3h = s3Helper()
+    mocker.patch.object(s3h, '_delete_files', return_value={})
+    deleter = s3BatchDeleter(s3h, batch_size=2, flush_interval=3600)
+    futures = []
+    for i in range(5):
+        f = dict(file_to_move)
+        f['source_key'] = 'key{}'.format(i)
+        futures.append(deleter.submit(f))
+    assert [c.args for c in s3h._delete_files.call_args_list] == [
+        ('encode-files', ['key0', 'key1']),
+        ('encode-files', ['key2', 'key3']),
+    ]
+    assert not futures[4].done()
+    deleter.flush()
+    assert s3h._delete_files.call_args.args == ('encode-files', ['key4'])
+    assert all(future.result() is True for future in futures)
+
+
+def test_s3_batch_deleter_skips_original_bucket(mocker, file_to_move):
+    from encode_file_transfer import s3Helper
+    from encode_file_transfer.transfer import s3BatchDeleter
+    s3h = s3Helper()
+    mocker.patch.object(s3h, '_delete_files')
+    deleter = s3BatchDeleter(s3h)
+    file_to_move['source_bucket'] = 'igvf-files'
+    assert deleter.submit(file_to_move).result() is False
+    deleter.flush()
+    s3h._delete_files.assert_not_called()
+
+
+def test_s3_batch_deleter_request_error(mocker, file_to_move):
+    from encode_file_transfer import s3Helper
+    from encode_file_transfer.transfer import s3BatchDeleter
+    s3h = s3Helper()
+    mocker.patch.object(s3h, '_delete_files', side_effect=ValueError('boom'))
+    deleter = s3BatchDeleter(s3h)
+    future = deleter.submit(file_to_move)
+    deleter.flush()
+    with pytest.raises(ValueError):
+        future.result()
+
+
+def test_s3_helper_move_file_keeps_part_layout(mocker, file_to_move):
+    from encode_file_transfer import s3Helper
+    mib = 1024 * 1024
+    s3h = s3Helper()
+    client = mocker.Mock()
+    mocker.patch.object(s3h, '_get_client', return_value=client)
+    client.head_object.side_effect = lambda **kwargs: (
+        {'ContentLength': 8 * mib} if kwargs.get('PartNumber') else {'ContentLength': 100 * mib, 'ETag': '"abc-13"'}
+    )
+    s3h._move_file(file_to_move)
+    config = client.copy.call_args.kwargs['Config']
+    assert config.multipart_chunksize == 8 * mib
+    assert config.multipart_threshold <= 100 * mib
+    client.head_object.side_effect = None
+    client.head_object.return_value = {'ContentLength': 100 * mib, 'ETag': '"abc"'}
+    s3h._move_file(file_to_move)
+    config = client.copy.call_args.kwargs['Config']
+    assert config.multipart_threshold > 100 * mib
+
+
+def _verify_helper(mocker, source, destination):
+    from encode_file_transfer import s3Helper
+    s3h = s3Helper()
+    metadata = {'encode-files': source, 'encode-pds-public-dev': destination}
+    mocker.patch.object(s3h, '_get_object_metadata', side_effect=lambda bucket, key, checksums=False: metadata[bucket])
+    return s3h
+
+
+def test_s3_helper_verify_copy_etag(mocker, file_to_move):
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"abc-2"'}, {'ContentLength': 10, 'ETag': '"abc-2"'})
+    assert s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_size_mismatch(mocker, file_to_move):
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"abc"'}, {'ContentLength': 9, 'ETag': '"abc"'})
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_missing_destination(mocker, file_to_move):
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"abc"'}, None)
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_etag_mismatch(mocker, file_to_move):
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"aaaa-4"'}, {'ContentLength': 10, 'ETag': '"bbbb-4"'})
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+    file_to_move.pop('md5sum', None)
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"aaaa"'}, {'ContentLength': 10, 'ETag': '"bbbb"'})
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_etag_mismatch_kms(mocker, file_to_move):
+    file_to_move.pop('md5sum', None)
+    source = {'ContentLength': 10, 'ETag': '"aaaa"', 'ServerSideEncryption': 'aws:kms'}
+    s3h = _verify_helper(mocker, source, dict(source, ETag='"bbbb"'))
+    assert s3h._verify_copy(file_to_move)
+    s3h.strict_verify = True
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_checksum(mocker, file_to_move):
+    source = {'ContentLength': 10, 'ETag': '"abc-2"', 'ChecksumCRC64NVME': 'x', 'ChecksumType': 'FULL_OBJECT'}
+    s3h = _verify_helper(mocker, source, dict(source, ETag='"def-3"'))
+    assert s3h._verify_copy(file_to_move)
+    s3h = _verify_helper(mocker, source, dict(source, ETag='"def-3"', ChecksumCRC64NVME='y'))
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_md5sum(mocker, file_to_move):
+    file_to_move['md5sum'] = '19e37212a2b8a24a1cfd12ffd50ef257'
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"abc-2"'}, {'ContentLength': 10, 'ETag': '"19e37212a2b8a24a1cfd12ffd50ef257"'})
+    assert s3h._verify_copy(file_to_move)
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"abc-2"'}, {'ContentLength': 10, 'ETag': '"def"'})
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
+
+
+def test_s3_helper_verify_copy_size_only(mocker, file_to_move):
+    s3h = _verify_helper(mocker, {'ContentLength': 10, 'ETag': '"abc-2"'}, {'ContentLength': 10, 'ETag': '"def-3"'})
+    assert s3h._verify_copy(file_to_move)
+    s3h.strict_verify = True
+    with pytest.raises(ValueError):
+        s3h._verify_copy(file_to_move)
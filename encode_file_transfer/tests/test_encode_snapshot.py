@@ -0,0 +1,51 @@
+import pytest
+
+
+@pytest.fixture
+def snapshot_rows():
+    return [
+        {'@id': '/files/IGVFFI0001AAAA/', 'file_size': 1, 'derived_from': ['/files/IGVFFI0002AAAA/']},
+        {'@id': '/files/IGVFFI0002AAAA/', 'file_size': 2, 'derived_from': None},
+        {'@id': '/files/IGVFFI0003AAAA/', 'file_size': 3.5, 'derived_from': None},
+    ]
+
+
+def test_encode_snapshot_replace(tmp_path, snapshot_rows):
+    from datetime import timedelta
+    from encode_file_transfer.snapshot import ManifestSnapshot
+    snapshot = ManifestSnapshot(tmp_path / 'snapshot.sqlite', ['@id', 'file_size'])
+    assert snapshot.needs_full_refresh(timedelta(days=7))
+    assert snapshot.replace(snapshot_rows, '2026-10-17T00:00:00+00:00') == 3
+    assert snapshot.since == '2026-10-17T00:00:00+00:00'
+    assert not snapshot.needs_full_refresh(timedelta(days=7))
+    assert snapshot.needs_full_refresh(timedelta(seconds=-1))
+    assert list(snapshot.rows()) == snapshot_rows
+    snapshot.close()
+    snapshot = ManifestSnapshot(tmp_path / 'snapshot.sqlite', ['@id', 'file_size'])
+    assert len(snapshot) == 3
+    snapshot.close()
+    snapshot = ManifestSnapshot(tmp_path / 'snapshot.sqlite', ['@id'])
+    assert snapshot.needs_full_refresh(timedelta(days=7))
+
+
+def test_encode_snapshot_update(tmp_path, snapshot_rows):
+    from encode_file_transfer.snapshot import ManifestSnapshot
+    snapshot = ManifestSnapshot(tmp_path / 'snapshot.sqlite', ['@id', 'file_size'])
+    snapshot.replace(snapshot_rows, '2026-10-17T00:00:00+00:00')
+    upserted, removed = snapshot.update(
+        [
+            {'@id': '/files/IGVFFI0004AAAA/', 'file_size': 4, 'derived_from': None},
+            {'@id': '/files/IGVFFI0001AAAA/', 'file_size': 10, 'derived_from': None},
+        ],
+        ['/files/IGVFFI0002AAAA/', '/files/IGVFFI0009AAAA/'],
+        '2026-10-18T00:00:00+00:00'
+    )
+    assert (upserted, removed) == (2, 1)
+    assert snapshot.since == '2026-10-18T00:00:00+00:00'
+    assert '/files/IGVFFI0002AAAA/' not in snapshot
+    assert [row['@id'] for row in snapshot.rows()] == [
+        '/files/IGVFFI0001AAAA/',
+        '/files/IGVFFI0003AAAA/',
+        '/files/IGVFFI0004AAAA/',
+    ]
+    assert next(snapshot.rows())['file_size'] == 10
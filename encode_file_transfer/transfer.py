@@ -1,25 +1,82 @@
 import boto3
+import csv
+import hashlib
+import json
 import logging
+import os
+import random
+import re
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from collections import deque
+from functools import partial
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from urllib.parse import (
     urlparse,
     urljoin,
 )
-import pandas as pd
 from .interface import (
     PORTAL_CREDS,
     BUCKET_UPDATE,
     ORIGINAL_BUCKET,
     PUBLIC_BUCKET,
     BATCH_SIZE,
+    WORKERS,
+    LARGE_FILE_THRESHOLD,
+    MAX_POOL_CONNECTIONS,
+    MULTIPART_THRESHOLD,
+    MULTIPART_CHUNKSIZE,
+    MULTIPART_TARGET_PARTS,
+    MAX_MULTIPART_CHUNKSIZE,
+    MAX_CONCURRENCY,
+    MAX_COPY_OBJECT_SIZE,
+    CHECKSUM_KEYS,
+    DELETE_BATCH_SIZE,
+    DELETE_FLUSH_INTERVAL,
     LOGFILE,
     METADATA_TSV,
     LOCAL_METADATA_TSV,
-    GLACIER_TAG_SET
+    MANIFEST_FORMATS,
+    MANIFEST_BUFFER_SIZE,
+    LOCAL_SNAPSHOT,
+    INCREMENTAL_OVERLAP_HOURS,
+    INCREMENTAL_FULL_REFRESH_DAYS,
+    GLACIER_TAG_SET,
+    MANIFEST_HASH_METADATA_KEY,
+    PATCH_WORKERS,
+    PATCH_RATE,
+    PATCH_BURST,
+    INDEXER_WAIT_INITIAL,
+    INDEXER_WAIT_MAX,
+    INDEXER_WAIT_FACTOR,
+    INDEXER_WAIT_JITTER,
+    INDEXER_WAIT_DEADLINE,
+)
+from .portal import (
+    EncodePortalHelper,
+    PortalUpdater,
+)
+from .manifest import (
+    ManifestWriter,
+    ParquetOutput,
+    TsvOutput,
 )
-from .portal import EncodePortalHelper
+from .snapshot import ManifestSnapshot
+from .inventory import BucketInventory
+from .journal import TransferJournal
+from .metrics import RunMetrics
 
 
 def logger(filename):
@@ -32,11 +89,41 @@ LOGFILE = LOGFILE.format(datetime.today().strftime('%Y-%m-%d-%Hh-%Mm-%Ss'))
 log = logger(LOGFILE)
 
 
+# Move <status> file <accession> from s3://<bucket>/<key> to s3://<bucket>/<key>
+AUDIT_DETAIL = re.compile(
+    r'Move (.+?) file \S+ from s3://([^/\s]+)/(\S+) to s3://([^/\s]+)/(\S+)'
+)
+
+
+class AuditDetailError(ValueError):
+    pass
+
+
 class s3Helper():
 
     def __init__(self, original_bucket=ORIGINAL_BUCKET, **kwargs):
         self.original_bucket = original_bucket
         self.awsid, self.awspw = kwargs.get('aws_creds', (None, None))
+        self.multipart_threshold = kwargs.get('multipart_threshold') or MULTIPART_THRESHOLD
+        self.multipart_chunksize = kwargs.get('multipart_chunksize') or MULTIPART_CHUNKSIZE
+        self.max_concurrency = kwargs.get('max_concurrency') or MAX_CONCURRENCY
+        # Leave a pooled connection for every transfer thread of every
+        # sync worker.
+        self.max_pool_connections = kwargs.get('max_pool_connections') or max(
+            MAX_POOL_CONNECTIONS,
+            (kwargs.get('workers') or 0) * self.max_concurrency
+        )
+        self._client = None
+        self._client_lock = threading.Lock()
+        # S3 compatible endpoint, e.g. a local stand-in for benchmarks.
+        self.endpoint_url = kwargs.get('endpoint_url')
+        self.metrics = kwargs.get('metrics') or RunMetrics()
+        # Optional BucketInventory answering existence checks locally.
+        self.inventory = None
+        # Verify copies before deleting sources. Copies keep the source
+        # part layout so their ETags can be compared.
+        self.verify = kwargs.get('verify', True)
+        self.strict_verify = kwargs.get('strict_verify', False)
 
     @staticmethod
     def _parse_file_to_move(file_to_move):
@@ -57,19 +144,128 @@ class s3Helper():
         )
         return session
 
+    def _get_client(self):
+        '''
+        Lazily create one S3 client shared by all operations. Clients
+        (unlike resources) are thread-safe, so workers share its
+        connection pool.
+        '''
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._get_session().client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        config=Config(
+                            max_pool_connections=self.max_pool_connections
+                        )
+                    )
+        return self._client
+
+    def _get_transfer_config(self, size=None):
+        '''
+        Multipart settings for an object of size bytes. Large objects get
+        bigger parts so a copy is about MULTIPART_TARGET_PARTS requests.
+        '''
+        chunksize = self.multipart_chunksize
+        if size:
+            mib = 1024 * 1024
+            target = -(-size // MULTIPART_TARGET_PARTS)
+            # Round up to a whole MiB.
+            target = -(-target // mib) * mib
+            chunksize = min(max(chunksize, target), MAX_MULTIPART_CHUNKSIZE)
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=chunksize,
+            max_concurrency=self.max_concurrency,
+        )
+
+    @staticmethod
+    def _get_part_count(etag):
+        '''
+        Number of parts from a multipart ETag, None if uploaded in one part.
+        '''
+        etag = (etag or '').strip('"')
+        if '-' not in etag:
+            return None
+        return int(etag.rsplit('-', 1)[1])
+
+    def _get_layout_transfer_config(self, bucket, key, metadata):
+        '''
+        Transfer settings that copy bucket/key with the same part layout,
+        so the destination ETag matches the source ETag.
+        '''
+        size = metadata['ContentLength']
+        if self._get_part_count(metadata.get('ETag')) is None:
+            if size > MAX_COPY_OBJECT_SIZE:
+                return None
+            return TransferConfig(
+                multipart_threshold=size + 1,
+                max_concurrency=self.max_concurrency,
+            )
+        part_size = self._get_client().head_object(
+            Bucket=bucket,
+            Key=key,
+            PartNumber=1
+        )['ContentLength']
+        return TransferConfig(
+            multipart_threshold=min(self.multipart_threshold, size),
+            multipart_chunksize=part_size,
+            max_concurrency=self.max_concurrency,
+        )
+
+    def _get_copy_part_count(self, metadata):
+        '''
+        Number of copy requests _move_file would make for an object with
+        metadata: 1 for CopyObject, otherwise UploadPartCopy parts.
+        '''
+        size = metadata['ContentLength']
+        parts = self._get_part_count(metadata.get('ETag')) if self.verify else None
+        if parts is not None:
+            return parts
+        if self.verify and size <= MAX_COPY_OBJECT_SIZE:
+            return 1
+        if size < self.multipart_threshold:
+            return 1
+        config = self._get_transfer_config(size)
+        return -(-size // config.multipart_chunksize)
+
+    def _lookup_inventory(self, bucket, key):
+        if self.inventory is None:
+            return None
+        return self.inventory.lookup(bucket, key)
+
+    def _get_object_size(self, bucket, key):
+        metadata = self._lookup_inventory(bucket, key)
+        if metadata is None:
+            metadata = self._get_object_metadata(bucket, key)
+        return metadata['ContentLength'] if metadata else None
+
+    def _get_object_metadata(self, bucket, key, checksums=False):
+        '''
+        HEAD bucket/key. Returns None if it doesn't exist.
+        '''
+        kwargs = {'ChecksumMode': 'ENABLED'} if checksums else {}
+        # Missing objects are expected while resolving sources, so they
+        # count as misses rather than head errors.
+        with self.metrics.timer('head'):
+            try:
+                return self._get_client().head_object(Bucket=bucket, Key=key, **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] != '404':
+                    raise e
+        self.metrics.inc('head_misses')
+        return None
+
     def _file_exists(self, bucket, key):
         '''
-        Check to see if bucket/key exists.
+        Check to see if bucket/key exists, using the inventory if it
+        covers bucket/key and HEAD otherwise.
         '''
-        session = self._get_session()
-        s3 = session.resource('s3')
-        try:
-            s3.Object(bucket, key).load()
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                return False
-            raise e
-        return True
+        known = self._lookup_inventory(bucket, key)
+        if known is not None:
+            return known is not False
+        return self._get_object_metadata(bucket, key) is not None
 
     def _move_file(self, file_to_move, initial_transfer=False):
         '''
@@ -85,20 +281,88 @@ class s3Helper():
         if sb == db and sk == dk:
             log.warning('Source and destination same. Skipping move!')
             return True
-        session = self._get_session()
-        s3 = session.resource('s3')
         source = {
             'Bucket': sb,
             'Key': sk,
         }
+        config = None
+        if self.verify:
+            metadata = self._lookup_inventory(sb, sk) or self._get_object_metadata(sb, sk)
+            size = metadata['ContentLength'] if metadata else None
+            if metadata and metadata.get('ETag'):
+                config = self._get_layout_transfer_config(sb, sk, metadata)
+        else:
+            size = self._get_object_size(sb, sk)
+        config = config or self._get_transfer_config(size)
         log.warning('Copying {}/{} to {}/{}'.format(sb, sk, db, dk))
-        s3.meta.client.copy(source, db, dk)
+        with self.metrics.timer('copy'):
+            self._get_client().copy(source, db, dk, Config=config)
+        self.metrics.inc('files_copied')
+        self.metrics.inc('bytes_copied', size or 0)
+        if self.inventory is not None:
+            self.inventory.add(db, dk, {'ContentLength': size, 'ETag': None})
         return True
 
-    def _delete_file(self, file_to_move):
+    def _verify_copy(self, file_to_move):
         '''
-        Delete file from source bucket.
+        Check destination matches source using metadata only: size, then
+        ETag, then additional checksums, then the portal md5sum. Raises
+        ValueError on a mismatch. ETags with the same part count must
+        match unless either object is SSE-KMS encrypted, since its ETag
+        isn't an MD5 of the content. Copies only verified by size pass
+        unless strict_verify is set.
         '''
+        sb, sk, db, dk = self._parse_file_to_move(file_to_move)
+        if sb == db and sk == dk:
+            return True
+        source = self._get_object_metadata(sb, sk, checksums=True)
+        destination = self._get_object_metadata(db, dk, checksums=True)
+        if source is None or destination is None:
+            raise ValueError(
+                'Cannot verify copy, {} missing'.format(
+                    '{}/{}'.format(sb, sk) if source is None else '{}/{}'.format(db, dk)
+                )
+            )
+        if source['ContentLength'] != destination['ContentLength']:
+            raise ValueError(
+                'Size mismatch {}/{} ({}) and {}/{} ({})'.format(
+                    sb, sk, source['ContentLength'], db, dk, destination['ContentLength']
+                )
+            )
+        if source.get('ETag') and source.get('ETag') == destination.get('ETag'):
+            return True
+        kms = any(x.get('ServerSideEncryption') == 'aws:kms' for x in (source, destination))
+        if (
+            source.get('ETag')
+            and destination.get('ETag')
+            and not kms
+            and self._get_part_count(source['ETag']) == self._get_part_count(destination['ETag'])
+        ):
+            raise ValueError('ETag mismatch {}/{} and {}/{}'.format(sb, sk, db, dk))
+        for checksum in CHECKSUM_KEYS:
+            if source.get(checksum) and destination.get(checksum):
+                if source[checksum] == destination[checksum]:
+                    return True
+                full_object = [
+                    x.get('ChecksumType') == 'FULL_OBJECT'
+                    for x in (source, destination)
+                ]
+                if all(full_object):
+                    raise ValueError(
+                        '{} mismatch {}/{} and {}/{}'.format(checksum, sb, sk, db, dk)
+                    )
+        md5sum = file_to_move.get('md5sum')
+        etag = destination.get('ETag', '').strip('"')
+        if md5sum and self._get_part_count(etag) is None:
+            if etag == md5sum:
+                return True
+            raise ValueError('md5sum mismatch {}/{}'.format(db, dk))
+        if self.strict_verify:
+            raise ValueError('Could not verify {}/{} beyond size'.format(db, dk))
+        log.warning('Only size verified for {}/{}'.format(db, dk))
+        return True
+
+    def _should_delete(self, file_to_move):
         sb, sk, db, dk = self._parse_file_to_move(file_to_move)
         if sb == self.original_bucket:
             log.warning('Not deleting from {}'.format(self.original_bucket))
@@ -106,12 +370,46 @@ class s3Helper():
         if sb == db and sk == dk:
             log.warning('Source and destination same. Skipping delete!')
             return False
+        return True
+
+    def _delete_file(self, file_to_move):
+        '''
+        Delete file from source bucket.
+        '''
+        if not self._should_delete(file_to_move):
+            return False
+        sb, sk, db, dk = self._parse_file_to_move(file_to_move)
         log.warning('Deleting {}/{}'.format(sb, sk))
-        session = self._get_session()
-        s3 = session.resource('s3')
-        s3.Object(sb, sk).delete()
+        self._get_client().delete_object(Bucket=sb, Key=sk)
+        if self.inventory is not None:
+            self.inventory.remove(sb, sk)
         return True
 
+    def _delete_files(self, bucket, keys):
+        '''
+        Delete up to 1000 keys from bucket in one request. Returns
+        {key: error message} for keys that failed.
+        '''
+        log.warning('Deleting {} files from {}'.format(len(keys), bucket))
+        with self.metrics.timer('delete'):
+            r = self._get_client().delete_objects(
+                Bucket=bucket,
+                Delete={
+                    'Objects': [{'Key': key} for key in keys],
+                    'Quiet': True,
+                }
+            )
+        errors = {
+            error['Key']: '{} {}'.format(error.get('Code'), error.get('Message'))
+            for error in r.get('Errors', [])
+        }
+        self.metrics.inc('objects_deleted', len(keys) - len(errors))
+        if self.inventory is not None:
+            for key in keys:
+                if key not in errors:
+                    self.inventory.remove(bucket, key)
+        return errors
+
     def _tag_file(self, file_to_move):
         '''
         Maybe tag s3 object to be moved to glacier storage. 
@@ -120,8 +418,6 @@ class s3Helper():
         if sb != self.original_bucket:
             log.warning('Object not in {}. Skipping tag!'.format(self.original_bucket))
             return False
-        session = self._get_session()
-        s3 = session.resource('s3')
         log.warning(
             'Tagging {}/{} with: {}'.format(
                 sb,
@@ -129,26 +425,220 @@ class s3Helper():
                 GLACIER_TAG_SET
             )
         )
-        s3.meta.client.put_object_tagging(
-            Bucket=sb,
-            Key=sk,
-            Tagging=GLACIER_TAG_SET
-        )
+        with self.metrics.timer('tag'):
+            self._get_client().put_object_tagging(
+                Bucket=sb,
+                Key=sk,
+                Tagging=GLACIER_TAG_SET
+            )
         return True
 
-    def _upload_file_metadata(self, localmanifest=LOCAL_METADATA_TSV):
+    @staticmethod
+    def _hash_file(path, chunk_size=1024 * 1024):
+        '''
+        Returns (sha256, md5) hex digests of local file.
+        '''
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+                md5.update(chunk)
+        return sha256.hexdigest(), md5.hexdigest()
+
+    @staticmethod
+    def _object_matches_hash(metadata, sha256, md5):
+        if metadata.get('Metadata', {}).get(MANIFEST_HASH_METADATA_KEY) == sha256:
+            return True
+        # ETag is the md5 of the content unless uploaded in parts.
+        etag = metadata.get('ETag', '').strip('"')
+        return '-' not in etag and etag == md5
+
+    def _upload_file_metadata(self, localmanifest=LOCAL_METADATA_TSV, force=False, key=METADATA_TSV):
+        '''
+        Upload manifest unless the object in s3 already has the same
+        content. Returns False if upload was skipped.
+        '''
+        sha256, md5 = self._hash_file(localmanifest)
+        if not force:
+            existing = self._get_object_metadata(PUBLIC_BUCKET, key)
+            if existing and self._object_matches_hash(existing, sha256, md5):
+                log.warning('File manifest {} unchanged. Skipping upload!'.format(key))
+                return False
         log.warning('Uploading file manifest {} to s3'.format(localmanifest))
-        session = self._get_session()
-        s3 = session.resource('s3')
-        s3.meta.client.upload_file(
-            localmanifest,
-            PUBLIC_BUCKET,
-            METADATA_TSV,
-            ExtraArgs={'ACL': 'bucket-owner-full-control'}
-        )
+        size = os.path.getsize(localmanifest)
+        with self.metrics.timer('upload'):
+            self._get_client().upload_file(
+                localmanifest,
+                PUBLIC_BUCKET,
+                key,
+                ExtraArgs={
+                    'ACL': 'bucket-owner-full-control',
+                    'Metadata': {MANIFEST_HASH_METADATA_KEY: sha256},
+                },
+                Config=self._get_transfer_config(size)
+            )
+        self.metrics.inc('bytes_uploaded', size)
         return True
 
 
+class s3BatchDeleter():
+    '''
+    Queues source objects to delete and removes them with DeleteObjects
+    in batches per bucket. Submitting a file returns a Future resolved
+    once its object is deleted (True), didn't need deleting (False) or
+    failed to delete (exception). Batches are sent when full, when
+    flush_interval seconds have passed since the last flush and on flush.
+    '''
+
+    def __init__(self, s3h, batch_size=DELETE_BATCH_SIZE, flush_interval=DELETE_FLUSH_INTERVAL):
+        self.s3h = s3h
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def submit(self, file_to_move):
+        future = Future()
+        if not self.s3h._should_delete(file_to_move):
+            future.set_result(False)
+            return future
+        sb, sk, _, _ = self.s3h._parse_file_to_move(file_to_move)
+        with self.lock:
+            self.pending.setdefault(sb, []).append((sk, future))
+            full = [
+                bucket
+                for bucket, items in self.pending.items()
+                if len(items) >= self.batch_size
+            ]
+            due = time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+        for bucket in full:
+            self._flush_bucket(bucket)
+        return future
+
+    def _flush_bucket(self, bucket):
+        with self.lock:
+            items = self.pending.get(bucket, [])
+            batch, rest = items[:self.batch_size], items[self.batch_size:]
+            if rest:
+                self.pending[bucket] = rest
+            else:
+                self.pending.pop(bucket, None)
+        if not batch:
+            return
+        try:
+            errors = self.s3h._delete_files(bucket, [key for key, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for key, future in batch:
+            if key in errors:
+                future.set_exception(
+                    RuntimeError('Failed to delete {}/{}: {}'.format(bucket, key, errors[key]))
+                )
+            else:
+                future.set_result(True)
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        while self.pending:
+            for bucket in list(self.pending):
+                self._flush_bucket(bucket)
+
+
+class SizeScheduler():
+    '''
+    Runs fn(i, f) for each file on workers threads, largest files first.
+    While small files are waiting, files of at least large_threshold
+    bytes only run on the first large_workers threads, so a few huge
+    copies can't hold every worker. Those threads take small files once
+    no large files are left and every thread takes large files once no
+    small files are left. Files of unknown size count as small. map
+    returns {Future: file} like submitting to an executor.
+    '''
+
+    def __init__(self, workers, large_threshold=LARGE_FILE_THRESHOLD, large_workers=None, get_size=None):
+        self.workers = max(workers, 1)
+        self.large_threshold = large_threshold
+        if large_workers is None:
+            large_workers = self.workers // 4
+        self.large_workers = min(max(large_workers, 1), self.workers)
+        self.get_size = get_size or (lambda f: f.get('file_size'))
+        self.large = deque()
+        self.small = deque()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def _is_large(self, size):
+        return size is not None and size >= self.large_threshold
+
+    def _next(self, takes_large):
+        with self.lock:
+            if self.large and (takes_large or not self.small):
+                return self.large.popleft()
+            if self.small:
+                return self.small.popleft()
+            return None
+
+    def _work(self, fn, takes_large):
+        while True:
+            item = self._next(takes_large)
+            if item is None:
+                return
+            _, i, f, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(i, f))
+            except Exception as e:
+                future.set_exception(e)
+
+    def map(self, fn, files):
+        large = []
+        small = []
+        for i, f in enumerate(files):
+            size = self.get_size(f)
+            item = (size or 0, i, f, Future())
+            (large if self._is_large(size) else small).append(item)
+        for items in (large, small):
+            items.sort(key=lambda item: (-item[0], item[1]))
+        log.warning(
+            'Scheduling {} large files on {} of {} workers'.format(
+                len(large),
+                self.large_workers,
+                self.workers
+            )
+        )
+        self.large.extend(large)
+        self.small.extend(small)
+        futures = {future: f for _, _, f, future in large + small}
+        for n in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                args=(fn, n < self.large_workers),
+                name='sync-{}'.format(n),
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+        return futures
+
+    def shutdown(self):
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
+
+
 class EncodeFileTransfer():
 
     def __init__(self, server, original_bucket=ORIGINAL_BUCKET, initial_transfer=False, **kwargs):
@@ -170,10 +660,38 @@ class EncodeFileTransfer():
         '''
         self.original_bucket = original_bucket
         self.server = server
+        # Shared by the helpers so one summary covers the whole run.
+        self.metrics = kwargs['metrics'] = kwargs.get('metrics') or RunMetrics()
+        self.metrics_file = kwargs.get('metrics_file')
+        self.prometheus_file = kwargs.get('prometheus_file')
         self.eph = EncodePortalHelper(server, **kwargs)
         self.s3h = s3Helper(**kwargs)
         self.files_to_move = None
         self.initial_transfer = initial_transfer
+        self.workers = kwargs.get('workers') or WORKERS
+        self.large_file_threshold = kwargs.get('large_file_threshold') or LARGE_FILE_THRESHOLD
+        self.large_file_workers = kwargs.get('large_file_workers')
+        self.patch_workers = kwargs.get('patch_workers') or PATCH_WORKERS
+        self.patch_rate = kwargs.get('patch_rate', PATCH_RATE)
+        self.patch_burst = kwargs.get('patch_burst') or PATCH_BURST
+        self.indexer_wait_initial = kwargs.get('indexer_wait_initial', INDEXER_WAIT_INITIAL)
+        self.indexer_wait_max = kwargs.get('indexer_wait_max', INDEXER_WAIT_MAX)
+        self.indexer_wait_factor = kwargs.get('indexer_wait_factor', INDEXER_WAIT_FACTOR)
+        self.indexer_wait_jitter = kwargs.get('indexer_wait_jitter', INDEXER_WAIT_JITTER)
+        self.indexer_wait_deadline = kwargs.get('indexer_wait_deadline', INDEXER_WAIT_DEADLINE)
+        self.s3_while_indexing = kwargs.get('s3_while_indexing', False)
+        self._failures_lock = threading.Lock()
+        self.manifest_buffer_size = kwargs.get('manifest_buffer_size') or MANIFEST_BUFFER_SIZE
+        self.incremental = kwargs.get('incremental', False)
+        self.snapshot_path = kwargs.get('snapshot_path') or LOCAL_SNAPSHOT
+        self.manifest_path = kwargs.get('manifest_path') or LOCAL_METADATA_TSV
+        self.force_upload = kwargs.get('force_upload', False)
+        self.manifest_formats = kwargs.get('manifest_formats') or []
+        self.use_inventory = kwargs.get('inventory', False)
+        self.journal_path = kwargs.get('journal_path')
+        self.journal = None
+        self.failures = {}
+        self.deferred = []
 
     @staticmethod
     def _parse_s3_to_bucket_and_key(s3_uri):
@@ -184,35 +702,48 @@ class EncodeFileTransfer():
         return {'Bucket': bucket, 'Key': key}
 
     def _parse_audit_details_for_source_and_destination(self, parsed_audits):
-        accession, audit_detail = parsed_audits
-        status = audit_detail.split('Move')[1].split(' ')[1]
-        audit_split = audit_detail.split(' to ')
-        source_s3_uri_parsed = self._parse_s3_to_bucket_and_key(
-            audit_split[0].split(' from ')[-1]
-        )
-        destination_s3_uri_parsed = self._parse_s3_to_bucket_and_key(
-            audit_split[-1]
-        )
+        accession, audit_detail = parsed_audits[:2]
+        # Optional file properties, e.g. md5sum, from the audit search.
+        file_properties = parsed_audits[2] if len(parsed_audits) > 2 else {}
+        match = AUDIT_DETAIL.fullmatch(audit_detail or '')
+        if match is None:
+            raise AuditDetailError(
+                'Malformed incorrect file bucket audit on {}: {!r}'.format(
+                    accession,
+                    audit_detail
+                )
+            )
+        status, source_bucket, source_key, destination_bucket, destination_key = match.groups()
         return {
             'accession': accession,
             'status': status,
-            'source_bucket': source_s3_uri_parsed.get('Bucket'),
-            'source_key': source_s3_uri_parsed.get('Key'),
-            'destination_bucket': destination_s3_uri_parsed.get('Bucket'),
-            'destination_key': destination_s3_uri_parsed.get('Key')
+            'source_bucket': source_bucket,
+            'source_key': source_key,
+            'destination_bucket': destination_bucket,
+            'destination_key': destination_key,
+            **file_properties
         }
 
     def _get_files_to_move(self):
         '''
-        Returns list of objects to move.
+        Returns list of objects to move. Audits that can't be parsed are
+        logged and skipped.
         '''
         files_to_move = []
         parsed_audits = self.eph.get_files_in_incorrect_bucket()
         for p in parsed_audits:
-            files_to_move.append(
-                self._parse_audit_details_for_source_and_destination(p)
-            )
+            try:
+                files_to_move.append(
+                    self._parse_audit_details_for_source_and_destination(p)
+                )
+            except AuditDetailError as e:
+                log.error(e)
         log.warning('Got {} files to move'.format(len(files_to_move)))
+        self.metrics.inc('files_to_move', len(files_to_move))
+        skipped = len(parsed_audits) - len(files_to_move)
+        if skipped:
+            log.warning('Skipped {} malformed audits'.format(skipped))
+            self.metrics.inc('malformed_audits', skipped)
         return files_to_move
 
     def _make_bucket_update_url(self, accession):
@@ -230,10 +761,28 @@ class EncodeFileTransfer():
         )
         return r
 
-    def _wait_for_indexer(self, times=[0, 120, 240]):
+    def _get_indexer_wait_times(self):
+        '''
+        Yields seconds to sleep before each indexer check: none before the
+        first, then exponential backoff with jitter until the deadline.
+        '''
+        yield 0
+        delay = self.indexer_wait_initial
+        waited = 0
+        while waited < self.indexer_wait_deadline:
+            t = min(delay, self.indexer_wait_max)
+            t = random.uniform(t * (1 - self.indexer_wait_jitter), t)
+            t = min(t, self.indexer_wait_deadline - waited)
+            waited += t
+            yield t
+            delay *= self.indexer_wait_factor
+
+    def _wait_for_indexer(self, times=None):
         '''
         Only wait for indexer for so long before giving up.
         '''
+        if times is None:
+            times = self._get_indexer_wait_times()
         for t in times:
             time.sleep(t)
             if not self.eph.is_indexing():
@@ -249,6 +798,22 @@ class EncodeFileTransfer():
             f['source_bucket'] = PUBLIC_BUCKET
         return f
 
+    def _build_inventory(self, files_to_move):
+        '''
+        List every bucket prefix _determine_source might check so existence
+        checks don't need a HEAD per file.
+        '''
+        bucket_keys = set()
+        for f in files_to_move:
+            sb, sk, db, dk = self.s3h._parse_file_to_move(f)
+            bucket_keys.update([(sb, sk), (db, dk), (self.original_bucket, sk)])
+            if self.initial_transfer:
+                bucket_keys.add((PUBLIC_BUCKET, sk))
+        inventory = BucketInventory(self.s3h._get_client())
+        inventory.list_keys(bucket_keys, workers=self.workers)
+        self.s3h.inventory = inventory
+        return inventory
+
     def _determine_source(self, f):
         '''
         Pick up failures if they have occured.
@@ -274,61 +839,481 @@ class EncodeFileTransfer():
             return False
         return f
 
+    def _count_source_requests(self, f, resolved):
+        '''
+        HEAD requests _determine_source makes for f: one for each bucket
+        it checks that the inventory doesn't cover.
+        '''
+        sb, sk, db, dk = self.s3h._parse_file_to_move(f)
+        candidates = [(sb, sk), (db, dk), (self.original_bucket, sk)]
+        if resolved:
+            source = (resolved['source_bucket'], resolved['source_key'])
+            candidates = candidates[:candidates.index(source) + 1]
+        return sum(
+            1 for bucket, key in candidates
+            if self.s3h._lookup_inventory(bucket, key) is None
+        )
+
+    def _plan_file(self, f):
+        '''
+        Resolves the source like a sync would and returns the steps the
+        sync would take for f with object size and estimated number of S3
+        requests to copy, verify and tag it. Only reads from S3.
+        '''
+        resolved = self._determine_source(dict(f))
+        plan = {
+            'accession': f['accession'],
+            'status': f.get('status'),
+            'action': 'missing',
+            'source_bucket': f['source_bucket'],
+            'source_key': f['source_key'],
+            'destination_bucket': f['destination_bucket'],
+            'destination_key': f['destination_key'],
+            'size': None,
+            'parts': 0,
+            's3_requests': self._count_source_requests(f, resolved),
+        }
+        if not resolved:
+            return plan
+        sb, sk, db, dk = self.s3h._parse_file_to_move(resolved)
+        plan.update(source_bucket=sb, source_key=sk)
+        steps = []
+        requests = plan['s3_requests']
+        same = sb == db and sk == dk
+        copied = same
+        if not copied and self.initial_transfer:
+            requests += 1
+            copied = self.s3h._file_exists(db, dk)
+        if not copied:
+            metadata = self.s3h._lookup_inventory(sb, sk)
+            if not metadata:
+                metadata = self.s3h._get_object_metadata(sb, sk)
+                requests += 1
+            plan['size'] = metadata['ContentLength']
+            plan['parts'] = self.s3h._get_copy_part_count(metadata)
+            # HEAD by the managed copy, plus CreateMultipartUpload and
+            # CompleteMultipartUpload around the parts.
+            requests += 1 + plan['parts'] + (2 if plan['parts'] > 1 else 0)
+            if self.s3h.verify and self.s3h._get_part_count(metadata.get('ETag')):
+                requests += 1
+            steps.append('copy')
+        # Verified even when initial_transfer found it already copied.
+        if not same and self.s3h.verify:
+            requests += 2
+            steps.append('verify')
+        if sb == self.original_bucket:
+            requests += 1
+            steps.append('tag')
+        if self.s3h._should_delete(resolved):
+            steps.append('delete')
+        steps.append('patch')
+        plan['action'] = '+'.join(steps)
+        plan['s3_requests'] = requests
+        return plan
+
+    @staticmethod
+    def _summarize_plan(plan):
+        '''
+        Totals of a plan: files per action, bytes and files per source and
+        destination bucket pair and estimated requests, with DeleteObjects
+        batched per source bucket.
+        '''
+        actions = {}
+        bucket_pairs = {}
+        deletes = {}
+        for p in plan:
+            actions[p['action']] = actions.get(p['action'], 0) + 1
+            if p['action'] == 'missing':
+                continue
+            pair = '{} -> {}'.format(p['source_bucket'], p['destination_bucket'])
+            totals = bucket_pairs.setdefault(pair, {'files': 0, 'bytes': 0})
+            totals['files'] += 1
+            totals['bytes'] += p['size'] or 0
+            if 'delete' in p['action'].split('+'):
+                deletes[p['source_bucket']] = deletes.get(p['source_bucket'], 0) + 1
+        delete_requests = sum(-(-n // DELETE_BATCH_SIZE) for n in deletes.values())
+        return {
+            'files': len(plan),
+            'actions': dict(sorted(actions.items())),
+            'bytes': sum(totals['bytes'] for totals in bucket_pairs.values()),
+            'bucket_pairs': dict(sorted(bucket_pairs.items())),
+            'requests': {
+                's3': sum(p['s3_requests'] for p in plan) + delete_requests,
+                's3_delete': delete_requests,
+                'portal_patch': sum(1 for p in plan if p['action'].endswith('patch')),
+            },
+        }
+
+    def plan_transfers(self):
+        '''
+        Returns what sync_buckets_and_portal would do without copying,
+        tagging, deleting or patching anything: {'summary': totals,
+        'files': per file plan}. Sources are resolved concurrently.
+        '''
+        try:
+            files_to_move = self._get_files_to_move()
+            if self.use_inventory:
+                self._build_inventory(files_to_move)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                plan = list(executor.map(self._plan_file, files_to_move))
+            summary = self._summarize_plan(plan)
+            log.warning(
+                'Planned {} files, {} bytes, about {} S3 requests: {}'.format(
+                    summary['files'],
+                    summary['bytes'],
+                    summary['requests']['s3'],
+                    summary['actions']
+                )
+            )
+            return {'summary': summary, 'files': plan}
+        finally:
+            self._write_metrics('plan')
+
+    @staticmethod
+    def write_plan(plan, filename):
+        '''
+        Writes plan as JSON if filename ends with .json, otherwise the per
+        file plan as TSV.
+        '''
+        if str(filename).endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump(plan, f, indent=2)
+            return
+        fields = [
+            'accession',
+            'status',
+            'action',
+            'source_bucket',
+            'source_key',
+            'destination_bucket',
+            'destination_key',
+            'size',
+            'parts',
+            's3_requests',
+        ]
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fields, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(plan['files'])
+
+    def _get_manifest_outputs(self, filename):
+        '''
+        Returns {key: output} for the extra manifest formats, written
+        next to filename.
+        '''
+        outputs = {}
+        directory = os.path.dirname(filename)
+        for manifest_format in self.manifest_formats:
+            key = MANIFEST_FORMATS[manifest_format]
+            path = os.path.join(directory, key)
+            if manifest_format == 'parquet':
+                outputs[key] = ParquetOutput(path)
+            else:
+                outputs[key] = TsvOutput(path, compression=manifest_format)
+        return outputs
+
     def _make_metadata_tsv(self, parsed_metadata, filename):
-        log.warning('Dumping metadata to {}'.format(filename))
-        df = pd.DataFrame(parsed_metadata)
-        df = df.sort_values(
-            by=[
-                'file_set.accession',
-                'assembly',
-                'file_format'
-            ]
-        ).reset_index(drop=True)
-        df[self.eph.file_metadata_fields].to_csv(filename, sep='\t', index=False)
+        '''
+        Parsed_metadata can be any iterable of rows, e.g. a generator
+        streaming rows from the portal. Extra manifest formats are
+        written from the same rows.
+        '''
+        writer = ManifestWriter(
+            self.eph.file_metadata_fields,
+            buffer_size=self.manifest_buffer_size
+        )
+        outputs = self._get_manifest_outputs(filename)
+        with self.metrics.timer('manifest_write'):
+            count = writer.write(parsed_metadata, filename, outputs=outputs.values())
+        self.metrics.inc('manifest_rows', count)
+        log.warning('Wrote {} files to {}'.format(count, filename))
+        return count
+
+    def _upload_manifests(self, filename):
+        self.s3h._upload_file_metadata(filename, force=self.force_upload)
+        for key, output in self._get_manifest_outputs(filename).items():
+            self.s3h._upload_file_metadata(output.filename, force=self.force_upload, key=key)
+
+    def _update_snapshot(self, snapshot):
+        '''
+        Brings snapshot up to date with the portal, only querying files
+        modified since the last run unless a full refresh is due.
+        '''
+        now = datetime.now(timezone.utc)
+        since = (now - timedelta(hours=INCREMENTAL_OVERLAP_HOURS)).isoformat()
+        if snapshot.needs_full_refresh(timedelta(days=INCREMENTAL_FULL_REFRESH_DAYS)):
+            count = snapshot.replace(self.eph.iter_file_metadata(), since)
+            log.warning('Refreshed snapshot with {} files'.format(count))
+            return
+        changed_ids = set()
+
+        def changed_rows():
+            for row in self.eph.iter_file_metadata(modified_since=snapshot.since):
+                changed_ids.add(row['@id'])
+                yield row
+
+        # Modified files that no longer match the manifest query, e.g.
+        # files that are no longer released. Evaluated after all changed
+        # rows have been consumed.
+        removed_ids = (
+            file_id
+            for file_id in self.eph.iter_modified_file_ids(snapshot.since)
+            if file_id not in changed_ids
+        )
+        upserted, removed = snapshot.update(changed_rows(), removed_ids, since)
+        log.warning(
+            'Updated snapshot with {} changed and {} removed files'.format(
+                upserted,
+                removed
+            )
+        )
+
+    def _make_incremental_metadata_tsv(self, filename):
+        snapshot = ManifestSnapshot(self.snapshot_path, self.eph.file_metadata_fields)
+        try:
+            self._update_snapshot(snapshot)
+            return self._make_metadata_tsv(snapshot.rows(), filename)
+        finally:
+            snapshot.close()
+
+    def _write_metrics(self, run):
+        self.metrics.run = run
+        self.metrics.log_summary()
+        if self.metrics_file:
+            self.metrics.write_json(self.metrics_file)
+        if self.prometheus_file:
+            self.metrics.write_prometheus(self.prometheus_file)
 
     def dump_file_metadata_to_s3(self):
+        try:
+            return self._dump_file_metadata_to_s3()
+        finally:
+            self.eph.close()
+            self._write_metrics('metadata')
+
+    def _dump_file_metadata_to_s3(self):
         if not self._wait_for_indexer():
             return False
-        parsed_metadata = self.eph.get_file_metadata()
-        self._make_metadata_tsv(
-            parsed_metadata,
-            LOCAL_METADATA_TSV
+        if self.incremental:
+            self._make_incremental_metadata_tsv(self.manifest_path)
+        else:
+            self._make_metadata_tsv(
+                self.eph.iter_file_metadata(),
+                self.manifest_path
+            )
+        self._upload_manifests(self.manifest_path)
+
+    def _record_step(self, f, step, redo=None):
+        if self.journal is not None:
+            self.journal.record(f, step, redo=redo)
+
+    def _sync_file(self, i, f):
+        '''
+        Run the copy steps for a single file in order. Steps for different
+        files are independent so this can run concurrently. Returns the
+        file to delete and patch, or False to skip it. Steps already in
+        the journal are skipped.
+        '''
+        log.warning(
+            '\n{}\t{}\t{}\t{}'.format(
+                i,
+                f['accession'],
+                f['status'],
+                datetime.now()
+            )
+        )
+        completed = self.journal.completed(f) if self.journal is not None else set()
+        resolved = self.journal.resolved(f) if self.journal is not None else None
+        if resolved:
+            f = resolved
+        else:
+            # Check for previous incomplete transfers.
+            with self.metrics.timer('determine_source'):
+                f = self._determine_source(f)
+            # The file doesn't exist in any bucket, so skip and clean up audit later.
+            if not f:
+                self.metrics.inc('files_not_found')
+                return False
+            self._record_step(f, TransferJournal.RESOLVED)
+        if TransferJournal.COPIED not in completed:
+            # Move file to destination.
+            self.s3h._move_file(f, self.initial_transfer)
+            self._record_step(f, TransferJournal.COPIED)
+        # Check destination before the source can be deleted.
+        if self.s3h.verify and TransferJournal.VERIFIED not in completed:
+            try:
+                with self.metrics.timer('verify'):
+                    self.s3h._verify_copy(f)
+            except Exception:
+                # The copy can't be trusted, so copy again next run.
+                self._record_step(f, TransferJournal.FAILED, redo=TransferJournal.COPIED)
+                raise
+            self._record_step(f, TransferJournal.VERIFIED)
+        if TransferJournal.TAGGED not in completed:
+            # Tag original file for glacier storage.
+            self.s3h._tag_file(f)
+            self._record_step(f, TransferJournal.TAGGED)
+        return f
+
+    def _record_failure(self, f, e):
+        log.error('Exception on {}: {!r}'.format(f, e))
+        self.metrics.inc('files_failed')
+        self._record_step(f, TransferJournal.FAILED)
+        with self._failures_lock:
+            self.failures[f['accession']] = e
+
+    def _submit_delete(self, deleter, f):
+        if self.journal is not None and TransferJournal.DELETED in self.journal.completed(f):
+            future = Future()
+            future.set_result(False)
+            return future
+        return deleter.submit(f)
+
+    def _patch_file(self, f):
+        r = self._update_bucket_on_portal(f)
+        self._record_step(f, TransferJournal.PATCHED)
+        self.metrics.inc('files_synced')
+        return r
+
+    def _patch_after_delete(self, updater, patches, f, delete_future):
+        '''
+        Only patch the portal once the source is deleted (or didn't need
+        deleting), otherwise the next run retries the file. Runs as a done
+        callback, which swallows exceptions, so every error is recorded
+        as a failure of f.
+        '''
+        try:
+            delete_future.result()
+            self._record_step(f, TransferJournal.DELETED)
+            patches.append((f, updater.submit(f)))
+        except Exception as e:
+            self._record_failure(f, e)
+
+    def _delete_and_patch(self, deleter, updater, patches, f):
+        self._submit_delete(deleter, f).add_done_callback(
+            partial(self._patch_after_delete, updater, patches, f)
         )
-        self.s3h._upload_file_metadata()
+
+    def _get_file_size(self, f):
+        '''
+        Size from the portal, or the inventory if it has the source.
+        '''
+        if f.get('file_size') is not None:
+            return f['file_size']
+        sb, sk, _, _ = self.s3h._parse_file_to_move(f)
+        metadata = self.s3h._lookup_inventory(sb, sk)
+        return metadata['ContentLength'] if metadata else None
+
+    def _make_scheduler(self):
+        return SizeScheduler(
+            self.workers,
+            large_threshold=self.large_file_threshold,
+            large_workers=self.large_file_workers,
+            get_size=self._get_file_size,
+        )
+
+    def _wait_for_sync(self):
+        '''
+        Returns whether to delete and patch each file as soon as it is
+        copied (True), only after all copies and a wait for the indexer
+        (False) or not to sync at all (None).
+        '''
+        if not self.s3_while_indexing:
+            return True if self._wait_for_indexer() else None
+        if self._wait_for_indexer(times=[0]):
+            return True
+        log.warning('Copying files while portal indexes')
+        return False
 
     def sync_buckets_and_portal(self):
         '''
-        Pull files with incorrect bucket audit.
+        Pull files with incorrect bucket audit. Files are copied and tagged
+        by a pool of workers, source objects are deleted in batches and
+        the portal is patched by a separate rate limited stage once a
+        file's delete succeeds. With s3_while_indexing files are copied
+        even if the portal is indexing and deletes and patches wait for
+        the indexer. Failures are collected per file rather than stopping
+        the run on the first exception.
         '''
-        if not self._wait_for_indexer():
+        try:
+            return self._sync_buckets_and_portal()
+        finally:
+            self._write_metrics('sync')
+
+    def _sync_buckets_and_portal(self):
+        indexer_idle = self._wait_for_sync()
+        if indexer_idle is None:
             return False
         files_to_move = self._get_files_to_move()
+        if self.use_inventory:
+            self._build_inventory(files_to_move)
+        self.failures = {}
+        self.deferred = []
+        patches = []
+        if self.journal_path:
+            self.journal = TransferJournal(self.journal_path)
+        updater = PortalUpdater(
+            self._patch_file,
+            workers=self.patch_workers,
+            rate=self.patch_rate,
+            burst=self.patch_burst,
+        )
         try:
-            for i, f in enumerate(files_to_move):
-                log.warning(
-                    '\n{}\t{}\t{}\t{}'.format(
-                        i,
-                        f['accession'],
-                        f['status'],
-                        datetime.now()
-                    )
-                )
-                # Check for previous incomplete transfers.
-                f = self._determine_source(f)
-                # The file doesn't exist in any bucket, so skip and clean up audit later.
-                if not f:
-                    continue
-                # Move file to destination.
-                self.s3h._move_file(f, self.initial_transfer)
-                # Tag original file for glacier storage.
-                self.s3h._tag_file(f)
-                # Delete file from source.
-                self.s3h._delete_file(f)
-                # Patch portal with new bucket.
-                self._update_bucket_on_portal(f)
-        except Exception as e:
-            log.exception('Exception on {}'.format(f))
-            raise
+            with self._make_scheduler() as scheduler:
+                deleter = s3BatchDeleter(self.s3h)
+                futures = scheduler.map(self._sync_file, files_to_move)
+                for future in as_completed(futures):
+                    f = futures[future]
+                    try:
+                        f = future.result()
+                    except Exception as e:
+                        self._record_failure(f, e)
+                        continue
+                    if not f:
+                        continue
+                    if indexer_idle:
+                        self._delete_and_patch(deleter, updater, patches, f)
+                    else:
+                        self.deferred.append(f)
+                if self.deferred and self._wait_for_indexer():
+                    for f in self.deferred:
+                        self._delete_and_patch(deleter, updater, patches, f)
+                    self.deferred = []
+                # Delete whatever is left in partial batches.
+                deleter.flush()
+            for f, future in patches:
+                try:
+                    future.result()
+                except Exception as e:
+                    self._record_failure(f, e)
         finally:
+            updater.shutdown()
+            # Patched files change both the audits and the manifest.
+            if patches and self.eph.cache is not None:
+                self.eph.cache.clear()
+            if self.journal is not None:
+                # Nothing left to resume after a clean run.
+                if not self.failures and not self.deferred:
+                    self.journal.reset()
+                self.journal.close()
+                self.journal = None
             print('Done')
-        return True
+        if self.deferred:
+            self.metrics.inc('files_deferred', len(self.deferred))
+            log.warning(
+                'Portal still indexing, left {} copied files to delete and patch next run'.format(
+                    len(self.deferred)
+                )
+            )
+        if self.failures:
+            log.warning(
+                'Failed to sync {} of {} files: {}'.format(
+                    len(self.failures),
+                    len(files_to_move),
+                    list(self.failures)
+                )
+            )
+            raise RuntimeError(
+                '{} files failed to sync'.format(len(self.failures))
+            )
+        return not self.deferred